@@ -0,0 +1,1093 @@
+#!/usr/bin/env python3
+import io
+import os
+import json
+import math
+import sys
+import contextlib
+import re
+import time
+import random
+import argparse
+import threading
+import tracemalloc
+import http.client
+import tempfile
+import subprocess
+import importlib.util
+from collections import defaultdict
+from datetime import datetime, timedelta
+from fake_aprs_is_log import iter_packet_lines, iter_records, rotate_log, LogFollower
+from fake_aprs_is_store import PacketStore
+
+# Other packet types for write_synthetic_log(varied=True), as (format, share of packets)
+varied_packets = [
+    (">Net control on 146.520 {station}", 0.05),
+    ("_10090556c220s004g005t0{temp}r000p000P000h50b09900wRSW", 0.10),
+    ("T#{seq:03d},199,000,255,073,123,01101001", 0.05),
+    (":N{station}XYZ   :Message number {seq}{{{seq:02d}", 0.05),
+    (";OBJ{station:<6}*092345z4903.50N/07201.75W>088/036 Object", 0.05),
+]
+
+def write_synthetic_log(path, lines, clients=3, stations=200, seed=1, varied=False):
+    """Write a log shaped like the collector's: iGates relaying beacons, with keepalives mixed in.
+
+    With varied=True, some packets are status, weather, telemetry, message and object packets.
+    """
+    rng = random.Random(seed)
+    timestamp = datetime.now() - timedelta(seconds=lines)
+    with open(path, 'w') as log_file:
+        for _ in range(lines):
+            timestamp += timedelta(microseconds=rng.randrange(2000000))
+            client_ip = f"192.168.1.{10 + rng.randrange(clients)}"
+            if rng.random() < 0.03:
+                message = "Sent keepalive"
+            else:
+                station = rng.randrange(stations)
+                body = f"!3327.{station % 100:02d}N/11204.{station % 97:02d}W-PHG2360 U=12.{rng.randrange(10)}V"
+                if varied:
+                    pick = rng.random()
+                    for packet_format, share in varied_packets:
+                        if pick < share:
+                            body = packet_format.format(station=station, temp=rng.randrange(50, 99), seq=rng.randrange(1000))
+                            break
+                        pick -= share
+                message = f"Received packet: N{station}XYZ-{station % 16}>APRS,WIDE1-1,qAR,GATE{client_ip[-1]}:{body}"
+            log_file.write(f"{timestamp.isoformat()} - {client_ip} - {message}\n")
+
+def load_tool(filename):
+    """Import one of the hyphen-named tool scripts as a module."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+    spec = importlib.util.spec_from_file_location(filename[:-3].replace("-", "_"), path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module  # So pool workers can unpickle references to its functions
+    spec.loader.exec_module(module)
+    return module
+
+def measure(name, lines, parse, repeat=3):
+    """Time `parse` over the lines, keeping the best of a few passes, and print lines/sec."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parsed = parse(lines)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"  {name:<48} {len(lines) / best:>12,.0f} lines/sec  ({parsed} parsed)")
+
+def bench_parser(args):
+    """Compare the per-tool parsing the readers used to do with the shared log parser."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_path = os.path.join(temp_dir, "fake-aprs-is.log")
+        write_synthetic_log(log_path, args.lines)
+        with open(log_path, 'r') as log_file:
+            lines = log_file.readlines()
+
+    status_pattern = re.compile(r'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d+)\s-\s([\d.]+)\s-\s(.+)')
+
+    def client_status_before(lines):
+        count = 0
+        for line in lines:
+            match = status_pattern.match(line)
+            if match:
+                datetime.fromisoformat(match.group(1))
+                count += 1
+        return count
+
+    def decoder_before(lines):
+        count = 0
+        for line in lines:
+            line = line.strip()
+            if "Received packet:" in line:
+                timestamp_str, client_ip, packet_line = line.split(" - ", 2)
+                datetime.fromisoformat(timestamp_str)
+                packet_line.split("Received packet: ", 1)[1].strip()
+                count += 1
+        return count
+
+    def graphs_before(lines):
+        count = 0
+        for line in lines:
+            match = re.match(r'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d+) - ', line)
+            if match:
+                datetime.strptime(match.group(1), "%Y-%m-%dT%H:%M:%S.%f")
+                count += 1
+        return count
+
+    def forwarder_before(lines):
+        count = 0
+        for line in lines:
+            if re.search(r'Received packet: (.+)', line.strip()):
+                count += 1
+        return count
+
+    def split_to_epoch_before(lines):
+        # What the readers would need to produce the same (epoch, source, message) records
+        count = 0
+        for line in lines:
+            timestamp_str, client_ip, message = line.split(" - ", 2)
+            datetime.fromisoformat(timestamp_str).timestamp()
+            message.strip()
+            count += 1
+        return count
+
+    def shared_parser(lines):
+        return sum(1 for _ in iter_records(lines))
+
+    def packet_lines(lines):
+        return sum(1 for _ in iter_packet_lines(lines))
+
+    print(f"Parsing {len(lines):,} synthetic log lines")
+    print(" Before:")
+    measure("client-status (regex + fromisoformat)", lines, client_status_before)
+    measure("decoder (split + fromisoformat)", lines, decoder_before)
+    measure("graphs (regex + strptime)", lines, graphs_before)
+    measure("serial forwarder (re.search)", lines, forwarder_before)
+    measure("split + fromisoformat + timestamp()", lines, split_to_epoch_before)
+    print(" After:")
+    measure("fake_aprs_is_log.iter_records", lines, shared_parser)
+    measure("fake_aprs_is_log.iter_packet_lines", lines, packet_lines)
+
+def synthetic_client_packets(packets, clients, stations=200, seed=1):
+    """Per-client (timestamp_us, packet, normalized) lists with packets heard by several iGates."""
+    rng = random.Random(seed)
+    client_packets = defaultdict(list)
+    timestamp = int(time.time() * 1000000) - packets * 1000000
+    for _ in range(packets):
+        timestamp += rng.randrange(1000000)
+        station = rng.randrange(stations)
+        normalized = f"N{station}XYZ>APRS,WIDE1-1:!3327.{station % 100:02d}N/11204.{station % 97:02d}W-"
+        # Each beacon reaches one or more iGates, each logging it a little later than the last
+        heard_at = timestamp
+        for client in rng.sample(range(clients), 1 + rng.randrange(min(clients, 3))):
+            heard_at += rng.randrange(1500000)
+            packet = normalized.replace(":", f",qAR,GATE{client}:", 1)
+            client_packets[f"192.168.1.{10 + client}"].append((heard_at, f"Received packet: {packet}", normalized))
+    for entries in client_packets.values():
+        entries.sort()
+    return dict(client_packets)
+
+def find_identical_packets_before(client_packets, window_us=1000000):
+    """The pairwise comparison client-status used before the windowed join."""
+    return {
+        client: [
+            any(
+                abs(timestamp - other_timestamp) <= window_us and normalized_packet == other_packet
+                for other_client, other_packets in client_packets.items()
+                if other_client != client
+                for other_timestamp, _, other_packet in other_packets
+            )
+            for timestamp, _, normalized_packet in packets
+        ]
+        for client, packets in client_packets.items()
+    }
+
+def baseline_source(filename, rev=None):
+    """Return a tool script as it was in `rev`, by default the repository's first commit."""
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    if rev is None:
+        rev = subprocess.run(["git", "-C", repo_dir, "rev-list", "--max-parents=0", "HEAD"],
+                             capture_output=True, text=True, check=True).stdout.split()[0]
+    return subprocess.run(["git", "-C", repo_dir, "show", f"{rev}:{filename}"],
+                          capture_output=True, text=True, check=True).stdout
+
+def bench_status(args):
+    """Check the windowed join against the pairwise comparison and time both, then the reports end to end."""
+    client_status = load_tool("fake-aprs-is-client-status.py")
+    client_packets = synthetic_client_packets(args.packets, args.clients)
+    total = sum(len(packets) for packets in client_packets.values())
+    print(f"Classifying {total:,} packets from {len(client_packets)} clients")
+
+    timings = {}
+    results = {}
+    for name, find in (("pairwise (before)", find_identical_packets_before),
+                       ("windowed join", client_status.find_identical_packets)):
+        start = time.perf_counter()
+        results[name] = find(client_packets)
+        timings[name] = time.perf_counter() - start
+        identical = sum(sum(flags) for flags in results[name].values())
+        print(f"  {name:<24} {timings[name]:>10.3f} s  ({identical:,} identical, {total - identical:,} unique)")
+
+    before, after = results.values()
+    if before != after:
+        mismatched = sum(a != b for client in before for a, b in zip(before[client], after[client]))
+        raise SystemExit(f"Mismatch: {mismatched} packet(s) classified differently")
+    print(f"  Identical results, {timings['pairwise (before)'] / timings['windowed join']:,.0f}x faster")
+
+    # A log ending now, with nothing logged within a minute of either window start,
+    # so the reports agree however long each run takes
+    windows = (600, 300)
+    now = time.time()
+    log_packets = synthetic_client_packets(args.log_packets, args.clients, seed=2)
+    lines = sorted(
+        (timestamp / 1000000, client, packet)
+        for client, packets in log_packets.items()
+        for index, (timestamp, packet, _) in enumerate(packets)
+        for packet in ((packet, "Sent keepalive") if index % 40 == 0 else (packet,))
+    )
+    shift = now - 5 - lines[-1][0]
+    lines = [
+        f"{datetime.fromtimestamp(epoch + shift).isoformat()} - {client} - {packet}\n"
+        for epoch, client, packet in lines
+        if all(abs(epoch + shift - (now - window)) > 60 for window in windows)
+    ]
+    print(f"\nReports from a {len(lines):,} line log, the baseline script's against --state runs")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        client_status.log_file_path = log_path = os.path.join(temp_dir, "fake-aprs-is.log")
+        state_path = os.path.join(temp_dir, "client-status.state")
+        # The baseline only reads the one file it is pointed at, so it gets everything logged so far in one
+        baseline_log_path = os.path.join(temp_dir, "baseline.log")
+        baseline_path = os.path.join(temp_dir, "client-status-baseline.py")
+        with open(baseline_path, 'w') as baseline_file:
+            baseline_file.write(baseline_source("fake-aprs-is-client-status.py", args.baseline).replace(
+                "/home/lighthouse/fake-aprs-is/fake-aprs-is-logs/fake-aprs-is.log", baseline_log_path))
+
+        first, second = len(lines) * 3 // 5, len(lines) * 4 // 5
+        stages = (
+            ("first run", windows[0], lines[:first], False),
+            ("appended lines", windows[0], lines[first:second], False),
+            ("rotated log", windows[0], lines[second:], True),
+            ("shorter window", windows[1], [], False),
+        )
+        for stage, window, new_lines, rotate in stages:
+            if rotate:
+                rotate_log(log_path)
+            for path in (log_path, baseline_log_path):
+                with open(path, 'a') as log_file:
+                    log_file.writelines(new_lines)
+            for flags in ([], ["-u"], ["-i"], ["-u", "-i"]):
+                argv = ["-d", f"{window // 60}min"] + flags
+                expected = subprocess.run([sys.executable, baseline_path] + argv, capture_output=True, text=True, check=True).stdout
+                output = io.StringIO()
+                with contextlib.redirect_stdout(output):
+                    client_status.main(argv + ["--state", state_path])
+                if output.getvalue() != expected:
+                    raise SystemExit(f"Mismatch after the {stage}: {' '.join(argv)} printed a different report")
+            print(f"  {stage:<24} same output for -d {window // 60}min, -u and -i ({expected.count(chr(10)):,} lines)")
+
+def bench_decoder(args):
+    """Time the decoder without and with its cache, then with a growing process pool, checking the output stays the same."""
+    decoder = load_tool("fake-aprs-is-decoder.py")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_path = os.path.join(temp_dir, "fake-aprs-is.log")
+        write_synthetic_log(log_path, args.lines)
+        with open(log_path, 'r') as log_file:
+            lines = log_file.readlines()
+
+    options = {"filter_type": args.type, "search_term": args.search}
+    print(f"Decoding {len(lines):,} synthetic log lines")
+    decoder.init_worker(options, cache_size=0)
+    start = time.perf_counter()
+    expected, _ = decoder.decode_batch(lines)
+    uncached = time.perf_counter() - start
+    print(f"  {'no cache':<12} {len(lines) / uncached:>12,.0f} lines/sec")
+
+    decoder.init_worker(options, cache_size=args.cache_size)
+    start = time.perf_counter()
+    output, (_, stats) = decoder.decode_batch(lines)
+    serial = time.perf_counter() - start
+    if output != expected:
+        raise SystemExit("Mismatch: decoding with the cache changed the output")
+    print(
+        f"  {'serial':<12} {len(lines) / serial:>12,.0f} lines/sec  ({uncached / serial:.2f}x, "
+        f"{stats['hits']:,} hits, {stats['misses']:,} misses, {stats['evictions']:,} evictions)"
+    )
+
+    jobs = 2
+    while jobs <= args.max_jobs:
+        start = time.perf_counter()
+        output = "".join(decoder.decode_parallel(lines, options, jobs, args.chunk_size, args.cache_size))
+        elapsed = time.perf_counter() - start
+        if output != expected:
+            raise SystemExit(f"Mismatch: --jobs {jobs} output differs from the serial decoder")
+        print(f"  {f'--jobs {jobs}':<12} {len(lines) / elapsed:>12,.0f} lines/sec  ({serial / elapsed:.2f}x serial)")
+        jobs *= 2
+
+def bench_prefilter(args):
+    """Time narrow --type/--search queries with and without the decoder's prefilter, checking the output is the same."""
+    decoder = load_tool("fake-aprs-is-decoder.py")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        log_path = os.path.join(temp_dir, "fake-aprs-is.log")
+        write_synthetic_log(log_path, args.lines, varied=True)
+        with open(log_path, 'r') as log_file:
+            lines = log_file.readlines()
+
+    print(f"Querying {len(lines):,} synthetic log lines")
+    queries = [("-t weather", "weather", None), ("-t status", "status", None),
+               ("-s N42XYZ", None, "N42XYZ"), ("-t message -s N7XYZ", "message", "N7XYZ"),
+               ("-s position (no prefilter possible)", None, "position")]
+    for name, filter_type, search_term in queries:
+        timings = []
+        outputs = []
+        for prefilter in (None, decoder.Prefilter(filter_type, search_term)):
+            options = {"filter_type": filter_type, "search_term": search_term, "prefilter": prefilter}
+            decoder.init_worker(options, cache_size=0)  # Cache off, to time the parsing the prefilter saves
+            start = time.perf_counter()
+            output, _ = decoder.decode_batch(lines)
+            timings.append(time.perf_counter() - start)
+            outputs.append(output)
+        if outputs[0] != outputs[1]:
+            raise SystemExit(f"Mismatch: prefilter changed the output of {name}")
+        print(f"  {name:<40} {timings[0]:>8.2f} s -> {timings[1]:>6.2f} s  ({timings[0] / timings[1]:.1f}x)")
+
+def bench_store(args):
+    """Time decoder queries answered from the log and from the SQLite store, checking the output is the same."""
+    decoder = load_tool("fake-aprs-is-decoder.py")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        decoder.log_file_path = os.path.join(temp_dir, "fake-aprs-is.log")
+        write_synthetic_log(decoder.log_file_path, args.lines, varied=True)
+        with open(decoder.log_file_path, 'r') as log_file:
+            lines = log_file.readlines()
+        store = PacketStore(os.path.join(temp_dir, "packets.db"))
+        decoder.decode_cache = decoder.DecodeCache()
+
+        start = time.perf_counter()
+        added = decoder.ingest_log(store)
+        print(f"Ingested {added:,} of {args.lines:,} synthetic log lines in {time.perf_counter() - start:.2f} s")
+
+        duration = timedelta(days=1)
+        queries = [("-t weather", "weather", None), ("-s N42XYZ", None, "N42XYZ"), ("-t message -s N7XYZ", "message", "N7XYZ")]
+        for name, filter_type, search_term in queries:
+            timings = []
+            outputs = []
+            for query in (
+                lambda: decoder.decode_lines(lines, duration, filter_type, search_term),
+                lambda: decoder.query_store(store, duration, filter_type, search_term),
+            ):
+                decoder.decode_cache = decoder.DecodeCache(0)
+                output = io.StringIO()
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(output):
+                    query()
+                timings.append(time.perf_counter() - start)
+                outputs.append(output.getvalue())
+            if outputs[0] != outputs[1]:
+                raise SystemExit(f"Mismatch: the store answered {name} differently")
+            print(f"  {name:<24} log {timings[0]:>7.2f} s, store {timings[1]:>6.3f} s  ({timings[0] / timings[1]:,.0f}x)")
+        store.close()
+
+def synthetic_raw_positions(count, stations=5000, seed=1):
+    """Position beacons of many stations, each also relayed by a second iGate, as (callsign, raw packet)."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        station = rng.randrange(stations)
+        raw = f"N{station}XYZ>APRS,WIDE1-1,qAR,GATE{rng.randrange(3)}:!3327.{rng.randrange(100):02d}N/11204.{rng.randrange(100):02d}W-"
+        yield f"N{station}XYZ", raw
+
+def synthetic_positions(web, count, stations=5000, seed=1, epoch=0.0):
+    """Web map position records for synthetic_raw_positions()."""
+    for callsign, raw in synthetic_raw_positions(count, stations, seed):
+        yield web.PositionRecord(epoch, 33.45, -112.07, callsign, raw)
+
+def bench_history(args):
+    """Time web map inserts with the ring buffer against the list scan it replaced, checking both keep the same packets."""
+    web = load_tool("fake-aprs-is-web.py")
+    web.history_size = args.history
+    positions = list(synthetic_positions(web, args.packets))
+
+    def add_position_before(all_packets, position):
+        normalized_packet = web.normalize_packet(position.raw)
+        if any(web.normalize_packet(p.raw) == normalized_packet for p in all_packets):
+            return all_packets, False
+        all_packets.append(position)
+        if len(all_packets) > args.history:
+            all_packets = all_packets[-args.history:]
+        return all_packets, True
+
+    before = []
+    checked = min(len(positions), args.check)
+    start = time.perf_counter()
+    for position in positions[:checked]:
+        before, _ = add_position_before(before, position)
+    list_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for position in positions[:checked]:
+        web.add_position(position)
+    ring_time = time.perf_counter() - start
+    if list(web.all_packets) != before:
+        raise SystemExit("Mismatch: the ring buffer kept different packets than the list")
+    print(f"Adding {checked:,} positions with a {args.history:,} packet history")
+    print(f"  {'list scan (before)':<20} {checked / list_time:>12,.0f} inserts/sec")
+    print(f"  {'ring buffer':<20} {checked / ring_time:>12,.0f} inserts/sec  (same packets kept)")
+
+    start = time.perf_counter()
+    for position in positions[checked:]:
+        web.add_position(position)
+    if len(positions) > checked:
+        print(f"  {'ring buffer, rest':<20} {(len(positions) - checked) / (time.perf_counter() - start):>12,.0f} inserts/sec  ({len(web.all_packets):,} kept)")
+
+def bench_viewport(args):
+    """Time viewport queries on the web map's grid index against a scan of every position, checking both agree."""
+    web = load_tool("fake-aprs-is-web.py")
+    web.history_size = args.packets
+    rng = random.Random(1)
+    for n in range(args.packets):
+        # Most stations around a few cities, the rest anywhere
+        if rng.random() < 0.9:
+            lat, lon = rng.choice([(33.45, -112.07), (51.5, -0.12), (-33.87, 151.21)])
+            lat, lon = lat + rng.gauss(0, 2), lon + rng.gauss(0, 2)
+        else:
+            lat, lon = rng.uniform(-85, 85), rng.uniform(-180, 180)
+        station = rng.randrange(args.packets // 10 or 1)
+        web.add_position(web.PositionRecord(time.time(), lat, lon, f"N{station}XYZ", f"N{station}XYZ>APRS:{n}"))
+
+    views = {
+        "city": "-112.5,33.2,-111.6,33.7",
+        "region": "-118,30,-106,37",
+        "continent": "-130,20,-60,55",
+        "antimeridian": "170,-50,190,-20",
+        "world": "-540,-85,540,85",
+    }
+    print(f"Viewport queries over {len(web.all_packets):,} positions")
+    for name, bbox in views.items():
+        for last_updated_only in (False, True):
+            boxes = web.parse_bbox(bbox)
+
+            def scan():
+                positions = web.query_positions()  # Every position, as the server reads them without a bbox
+                if last_updated_only:
+                    positions = list({p.callsign: p for p in positions}.values())
+                return [p for p in positions if any(web.in_box(box, p) for box in boxes)]
+
+            def indexed():
+                return web.query_positions(boxes, last_updated_only)
+
+            expected, found = scan(), indexed()
+            if sorted(map(id, expected)) != sorted(map(id, found)):
+                raise SystemExit(f"Mismatch: the index found different positions for {name}")
+            timings = []
+            for query in (scan, indexed):
+                start = time.perf_counter()
+                for _ in range(args.repeat):
+                    query()
+                timings.append((time.perf_counter() - start) / args.repeat)
+            label = f"{name}{', last only' if last_updated_only else ''}"
+            print(f"  {label:<26} {len(found):>8,} found  scan {timings[0] * 1000:>8.2f} ms, index {timings[1] * 1000:>8.2f} ms")
+    for zoom in (3, 6, 8):
+        markers = web.cluster_positions(web.query_positions(web.parse_bbox(views["world"])), zoom)
+        print(f"  zoom {zoom}: {len(markers):,} markers for {sum(m['count'] if isinstance(m, dict) else 1 for m in markers):,} positions")
+
+def bench_serve(args):
+    """Poll the web map's HTTP server from concurrent clients, without and with the response cache."""
+    web = load_tool("fake-aprs-is-web.py")
+    web.history_size = args.packets
+    for position in synthetic_positions(web, args.packets, stations=args.packets // 5, epoch=time.time()):
+        web.add_position(position)
+    server = web.ThreadingHTTPServer(("127.0.0.1", 0), web.MapHTTPRequestHandler)
+    server.RequestHandlerClass.log_message = lambda *a: None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    queries = [
+        "/new_positions.json?time=all&callsigns=all&lastUpdatedOnly=false&bbox=-113,33,-111,34&zoom=13",
+        "/new_positions.json?time=60&callsigns=all&lastUpdatedOnly=true&bbox=-113,33,-111,34&zoom=13",
+        "/new_positions.json?time=all&callsigns=all&lastUpdatedOnly=false&bbox=-120,30,-100,40&zoom=6",
+    ]
+
+    def client(results, revalidate):
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        etags = {}
+        for n in range(args.requests):
+            query = queries[n % len(queries)]
+            headers = {"Accept-Encoding": "gzip"}
+            if revalidate and query in etags:
+                headers["If-None-Match"] = etags[query]
+            connection.request("GET", query, headers=headers)
+            response = connection.getresponse()
+            body = response.read()
+            etags[query] = response.getheader("ETag")
+            results.append(len(body))
+        connection.close()
+
+    print(f"{args.clients} clients polling {len(web.all_packets):,} positions, {args.requests} requests each")
+    for label, cache_size, revalidate in (("no cache", 0, False), ("response cache", 256, False), ("cache + If-None-Match", 256, True)):
+        web.response_cache_size = cache_size
+        web.response_cache.clear()
+        results = []
+        threads = [threading.Thread(target=client, args=(results, revalidate)) for _ in range(args.clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        print(f"  {label:<22} {len(results) / elapsed:>8,.0f} requests/sec  {sum(results) / len(results):>10,.0f} bytes/response")
+    server.shutdown()
+
+def bench_follow(args):
+    """Measure line latency and idle CPU of the web map's old readline/sleep loop and of LogFollower."""
+    def readline_loop(path, stop, arrived):
+        with open(path, "r") as log_file:
+            log_file.seek(0, 2)
+            while not stop.is_set():
+                line = log_file.readline()
+                if not line:
+                    time.sleep(0.1)
+                    continue
+                arrived(line)
+
+    def follower_loop(path, stop, arrived):
+        follower = LogFollower(path)
+        for lines in follower.batches():
+            for line in lines:
+                arrived(line)
+            if stop.is_set():
+                break
+        follower.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "fake-aprs-is.log")
+        open(path, "w").close()
+        print(f"{args.lines} lines written {args.interval * 1000:.0f} ms apart, then {args.idle:.0f} s idle")
+        for name, loop in (("readline + sleep (before)", readline_loop), ("LogFollower", follower_loop)):
+            latencies = []
+            stop = threading.Event()
+            reader = threading.Thread(target=loop, args=(path, stop, lambda line: latencies.append(time.perf_counter() - float(line))), daemon=True)
+            reader.start()
+            time.sleep(0.2)
+            with open(path, "a") as log_file:
+                for _ in range(args.lines):
+                    log_file.write(f"{time.perf_counter()}\n")
+                    log_file.flush()
+                    time.sleep(args.interval)
+            time.sleep(0.3)
+            start = time.process_time()
+            time.sleep(args.idle)
+            idle_cpu = time.process_time() - start
+            stop.set()
+            with open(path, "a") as log_file:
+                log_file.write(f"{time.perf_counter()}\n")  # Wake the follower so it sees the stop
+            reader.join()
+            latencies = sorted(latencies[:args.lines])
+            print(f"  {name:<26} latency mean {sum(latencies) / len(latencies) * 1000:>6.1f} ms, "
+                  f"max {latencies[-1] * 1000:>6.1f} ms, idle CPU {idle_cpu / args.idle * 100:.2f}%")
+
+def bench_backfill(args):
+    """Time the web map's warm start from the end of logs of growing size, against decoding the whole log forward."""
+    web = load_tool("fake-aprs-is-web.py")
+    web.backfill_minutes = 10 ** 6  # Bounded by --history only
+    with tempfile.TemporaryDirectory() as directory:
+        web.log_file_path = os.path.join(directory, "fake-aprs-is.log")
+        print(f"Backfilling {args.history:,} positions")
+        for lines in (args.lines, args.lines * 10):
+            write_synthetic_log(web.log_file_path, lines, stations=5000)
+            timings = []
+            for label in ("forward", "backward"):
+                web.history_size = args.history
+                web.all_packets.clear()
+                web.packet_keys.clear()
+                web.position_index.cells.clear()
+                web.tracks.clear()
+                follower = web.LogFollower(web.log_file_path)
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    if label == "forward":
+                        for epoch, _, kind, raw_packet in iter_records(open(web.log_file_path)):
+                            if kind == "packet":
+                                position = web.decode_packet(raw_packet, epoch)
+                                if position:
+                                    web.add_position(position)
+                    else:
+                        web.backfill(follower)
+                timings.append(time.perf_counter() - start)
+                follower.close()
+                kept = [p.raw for p in web.all_packets]
+                if label == "forward":
+                    expected = kept
+            # Reading the whole log, copies of packets seen before the backfilled window are skipped too,
+            # so the two can differ there; the newest packet and the history size must agree
+            if len(kept) != len(expected) or kept[-1] != expected[-1] or len(set(map(web.normalize_packet, kept))) != len(kept):
+                raise SystemExit("Mismatch: the backfill did not keep the newest distinct packets")
+            shared = len(set(kept) & set(expected)) / len(expected)
+            print(f"  {lines:>9,} line log: whole log forward {timings[0]:>7.2f} s, backfill {timings[1]:>6.2f} s  ({shared:.0%} of packets the same)")
+
+        # With --db: the store holds most of the log, and the rest is logged before the map starts
+        decoder = load_tool("fake-aprs-is-decoder.py")
+        decoder.decode_cache = decoder.DecodeCache()
+        decoder.log_file_path = web.log_file_path
+        with open(web.log_file_path, 'r') as log_file:
+            lines = log_file.readlines()
+        stored = len(lines) - len(lines) // 20  # Fewer positions than --history are left for the backfill
+        with open(web.log_file_path, 'w') as log_file:
+            log_file.writelines(lines[:stored])
+        store = PacketStore(os.path.join(directory, "packets.db"))
+        decoder.ingest_log(store)
+        store.close()
+        with open(web.log_file_path, 'a') as log_file:
+            log_file.writelines(lines[stored:])
+        web.all_packets.clear()
+        web.packet_keys.clear()
+        web.position_index.cells.clear()
+        web.tracks.clear()
+        follower = web.LogFollower(web.log_file_path)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            web.backfill_since = web.load_history(os.path.join(directory, "packets.db"))
+            web.backfill(follower)
+        elapsed = time.perf_counter() - start
+        follower.close()
+        web.backfill_since = None
+        kept = [p.raw for p in web.all_packets]
+        with contextlib.redirect_stdout(io.StringIO()):
+            unstored = [raw for epoch, _, kind, raw in iter_records(lines[stored:]) if kind == "packet" and web.decode_packet(raw, epoch)]
+        # Reading the log forward, a repeat is also dropped while an earlier copy is on the map,
+        # so every position of the unstored lines that reading keeps must be on the map too
+        logged = set(map(web.normalize_packet, unstored)) & set(map(web.normalize_packet, expected))
+        if len(kept) != len(expected) or kept[-1] != expected[-1] or not logged <= set(map(web.normalize_packet, kept)):
+            raise SystemExit("Mismatch: --db and the backfill after it left a gap or a short history")
+        print(f"  --db with {len(lines) - stored:,} lines logged since the last ingest: {elapsed:.2f} s, {len(kept):,} positions, none missed")
+
+def bench_tracks(args):
+    """Size and build time of /tracks.json at several zoom levels for long mobile tracks, checking the simplification."""
+    web = load_tool("fake-aprs-is-web.py")
+    web.history_size = args.stations * args.points
+    rng = random.Random(1)
+    for station in range(args.stations):
+        lat, lon, heading = 33.45 + rng.uniform(-1, 1), -112.07 + rng.uniform(-1, 1), rng.uniform(0, 2 * math.pi)
+        for n in range(args.points):
+            heading += rng.gauss(0, 0.2)
+            lat, lon = lat + 0.0005 * math.cos(heading), lon + 0.0005 * math.sin(heading)
+            web.add_position(web.PositionRecord(time.time(), lat, lon, f"M{station}", f"M{station}>APRS:{n}"))
+
+    # Every dropped point must be within the tolerance of the segment between the points kept around it
+    track = [[p.lat, p.lon] for p in web.tracks["M0"]]
+    tolerance = web.track_tolerance_px * 360 / (256 * 2 ** 14)
+    kept = web.simplify_track(track, tolerance)
+    indexes = [track.index(point) for point in kept]
+    for first, last in zip(indexes, indexes[1:]):
+        (x1, y1), (x2, y2) = web.mercator(*track[first]), web.mercator(*track[last])
+        for point in track[first + 1:last]:
+            x, y = web.mercator(*point)
+            dx, dy = x2 - x1, y2 - y1
+            t = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / (dx * dx + dy * dy))) if dx or dy else 0.0
+            if math.hypot(x - x1 - t * dx, y - y1 - t * dy) > tolerance * (1 + 1e-9):
+                raise SystemExit("Mismatch: a dropped point is further from the simplified track than the tolerance")
+
+    all_points = json.dumps([[[p.lat, p.lon] for p in track] for track in web.tracks.values()])
+    print(f"{args.stations} mobile stations with {args.points:,} positions each; all points as JSON: {len(all_points):,} bytes")
+    for zoom in (6, 10, 14, 18, None):
+        start = time.perf_counter()
+        response = web.tracks_response(f"zoom={zoom}" if zoom is not None else "")
+        elapsed = time.perf_counter() - start
+        points = sum(len(track["points"]) for track in json.loads(response.body))
+        print(f"  zoom {zoom if zoom is not None else '-':<4} {points:>8,} points {len(response.body):>10,} bytes  {elapsed * 1000:>7.1f} ms")
+
+def bench_memory(args):
+    """Memory of web map positions stored as dicts of decoded fields (before) and as PositionRecords, and time filter speed."""
+    import aprslib
+    web = load_tool("fake-aprs-is-web.py")
+    web.history_size = args.positions
+    raws = [raw for _, raw in synthetic_raw_positions(args.positions, stations=args.positions // 10)]
+    epoch = time.time()
+
+    def positions_before():
+        positions = []
+        for raw in raws:
+            packet = aprslib.parse(raw)
+            positions.append({
+                "lat": packet["latitude"],
+                "lon": packet["longitude"],
+                "timestamp": datetime.fromtimestamp(epoch).strftime("%Y-%m-%d %H:%M:%S"),
+                "fields": packet,
+                "callsign": packet.get("from", "Unknown"),
+            })
+        return positions
+
+    def positions_after():
+        for raw in raws:
+            packet = aprslib.parse(raw)  # Parsed as the web map does, then only the record is kept
+            web.add_position(web.PositionRecord(epoch, packet["latitude"], packet["longitude"], packet.get("from", "Unknown"), packet["raw"]))
+        return list(web.all_packets)
+
+    print(f"{args.positions:,} positions")
+    for label, build in (("dicts (before)", positions_before), ("PositionRecord", positions_after)):
+        tracemalloc.start()
+        positions = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        min_time = datetime.fromtimestamp(epoch) - timedelta(minutes=60)
+        start = time.perf_counter()
+        if label == "dicts (before)":
+            kept = [p for p in positions if datetime.strptime(p["timestamp"], "%Y-%m-%d %H:%M:%S") >= min_time]
+        else:
+            kept = web.filter_positions(positions, epoch - 3600, None)
+        filter_time = time.perf_counter() - start
+        what = "list" if label == "dicts (before)" else "history, grid index, tracks and duplicate keys"
+        print(f"  {label:<16} {size / 2 ** 20:>8.1f} MB ({size / len(positions):>6,.0f} bytes/position, {what}); "
+              f"time filter {filter_time * 1000:>7.1f} ms for {len(kept):,}")
+        del positions
+
+def bench_forwarder(args):
+    """Serial forwarder duplicate checks over simulated days of traffic: the never-pruned dict (before) and DedupCache."""
+    forwarder = load_tool("fake-aprs-is-serial-forwarder.py")
+    rng = random.Random(1)
+    interval = 86400 * args.days / args.packets
+    packets = []
+    for i, (callsign, raw) in enumerate(synthetic_raw_positions(args.packets, stations=args.stations)):
+        packets.append((i * interval, raw))
+        if rng.random() < 0.3:  # The same beacon relayed by a second iGate moments later
+            packets.append((i * interval + 0.2, raw.replace(":", ",qAR,IGATE2:", 1)))
+    packets.sort()
+
+    def before():
+        last_sent_packets = {}
+        sent = 0
+        for now, packet in packets:
+            if any(re.search(pattern, packet) for pattern in forwarder.ignore_patterns):
+                continue
+            normalized_packet = re.sub(r",q[A-Z]+,[^:]+:", "", packet).strip()
+            if normalized_packet in last_sent_packets and now - last_sent_packets[normalized_packet] < args.window:
+                continue
+            last_sent_packets[normalized_packet] = now
+            sent += 1
+        return sent, len(last_sent_packets)
+
+    def after():
+        dedup = forwarder.DedupCache(args.window)
+        sent = 0
+        for now, packet in packets:
+            if forwarder.should_ignore_packet(packet):
+                continue
+            if dedup.is_unique(packet, now):
+                sent += 1
+        return sent, len(dedup.sent)
+
+    print(f"{len(packets):,} packets over {args.days:g} days from {args.stations:,} stations, {args.window:g} s window")
+    results = []
+    for label, run in (("dict (before)", before), ("DedupCache", after)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        sent, entries = run()
+        elapsed = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append(sent)
+        print(f"  {label:<14} {len(packets) / elapsed:>10,.0f} packets/s, {sent:,} sent, "
+              f"{entries:,} entries kept, peak {peak / 2 ** 20:.1f} MB")
+    print("  same packets sent" if results[0] == results[1] else "  MISMATCH in packets sent")
+
+class SimulatedSerialLink:
+    """Stands in for the radio's serial port: writes take as long as the bytes do at the baud rate."""
+
+    def __init__(self, baudrate):
+        self.baudrate = baudrate
+        self.writes = []
+
+    def write(self, data):
+        time.sleep(len(data) * 10 / self.baudrate)
+        self.writes.append((time.monotonic(), bytes(data)))
+
+def bench_transmit(args):
+    """How long a burst of log lines holds up the serial forwarder's log tailing, before and after TransmitQueue."""
+    forwarder = load_tool("fake-aprs-is-serial-forwarder.py")
+    packets = [raw for _, raw in synthetic_raw_positions(args.burst, stations=args.stations)]
+    print(f"Burst of {len(packets):,} packets from {args.stations:,} stations at {args.baud:,} baud")
+
+    link = SimulatedSerialLink(args.baud)
+    start = time.perf_counter()
+    for packet in packets:
+        link.write(packet.encode('utf-8') + b'\r\n')  # As forward_new_lines() did
+    blocked = time.perf_counter() - start
+    print(f"  synchronous writes (before) tailing blocked {blocked * 1000:>9.1f} ms, {len(link.writes)} packets sent back to back")
+
+    link = SimulatedSerialLink(args.baud)
+    transmitter = forwarder.TransmitQueue(link, window=args.window)
+    with contextlib.redirect_stdout(io.StringIO()):
+        transmitter.start()
+        start = time.perf_counter()
+        for packet in packets:
+            transmitter.put(packet)
+        blocked = time.perf_counter() - start
+        time.sleep(args.window)
+        transmitter.stop()
+    stats = transmitter.stats()
+    gaps = [b[0] - a[0] for a, b in zip(link.writes, link.writes[1:])]
+    print(f"  TransmitQueue              tailing blocked {blocked * 1000:>9.1f} ms, {stats['sent']} sent in {args.window:g} s "
+          f"({sum(len(data) for _, data in link.writes)} of {stats['budget']} budget bytes), {stats['coalesced']} coalesced, "
+          f"{stats['dropped']} dropped, max depth {stats['max_depth']}, latency avg {stats['latency_avg']:.2f} s, "
+          f"min gap {min(gaps, default=0) * 1000:.0f} ms")
+
+    # Coalescing only merges reports of the same thing: a station's position or status, or one object or item
+    burst = [
+        ("N0CALL>APRS:!3327.00N/11204.00W-first position", False),
+        ("N0CALL>APRS:=3327.10N/11204.10W-newer position", True),
+        ("N0CALL>APRS:;LEADER   *092345z4903.50N/07201.75W>object one", True),
+        ("N0CALL>APRS:;FOLLOWER *092345z4903.60N/07201.85W>object two", True),
+        ("N0CALL>APRS:)AID #2!4903.50N/07201.75WA item one", True),
+        ("N0CALL>APRS:)AID #3!4903.60N/07201.85WA item two", True),
+        ("N0CALL>APRS:T#001,199,000,255,073,123,01101001", True),
+        ("N0CALL>APRS:T#002,198,000,255,073,123,01101001", True),
+        ("GATE>APRS:}N1CALL>APRS,TCPIP,GATE*:>first third-party", True),
+        ("GATE>APRS:}N2CALL>APRS,TCPIP,GATE*:>second third-party", True),
+    ]
+    link = SimulatedSerialLink(args.baud)
+    transmitter = forwarder.TransmitQueue(link, window=1, share=1, gap=0)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for packet, _ in burst:
+            transmitter.put(packet)  # Queued before the thread starts, so all are waiting together
+        transmitter.start()
+        deadline = time.monotonic() + 10
+        while transmitter.stats()["depth"] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        transmitter.stop()
+    sent = {data.decode().rstrip("\r\n") for _, data in link.writes}
+    wrong = [packet for packet, expected in burst if (packet in sent) != expected]
+    print(f"  coalescing: {len(sent)} of {len(burst)} burst packets sent, "
+          + ("only the superseded position dropped" if not wrong else f"WRONG for {wrong}"))
+
+class CountingLogWriter:
+    """Stands in for LogWriter in the serial collector: keeps the entries' packets instead of writing them."""
+
+    def __init__(self):
+        self.packets = []
+
+    def write(self, entry):
+        self.packets.append(entry.split(" - ", 2)[2])
+
+def bench_serial(args):
+    """Serial collector throughput over a pseudo-terminal: readline() per line (before) and bulk in_waiting reads."""
+    import pty
+    import tty
+    import serial
+    from fake_aprs_is_framing import LineFramer
+    collector = load_tool("fake-aprs-is-collector-serial.py")
+    collector.log_to_console = False
+    lines = [raw for _, raw in synthetic_raw_positions(args.lines)]
+    data = "".join(line + "\r\n" for line in lines).encode()
+
+    def run(label, read_loop):
+        controller, device = pty.openpty()
+        tty.setraw(device)  # No echo or newline translation, as on a real serial port
+        collector.log_writer = CountingLogWriter()
+        with serial.Serial(os.ttyname(device), args.baud, timeout=0.2) as ser:
+            def feed():
+                for start in range(0, len(data), 4096):
+                    os.write(controller, data[start:start + 4096])
+            writer = threading.Thread(target=feed)
+            start = time.perf_counter()
+            writer.start()
+            reads = read_loop(ser, len(lines))
+            elapsed = time.perf_counter() - start
+            writer.join()
+        os.close(controller)
+        os.close(device)
+        received = collector.log_writer.packets
+        print(f"  {label:<22} {len(received) / elapsed:>10,.0f} lines/s, {reads:>7,} reads "
+              f"({reads / max(1, len(received)):.2f} per line), {'all lines intact' if received == lines else 'LINES DIFFER'}")
+
+    def readline_loop(ser, count):
+        reads = 0
+        while len(collector.log_writer.packets) < count:
+            line = ser.readline().decode('utf-8', errors='replace').strip()
+            reads += 1
+            if line:
+                collector.log_console_packet(line)
+            elif reads > count * 2:
+                break
+        return reads
+
+    def bulk_loop(ser, count):
+        framer = LineFramer()
+        reads = 0
+        while len(collector.log_writer.packets) < count:
+            data = ser.read(max(1, ser.in_waiting))
+            reads += 1
+            if not data:
+                break
+            collector.log_console_lines(framer.feed(data)[0])
+        return reads
+
+    print(f"{len(lines):,} console lines through a pty set to {args.baud:,} baud (ptys don't pace to it)")
+    run("readline() (before)", readline_loop)
+    run("bulk in_waiting reads", bulk_loop)
+
+def bench_graphs(args):
+    """Telemetry graphs over a long synthetic history: raw lists and unclosed figures (before), NumPy with --bucket and --jobs, and --cache."""
+    graphs = load_tool("fake-aprs-is-tcpip-volt-temp-graphs.py")
+    plt = graphs.plt
+    np = graphs.np
+    rng = random.Random(1)
+    start_time = datetime.now() - timedelta(days=args.days)
+    interval = timedelta(days=args.days) / args.samples
+    with tempfile.TemporaryDirectory() as temp_dir:
+        graphs.log_file_path = os.path.join(temp_dir, "fake-aprs-is.log")
+        with open(graphs.log_file_path, 'w') as log_file:
+            for i in range(args.samples):
+                timestamp = start_time + i * interval
+                for client in range(args.clients):
+                    voltage = 12 + math.sin(i / 500 + client) + rng.random() / 5
+                    temperature = 60 + 15 * math.sin(i / 2000) + rng.random() * 3
+                    log_file.write(f"{timestamp.isoformat()} - 10.0.0.{client} - Received packet: "
+                                   f"LH{client}>LHOUSE,TCPIP*:@011200z3327.00N/11204.00W-U={voltage:.2f}V,T=x{temperature:.1f}F\n")
+        print(f"{args.clients} clients x {args.samples:,} samples over {args.days:g} days")
+        cwd = os.getcwd()
+        os.chdir(temp_dir)
+        try:
+            tracemalloc.start()
+            start = time.perf_counter()
+            lists = defaultdict(lambda: {'timestamps': [], 'voltages': [], 'temperatures': []})
+            for epoch, _, kind, payload in iter_records(open(graphs.log_file_path)):
+                match = graphs.pattern.match(payload)
+                if kind == "packet" and match:
+                    client, voltage, temperature = match.groups()
+                    lists[client]['timestamps'].append(datetime.fromtimestamp(epoch))
+                    lists[client]['voltages'].append(float(voltage))
+                    lists[client]['temperatures'].append(float(temperature))
+            load_time = time.perf_counter() - start
+            load_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            start = time.perf_counter()
+            for client, data in lists.items():
+                for values in (data['voltages'], data['temperatures']):
+                    plt.figure(figsize=(12, 6))
+                    plt.plot(data['timestamps'], values, marker='o', linestyle='-')
+                    plt.gcf().autofmt_xdate()
+                    plt.savefig(f"{client}_before.png")
+            print(f"  lists, raw points (before)   load {load_time:>6.2f} s {load_memory / 2 ** 20:>7.1f} MB, "
+                  f"render {time.perf_counter() - start:>6.2f} s, {len(plt.get_fignums())} figures left open")
+            plt.close('all')
+            # As the baseline printed them, e.g. "Voltage: 12.0V", to check the NumPy listing against
+            listing = {
+                client: [f"Timestamp: {timestamp}, Voltage: {voltage}V, Temperature: {temperature}F"
+                         for timestamp, voltage, temperature in zip(data['timestamps'], data['voltages'], data['temperatures'])]
+                for client, data in lists.items()
+            }
+            del lists
+
+            tracemalloc.start()
+            start = time.perf_counter()
+            clients_data = graphs.load_samples()
+            load_time = time.perf_counter() - start
+            load_memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            if any(graphs.format_samples(*clients_data[client], None) != lines for client, lines in listing.items()):
+                raise SystemExit("Mismatch: the NumPy samples print differently from the lists")
+            for label, bucket, jobs in (("NumPy, raw", None, 1), (f"NumPy, --bucket {args.bucket}", args.bucket, 1),
+                                        (f"NumPy, --bucket {args.bucket} -j {args.jobs}", args.bucket, args.jobs)):
+                bucket_seconds = graphs.parse_duration(bucket).total_seconds() if bucket else None
+                tasks = [(client, *data, bucket_seconds, False) for client, data in clients_data.items()]
+                start = time.perf_counter()
+                if jobs > 1:
+                    with graphs.ProcessPoolExecutor(max_workers=jobs) as pool:
+                        list(pool.map(graphs.render_client, *zip(*tasks)))
+                else:
+                    for task in tasks:
+                        graphs.render_client(*task)
+                print(f"  {label:<28} load {load_time:>6.2f} s {load_memory / 2 ** 20:>7.1f} MB, "
+                      f"render {time.perf_counter() - start:>6.2f} s, {len(plt.get_fignums())} figures left open")
+
+            # --cache: the first run parses the whole log, later runs only the lines appended since
+            for run in ("first run", "next run"):
+                start = time.perf_counter()
+                cache = graphs.TelemetryCache(os.path.join(temp_dir, "cache"))
+                added = cache.update(graphs.log_file_path)
+                cached = cache.samples()
+                print(f"  --cache, {run:<19} load {time.perf_counter() - start:>6.2f} s, {added:,} samples appended")
+            same = cached.keys() == clients_data.keys() and all(
+                all(np.array_equal(a, b) for a, b in zip(cached[client], clients_data[client])) for client in cached
+            )
+            print("  cached samples match the log" if same else "  MISMATCH between cached samples and the log")
+        finally:
+            os.chdir(cwd)
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the fake-aprs-is tools")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    parser_bench = subparsers.add_parser("parser", help="Log line parsing throughput, before and after the shared parser")
+    parser_bench.add_argument("--lines", type=int, default=200000, help="Number of synthetic log lines")
+    parser_bench.set_defaults(func=bench_parser)
+
+    status_bench = subparsers.add_parser("status", help="client-status identical-packet detection, checked against the pairwise comparison")
+    status_bench.add_argument("--packets", type=int, default=3000, help="Number of synthetic beacons")
+    status_bench.add_argument("--clients", type=int, default=4, help="Number of synthetic iGates")
+    status_bench.add_argument("--log-packets", type=int, default=1500, help="Beacons in the log the reports are compared on")
+    status_bench.add_argument("--baseline", help="Git revision of the client-status script to compare with (default: the first commit)")
+    status_bench.set_defaults(func=bench_status)
+
+    decoder_bench = subparsers.add_parser("decoder", help="Decoder throughput without and with the decode cache, and with --jobs 2, 4...")
+    decoder_bench.add_argument("--lines", type=int, default=100000, help="Number of synthetic log lines")
+    decoder_bench.add_argument("--max-jobs", type=int, default=os.cpu_count(), help="Largest worker count to try")
+    decoder_bench.add_argument("--chunk-size", type=int, default=2000, help="Log lines per worker batch")
+    decoder_bench.add_argument("--cache-size", type=int, default=10000, help="Decode cache size, as for the decoder")
+    decoder_bench.add_argument("-t", "--type", help="Packet type filter, as for the decoder")
+    decoder_bench.add_argument("-s", "--search", help="Search term, as for the decoder")
+    decoder_bench.set_defaults(func=bench_decoder)
+
+    prefilter_bench = subparsers.add_parser("prefilter", help="Narrow decoder queries with and without the prefilter")
+    prefilter_bench.add_argument("--lines", type=int, default=50000, help="Number of synthetic log lines")
+    prefilter_bench.set_defaults(func=bench_prefilter)
+
+    store_bench = subparsers.add_parser("store", help="Decoder queries from the log versus from the SQLite store")
+    store_bench.add_argument("--lines", type=int, default=50000, help="Number of synthetic log lines")
+    store_bench.set_defaults(func=bench_store)
+
+    history_bench = subparsers.add_parser("history", help="Web map packet history inserts, checked against the list scan")
+    history_bench.add_argument("--packets", type=int, default=300000, help="Number of positions to add")
+    history_bench.add_argument("--history", type=int, default=100000, help="Positions kept, as for the web map's --history")
+    history_bench.add_argument("--check", type=int, default=5000, help="Positions also added the old way, to compare")
+    history_bench.set_defaults(func=bench_history)
+
+    viewport_bench = subparsers.add_parser("viewport", help="Web map viewport queries with the grid index, checked against a full scan")
+    viewport_bench.add_argument("--packets", type=int, default=100000, help="Number of positions on the map")
+    viewport_bench.add_argument("--repeat", type=int, default=20, help="Queries timed per viewport")
+    viewport_bench.set_defaults(func=bench_viewport)
+
+    serve_bench = subparsers.add_parser("serve", help="Web map HTTP polling from concurrent clients, without and with the response cache")
+    serve_bench.add_argument("--packets", type=int, default=20000, help="Number of positions on the map")
+    serve_bench.add_argument("--clients", type=int, default=8, help="Concurrent polling clients")
+    serve_bench.add_argument("--requests", type=int, default=50, help="Requests per client")
+    serve_bench.set_defaults(func=bench_serve)
+
+    follow_bench = subparsers.add_parser("follow", help="Web map log tailing latency and idle CPU, before and after LogFollower")
+    follow_bench.add_argument("--lines", type=int, default=50, help="Lines appended to the log")
+    follow_bench.add_argument("--interval", type=float, default=0.05, help="Seconds between appended lines")
+    follow_bench.add_argument("--idle", type=float, default=3, help="Seconds to measure idle CPU for")
+    follow_bench.set_defaults(func=bench_follow)
+
+    backfill_bench = subparsers.add_parser("backfill", help="Web map warm start from the end of the log, checked against reading all of it")
+    backfill_bench.add_argument("--lines", type=int, default=20000, help="Lines in the smaller synthetic log; the larger has ten times as many")
+    backfill_bench.add_argument("--history", type=int, default=2000, help="Positions to backfill, as for the web map's --history")
+    backfill_bench.set_defaults(func=bench_backfill)
+
+    tracks_bench = subparsers.add_parser("tracks", help="Web map /tracks.json size and build time by zoom level")
+    tracks_bench.add_argument("--stations", type=int, default=20, help="Mobile stations")
+    tracks_bench.add_argument("--points", type=int, default=2000, help="Positions per station")
+    tracks_bench.set_defaults(func=bench_tracks)
+
+    memory_bench = subparsers.add_parser("memory", help="Web map memory per position, before and after PositionRecord")
+    memory_bench.add_argument("--positions", type=int, default=100000, help="Positions on the map")
+    memory_bench.set_defaults(func=bench_memory)
+
+    forwarder_bench = subparsers.add_parser("forwarder", help="Serial forwarder duplicate checks, before and after DedupCache")
+    forwarder_bench.add_argument("--packets", type=int, default=500000, help="Number of synthetic forwarded packets")
+    forwarder_bench.add_argument("--stations", type=int, default=2000, help="Number of synthetic stations")
+    forwarder_bench.add_argument("--days", type=float, default=30, help="Days of traffic the packets are spread over")
+    forwarder_bench.add_argument("--window", type=float, default=1.0, help="Seconds within which a repeated packet is a duplicate")
+    forwarder_bench.set_defaults(func=bench_forwarder)
+
+    transmit_bench = subparsers.add_parser("transmit", help="Serial forwarder log tailing during a packet burst, before and after TransmitQueue")
+    transmit_bench.add_argument("--burst", type=int, default=200, help="Packets logged at once")
+    transmit_bench.add_argument("--stations", type=int, default=60, help="Number of synthetic stations in the burst")
+    transmit_bench.add_argument("--baud", type=int, default=9600, help="Baud rate of the simulated serial link")
+    transmit_bench.add_argument("--window", type=float, default=10, help="TransmitQueue airtime window, and seconds to let it send")
+    transmit_bench.set_defaults(func=bench_transmit)
+
+    serial_bench = subparsers.add_parser("serial", help="Serial collector reads per line, before and after bulk in_waiting reads")
+    serial_bench.add_argument("--lines", type=int, default=50000, help="Number of console lines written to the pty")
+    serial_bench.add_argument("--baud", type=int, default=115200, help="Baud rate the pty is opened at")
+    serial_bench.set_defaults(func=bench_serial)
+
+    graphs_bench = subparsers.add_parser("graphs", help="Telemetry graph load and render times, before and after NumPy, --bucket, --jobs and --cache")
+    graphs_bench.add_argument("--clients", type=int, default=4, help="Number of synthetic stations graphed")
+    graphs_bench.add_argument("--samples", type=int, default=50000, help="Samples per client")
+    graphs_bench.add_argument("--days", type=float, default=90, help="Days of history the samples are spread over")
+    graphs_bench.add_argument("--bucket", default="6h", help="Averaging bucket for the --bucket runs")
+    graphs_bench.add_argument("--jobs", type=int, default=4, help="Render processes for the --jobs run")
+    graphs_bench.set_defaults(func=bench_graphs)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,16 @@
 #!/usr/bin/env python3
-import re
+import os
+import json
+import time
 import argparse
 from collections import defaultdict
 from datetime import datetime, timedelta
+from fake_aprs_is_log import (
+    find_start_offset, iter_records, iter_segment_lines, normalize_packet, read_fingerprint, KIND_PACKET, PACKET_PREFIX,
+)
 
-# Initialize dictionaries to hold hourly counts for each client
-client_hourly_counts = defaultdict(lambda: defaultdict(int))
-client_last_hour_packets = defaultdict(list)  # Stores packets with timestamps for each client in the specified time range
-
-# Parse command-line arguments
-parser = argparse.ArgumentParser(description="APRS Log Analyzer")
-parser.add_argument("-d", "--duration", type=str, default="1h", help="Specify duration (e.g., 1min, 30min, 1h, 5h, 1d, 1w)")
-parser.add_argument("-u", "--unique", action="store_true", help="Show unique packets for each client")
-parser.add_argument("-i", "--identical", action="store_true", help="Show packets seen by all clients")
-args = parser.parse_args()
-
-# Determine the time delta based on the -d argument
-time_delta_mapping = {
-    "min": "minutes",
-    "h": "hours",
-    "d": "days",
-    "w": "weeks"
-}
-unit = args.duration[-3:] if args.duration.endswith("min") else args.duration[-1]
-value = int(args.duration[:-3]) if unit == "min" else int(args.duration[:-1])  # Default to 1 if parsing fails
-time_delta = timedelta(**{time_delta_mapping.get(unit, "hours"): value})
-
-# Get the current time and calculate the start time for the log range
-latest_timestamp = datetime.now()
-time_range_start = latest_timestamp - time_delta
-
-# Function to normalize packets by removing `qAO`, `qAR`, and similar parts
-def normalize_packet(packet):
-    # Remove `qAO`, `qAR`, or similar patterns
-    normalized = re.sub(r",qA[OR],[^:]+:", ":", packet).strip()
-    return normalized
-
-# List to store all unique packets with timestamps for sorting later
-all_unique_packets_with_timestamps = []
+log_file_path = '/home/lighthouse/fake-aprs-is/fake-aprs-is-logs/fake-aprs-is.log'
+state_version = 1  # Bump when the --state file layout changes; older files are rebuilt
 
 # Define a list of patterns to ignore, including keepalive packets
 ignore_patterns = [
@@ -46,94 +19,303 @@ ignore_patterns = [
     "#",  # Any packet with only `#`
 ]
 
-# Open and read the log file
-with open('/home/lighthouse/fake-aprs-is/fake-aprs-is-logs/fake-aprs-is.log', 'r') as file:
-    for line in file:
-        # Skip lines containing any ignore patterns, including keepalives
-        if any(pattern in line for pattern in ignore_patterns):
+identical_window_us = 1000000  # Packets seen by another client within 1 second are identical
+
+def find_identical_packets(client_packets, window_us=identical_window_us):
+    """Flag each client's packets that another client logged, normalized, within the window.
+
+    Packets are grouped by normalized text and swept in time order, keeping per-client counts
+    for the current window, so the cost is O(n log n) instead of comparing every pair.
+    Returns {client: [is_identical, ...]} in the same order as client_packets.
+    """
+    flags = {client: [False] * len(packets) for client, packets in client_packets.items()}
+    by_packet = defaultdict(list)
+    for client, packets in client_packets.items():
+        for index, (timestamp, _, normalized_packet) in enumerate(packets):
+            by_packet[normalized_packet].append((timestamp, client, index))
+
+    for entries in by_packet.values():
+        if len(entries) < 2:
             continue
+        entries.sort()
+        window_counts = defaultdict(int)  # Packets per client in [timestamp - window, timestamp + window]
+        low = high = 0
+        for timestamp, client, index in entries:
+            while high < len(entries) and entries[high][0] <= timestamp + window_us:
+                window_counts[entries[high][1]] += 1
+                high += 1
+            while entries[low][0] < timestamp - window_us:
+                window_counts[entries[low][1]] -= 1
+                low += 1
+            if high - low > window_counts[client]:
+                flags[client][index] = True
+    return flags
+
+class ClientStatus:
+    """Per-client packets and hourly counts for the report window, resumable from a --state file.
+
+    Each client's entries are [epoch, packet, is_identical] lists in log order; is_identical is None
+    for lines that are only counted (empty or `#` once normalized).
+    """
+
+    def __init__(self, since):
+        self.since = since          # Epoch from which the entries are complete
+        self.entries = {}           # client -> entries
+        self.hourly_counts = {}     # client -> {hour: count}
+        self.log_identity = None    # [device, inode, fingerprint hex] of the live log
+        self.offset = 0             # Bytes of the live log already processed
+
+    @classmethod
+    def load(cls, state_path, log_path, since):
+        """Return the saved state if it can be continued for this log and window, otherwise None."""
+        try:
+            with open(state_path, 'r') as state_file:
+                saved = json.load(state_file)
+        except (FileNotFoundError, ValueError):
+            return None
+        if saved.get("version") != state_version or saved["since"] > since:
+            return None  # Different layout, or the window now reaches further back than the state
+        try:
+            with open(log_path, 'rb') as log_file:
+                stat = os.fstat(log_file.fileno())
+                fingerprint = read_fingerprint(log_file).hex()
+        except FileNotFoundError:
+            return None
+        device, inode, saved_fingerprint = saved["log_identity"] or (None, None, "")
+        if (stat.st_dev, stat.st_ino) != (device, inode) or not fingerprint.startswith(saved_fingerprint):
+            return None  # Rotated or replaced
+        if stat.st_size < saved["offset"]:
+            return None  # Truncated
+        status = cls(saved["since"])
+        status.entries = saved["entries"]
+        status.hourly_counts = saved["hourly_counts"]
+        status.log_identity = saved["log_identity"]
+        status.offset = saved["offset"]
+        return status
+
+    def save(self, state_path):
+        """Write the state atomically, so an interrupted run leaves the previous state in place."""
+        saved = {
+            "version": state_version,
+            "since": self.since,
+            "log_identity": self.log_identity,
+            "offset": self.offset,
+            "hourly_counts": self.hourly_counts,
+            "entries": self.entries,
+        }
+        temp_path = state_path + '.tmp'
+        with open(temp_path, 'w') as state_file:
+            json.dump(saved, state_file, separators=(',', ':'))
+        os.replace(temp_path, state_path)
+
+    def rebuild(self, log_path):
+        """Read the whole window: closed segments, then the live log from the first line in range."""
+        since = datetime.fromtimestamp(self.since)
+        self.add_lines(iter_segment_lines(log_path, since))
+        if os.path.exists(log_path):
+            self.offset = find_start_offset(log_path, since)
+            self.read_appended(log_path)
+        self.classify()
 
-        # Extract the timestamp, client IP, and message
-        match = re.match(r'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d+)\s-\s([\d.]+)\s-\s(.+)', line)
-        if match:
-            timestamp, client_ip, packet_data = match.groups()
-            date_time = datetime.fromisoformat(timestamp)
+    def read_appended(self, log_path):
+        """Add the complete lines written to the live log since the last processed offset."""
+        with open(log_path, 'rb') as log_file:
+            stat = os.fstat(log_file.fileno())
+            self.log_identity = [stat.st_dev, stat.st_ino, read_fingerprint(log_file).hex()]
+            log_file.seek(self.offset)
+            return self.add_lines(self._complete_lines(log_file))
+
+    def _complete_lines(self, log_file):
+        for line in log_file:
+            if not line.endswith(b'\n'):
+                break  # Still being written; picked up by the next run
+            self.offset += len(line)
+            yield line.decode('utf-8', errors='replace')
+
+    def add_lines(self, lines):
+        """Add the client lines in range; returns the earliest new epoch, or None if none were added."""
+        earliest = None
+        for epoch, client_ip, kind, payload in iter_records(lines):
+            # Only lines from clients, i.e. with an IP address as the source
+            if not client_ip.replace('.', '').isdigit():
+                continue
+
+            # The message as logged, e.g. "Received packet: ..." or "Sent keepalive"
+            packet_data = PACKET_PREFIX + payload if kind == KIND_PACKET else payload
+
+            # Skip lines containing any ignore patterns, including keepalives
+            if any(pattern in packet_data for pattern in ignore_patterns):
+                continue
 
             # Skip packets older than the specified time range
-            if date_time < time_range_start:
+            if epoch < self.since:
                 continue
 
             # Increment counts for the client on an hourly basis
-            hour_str = date_time.strftime('%Y-%m-%d %H:00')
-            client_hourly_counts[client_ip][hour_str] += 1
+            hours = self.hourly_counts.setdefault(client_ip, {})
+            hour_str = hour_of(epoch)
+            hours[hour_str] = hours.get(hour_str, 0) + 1
 
-            # Normalize the packet for comparison, but keep the original for display
+            # Lines that normalize to nothing or only `#` are counted but not compared
             normalized_packet = normalize_packet(packet_data)
-            if normalized_packet in ["#", ""]:
-                continue  # Skip empty packets or those with only `#`
-
-            # Track original and normalized packets with timestamps for comparison
-            client_last_hour_packets[client_ip].append((date_time, packet_data, normalized_packet))
-
-# Perform detailed comparison of packets within the specified time range
-identical_counts = defaultdict(int)
-unique_counts = defaultdict(int)
-client_packet_diff = defaultdict(list)  # Store packet differences
-
-# Check identical and unique counts per client in the specified time range
-for client, packets in client_last_hour_packets.items():
-    for timestamp, original_packet, normalized_packet in packets:
-        # Check if this normalized packet appears in other clients' data within a 1-second window
-        is_identical = any(
-            abs((timestamp - other_timestamp).total_seconds()) <= 1 and normalized_packet == other_packet
-            for other_client, other_packets in client_last_hour_packets.items()
-            if other_client != client
-            for other_timestamp, _, other_packet in other_packets
-        )
-
-        if is_identical:
-            identical_counts[client] += 1
-            if args.identical:
-                # Add to global list if showing identical packets across clients
-                all_unique_packets_with_timestamps.append((timestamp, client, original_packet))
-        else:
-            # Skip adding "Sent keepalive" packets to unique counts or output
-            if "Sent keepalive" in original_packet:
+            is_identical = None if normalized_packet in ["#", ""] else False
+            self.entries.setdefault(client_ip, []).append([epoch, packet_data, is_identical])
+            if earliest is None or epoch < earliest:
+                earliest = epoch
+        return earliest
+
+    def evict(self, since):
+        """Drop lines older than `since` from the entries and hourly counts."""
+        self.since = since
+        for client, entries in list(self.entries.items()):
+            if all(entry[0] >= since for entry in entries):
+                continue
+            kept = []
+            hours = self.hourly_counts[client]
+            for entry in entries:
+                if entry[0] >= since:
+                    kept.append(entry)
+                    continue
+                hour_str = hour_of(entry[0])
+                hours[hour_str] -= 1
+                if not hours[hour_str]:
+                    del hours[hour_str]
+            if kept:
+                self.entries[client] = kept
+            else:
+                del self.entries[client]
+                del self.hourly_counts[client]
+
+    def classify(self, low=float('-inf'), high=float('inf')):
+        """Recompute is_identical for the entries between `low` and `high`, from their neighbours in the window."""
+        reach = identical_window_us / 1000000 + 0.001
+        client_packets = {}
+        updated = {}
+        for client, entries in self.entries.items():
+            packets = []
+            for entry in entries:
+                epoch, packet_data, is_identical = entry
+                if is_identical is not None and low - reach <= epoch < high + reach:
+                    packets.append((round(epoch * 1000000), packet_data, normalize_packet(packet_data)))
+                    updated.setdefault(client, []).append(entry)
+            if packets:
+                client_packets[client] = packets
+        for client, flags in find_identical_packets(client_packets).items():
+            for entry, is_identical in zip(updated[client], flags):
+                if low <= entry[0] < high:
+                    entry[2] = is_identical
+
+def hour_of(epoch):
+    return time.strftime('%Y-%m-%d %H:00', time.localtime(epoch))
+
+def main(argv=None):
+    # Parse command-line arguments
+    parser = argparse.ArgumentParser(description="APRS Log Analyzer")
+    parser.add_argument("-d", "--duration", type=str, default="1h", help="Specify duration (e.g., 1min, 30min, 1h, 5h, 1d, 1w)")
+    parser.add_argument("-u", "--unique", action="store_true", help="Show unique packets for each client")
+    parser.add_argument("-i", "--identical", action="store_true", help="Show packets seen by all clients")
+    parser.add_argument("--state", help="State file to resume from, so repeated runs only read newly logged lines")
+    args = parser.parse_args(argv)
+
+    # Determine the time delta based on the -d argument
+    time_delta_mapping = {
+        "min": "minutes",
+        "h": "hours",
+        "d": "days",
+        "w": "weeks"
+    }
+    unit = args.duration[-3:] if args.duration.endswith("min") else args.duration[-1]
+    value = int(args.duration[:-3]) if unit == "min" else int(args.duration[:-1])  # Default to 1 if parsing fails
+    time_delta = timedelta(**{time_delta_mapping.get(unit, "hours"): value})
+
+    # Get the current time and calculate the start time for the log range
+    latest_timestamp = datetime.now()
+    time_range_start = latest_timestamp - time_delta
+
+    # Continue from the saved state, or read the whole window again if there is none or the log was rotated or truncated
+    range_start_epoch = time_range_start.timestamp()
+    status = ClientStatus.load(args.state, log_file_path, range_start_epoch) if args.state else None
+    if status is None:
+        status = ClientStatus(range_start_epoch)
+        status.rebuild(log_file_path)
+    else:
+        earliest = status.read_appended(log_file_path) if os.path.exists(log_file_path) else None
+        status.evict(range_start_epoch)
+        # Only packets within the identical window of a new or dropped line can change
+        if earliest is not None:
+            status.classify(low=earliest - identical_window_us / 1000000)
+        status.classify(high=range_start_epoch + identical_window_us / 1000000)
+    if args.state:
+        status.save(args.state)
+
+    # Clients in order of their first line in the window
+    clients = sorted(status.entries, key=lambda client: status.entries[client][0][0])
+    client_last_hour_packets = {
+        client: status.entries[client] for client in clients
+        if any(is_identical is not None for _, _, is_identical in status.entries[client])
+    }
+
+    # List to store all unique packets with timestamps for sorting later
+    all_unique_packets_with_timestamps = []
+
+    # Perform detailed comparison of packets within the specified time range
+    identical_counts = defaultdict(int)
+    unique_counts = defaultdict(int)
+    client_packet_diff = defaultdict(list)  # Store packet differences
+
+    # Check identical and unique counts per client in the specified time range
+    for client, packets in client_last_hour_packets.items():
+        for epoch, original_packet, is_identical in packets:
+            if is_identical is None:
                 continue
-            unique_counts[client] += 1
-            # Log this packet as unique to this client for debugging
-            client_packet_diff[client].append((timestamp, original_packet))
-            # Also add to the global list for sorting later if showing unique packets
-            if args.unique:
-                all_unique_packets_with_timestamps.append((timestamp, client, original_packet))
-
-# Sort the global list of all unique packets by timestamp
-all_unique_packets_with_timestamps.sort(key=lambda x: x[0])
-
-# Output results
-print("\nHourly Counts:")
-for client, hours in client_hourly_counts.items():
-    print(f"\nClient: {client}")
-    for hour, count in hours.items():
-        print(f"  {hour}: {count} messages")
-
-print("\nDetailed Comparison (Total Counts per Client):")
-for client in client_last_hour_packets.keys():
-    total_packets = identical_counts[client] + unique_counts[client]
-    identical_percentage = (identical_counts[client] / total_packets) * 100 if total_packets > 0 else 0
-    print(f"\nClient: {client}")
-    print(f"  Identical packets: {identical_counts[client]} ({identical_percentage:.2f}%)")
-    print(f"  Unique packets: {unique_counts[client]}")
-
-if args.unique:
-    print("\nPacket Differences (Unique Packets per Client):")
-    for client, unique_packets in client_packet_diff.items():
+            timestamp = round(epoch * 1000000)
+            if is_identical:
+                identical_counts[client] += 1
+                if args.identical:
+                    # Add to global list if showing identical packets across clients
+                    all_unique_packets_with_timestamps.append((timestamp, client, original_packet))
+            else:
+                # Skip adding "Sent keepalive" packets to unique counts or output
+                if "Sent keepalive" in original_packet:
+                    continue
+                unique_counts[client] += 1
+                # Log this packet as unique to this client for debugging
+                client_packet_diff[client].append((timestamp, original_packet))
+                # Also add to the global list for sorting later if showing unique packets
+                if args.unique:
+                    all_unique_packets_with_timestamps.append((timestamp, client, original_packet))
+
+    # Sort the global list of all unique packets by timestamp
+    all_unique_packets_with_timestamps.sort(key=lambda x: x[0])
+
+    # Output results
+    print("\nHourly Counts:")
+    for client in clients:
+        hours = status.hourly_counts[client]
+        print(f"\nClient: {client}")
+        for hour, count in hours.items():
+            print(f"  {hour}: {count} messages")
+
+    print("\nDetailed Comparison (Total Counts per Client):")
+    for client in client_last_hour_packets.keys():
+        total_packets = identical_counts[client] + unique_counts[client]
+        identical_percentage = (identical_counts[client] / total_packets) * 100 if total_packets > 0 else 0
         print(f"\nClient: {client}")
-        print("  Unique packets in this client (not seen by others):")
-        for timestamp, packet in sorted(unique_packets, key=lambda x: x[0]):
-            print(f"    {timestamp}: {packet}")
-
-if args.identical:
-    print("\nAll Identical Packets Across Clients (Sorted by Timestamp):")
-    for timestamp, client, packet in all_unique_packets_with_timestamps:
-        print(f"{timestamp} - Client: {client} - Packet: {packet}")
+        print(f"  Identical packets: {identical_counts[client]} ({identical_percentage:.2f}%)")
+        print(f"  Unique packets: {unique_counts[client]}")
+
+    if args.unique:
+        print("\nPacket Differences (Unique Packets per Client):")
+        for client, unique_packets in client_packet_diff.items():
+            print(f"\nClient: {client}")
+            print("  Unique packets in this client (not seen by others):")
+            for timestamp, packet in sorted(unique_packets, key=lambda x: x[0]):
+                print(f"    {datetime.fromtimestamp(timestamp / 1000000)}: {packet}")
+
+    if args.identical:
+        print("\nAll Identical Packets Across Clients (Sorted by Timestamp):")
+        for timestamp, client, packet in all_unique_packets_with_timestamps:
+            print(f"{datetime.fromtimestamp(timestamp / 1000000)} - Client: {client} - Packet: {packet}")
+
+if __name__ == "__main__":
+    main()
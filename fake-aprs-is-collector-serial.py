@@ -1,38 +1,103 @@
 #!/home/lighthouse/fake-aprs-is-env/bin/python
 import serial
 import datetime
+import argparse
+import threading
+from fake_aprs_is_log import add_log_writer_arguments, log_writer_from_args
+from fake_aprs_is_framing import LineFramer, KissFramer, max_line_length
 
 # Configuration
 serial_port = '/dev/ttyS0'  # Update to your console port (e.g., /dev/ttyUSB0 or COMx on Windows)
 baud_rate = 9600             # Adjust to match your radio's configuration
 log_file_path = '/home/lighthouse/fake-aprs-is/fake-aprs-is-logs/fake-aprs-is.log'
+log_writer = None            # LogWriter started in main()
+read_timeout = 1             # Seconds a read waits for the first byte; a partial line is logged after this much silence
+log_to_console = True        # Print every logged line; --quiet turns it off
 
-def log_console_packet(packet_data):
+def log_console_packet(packet_data, source="Console"):
     """Log console packet data with a timestamp."""
     timestamp = datetime.datetime.now().isoformat()
-    log_entry = f"{timestamp} - Console - {packet_data}"
+    log_entry = f"{timestamp} - {source} - {packet_data}"
 
     # Write to log file
-    with open(log_file_path, 'a') as log_file:
-        log_file.write(log_entry + "\n")
+    log_writer.write(log_entry)
 
     # Print to console for debugging
-    print(log_entry)
+    if log_to_console:
+        print(log_entry)
 
-def main():
+def log_console_lines(lines, source="Console"):
+    """Log one entry per non-empty line."""
+    for line in lines:
+        packet_data = line.decode('utf-8', errors='replace').strip()
+        if packet_data:
+            log_console_packet(packet_data, source)
+
+def parse_port(spec, default_framing):
+    """Return (device, baud rate, framing) from a DEVICE[:BAUD[:FRAMING]] --port value."""
+    # Options are taken from the right: /dev/serial/by-path/ names contain colons themselves
+    device, framing, baud = spec, default_framing, baud_rate
+    head, _, last = device.rpartition(':')
+    if head and last in ("text", "kiss"):
+        device, framing = head, last
+    head, _, last = device.rpartition(':')
+    if head and last.isdigit():
+        device, baud = head, int(last)
+    return device, baud, framing
+
+def read_port(device, baud, framing, source="Console"):
+    """Log everything received on one serial port, as `source`, until it fails."""
+    framer = KissFramer() if framing == "kiss" else LineFramer(max_length=max_line_length)
     try:
-        # Open the serial port
-        with serial.Serial(serial_port, baud_rate, timeout=1) as ser:
-            print(f"Listening on {serial_port} at {baud_rate} baud...")
+        with serial.Serial(device, baud, timeout=read_timeout) as ser:
+            print(f"Listening on {device} at {baud} baud ({framing})...")
             while True:
-                # Read a line of data from the serial port
-                line = ser.readline().decode('utf-8', errors='replace').strip()
-                if line:
-                    log_console_packet(line)
+                # Wait for the first byte, then take everything the driver has buffered in one read
+                data = ser.read(max(1, ser.in_waiting))
+                if data:
+                    lines, dropped = framer.feed(data)
+                    if dropped:
+                        print(f"{device}: discarded {dropped} overlong or undecodable {'frame' if framing == 'kiss' else 'line'}(s)")
+                else:
+                    lines = [framer.take_pending()]  # A line left unterminated for a whole timeout, as readline() returned it
+                log_console_lines(lines, source)
     except serial.SerialException as e:
         print(f"Serial port error: {e}")
+
+def main():
+    global log_writer, log_to_console
+
+    parser = argparse.ArgumentParser(description="Log APRS packets received on a radio's serial console")
+    parser.add_argument(
+        "--port", action="append", metavar="DEVICE[:BAUD[:FRAMING]]",
+        help=f"Serial port to read, repeatable for several radios or TNCs, whose lines are then logged as from "
+             f"Console:DEVICE (default {serial_port}:{baud_rate})"
+    )
+    parser.add_argument(
+        "--framing", choices=["text", "kiss"], default="text",
+        help="Framing of ports that don't give one: TNC2 text lines from a radio console, or KISS from a TNC"
+    )
+    parser.add_argument("--quiet", action="store_true", help="Don't print every logged line")
+    add_log_writer_arguments(parser)
+    args = parser.parse_args()
+    ports = [parse_port(spec, args.framing) for spec in args.port or [serial_port]]
+    # With several ports, each one's lines name its device, e.g. "Console:/dev/ttyUSB0"
+    sources = ["Console"] if len(ports) == 1 else [f"Console:{device}" for device, _, _ in ports]
+    log_to_console = not args.quiet
+    log_writer = log_writer_from_args(log_file_path, args)
+
+    try:
+        # One reader thread per port, all handing their lines to the single log writer
+        readers = [threading.Thread(target=read_port, args=(*port, source), daemon=True) for port, source in zip(ports, sources)]
+        for reader in readers:
+            reader.start()
+        for reader in readers:
+            while reader.is_alive():
+                reader.join(1)  # With a timeout, so Ctrl-C is not held up
     except KeyboardInterrupt:
         print("Exiting on user interrupt.")
+    finally:
+        log_writer.close()
 
 if __name__ == "__main__":
     main()
@@ -3,33 +3,45 @@ import socket
 import datetime
 import time
 import threading
+import asyncio
+import argparse
+from collections import deque
+from fake_aprs_is_log import add_log_writer_arguments, log_writer_from_args
+from fake_aprs_is_framing import LineFramer, recv_size, max_line_length  # Defaults, overridden by --recv-size and --max-line-length
 
 # Configuration
 HOST = '0.0.0.0'  # Listen on all available interfaces
 PORT = 14580      # Typical APRS-IS port
 log_file_path = '/home/lighthouse/fake-aprs-is/fake-aprs-is-logs/fake-aprs-is.log'
 keepalive_interval = 60  # Send keepalive every 60 seconds
-recent_packets = []  # Store recent packets for log
 max_recent_packets = 100  # Limit the number of packets stored
+recent_packets = deque(maxlen=max_recent_packets)  # Store recent packets for log
+log_writer = None           # LogWriter started in main()
 
 def log_packet(ip_address, packet_data, log_to_console=True):
     """Log packet data with a timestamp, including IP address, and optionally print to console."""
     timestamp = datetime.datetime.now().isoformat()
     log_entry = f"{timestamp} - {ip_address} - {packet_data}"
 
-    # Append the log entry to recent packets list
+    # Append the log entry to recent packets list; the deque drops the oldest entry itself
     recent_packets.append(log_entry)
-    if len(recent_packets) > max_recent_packets:
-        recent_packets.pop(0)  # Keep only the most recent packets
 
-    # Write to log file
-    with open(log_file_path, 'a') as log_file:
-        log_file.write(log_entry + "\n")
+    # Hand the entry to the writer thread instead of reopening the log file
+    log_writer.write(log_entry)
 
     # Print to console if needed
     if log_to_console:
         print(log_entry)
 
+def log_received_lines(ip_address, lines, dropped=0):
+    """Log one entry per received APRS line."""
+    for line in lines:
+        packet_data = line.decode('utf-8', errors='replace').strip()
+        if packet_data:
+            log_packet(ip_address, f"Received packet: {packet_data}")
+    if dropped:
+        log_packet(ip_address, f"Discarded {dropped} line(s) longer than {max_line_length} bytes")
+
 def send_keepalive(client_socket, ip_address):
     """Send keepalive messages to the client at regular intervals."""
     while True:
@@ -53,8 +65,12 @@ def handle_client(client_socket, ip_address):
     client_socket.send(welcome_message.encode('utf-8'))
     log_packet(ip_address, "Sent welcome message")
 
-    # Wait to receive authentication data
-    auth_data = client_socket.recv(1024).decode('utf-8', errors='replace').strip()
+    # Wait to receive authentication data; anything sent along with it is kept for the packet loop
+    framer = LineFramer(recv_size, max_line_length)
+    lines, dropped, nbytes = framer.recv_from(client_socket)
+    if not lines:
+        lines = [framer.take_pending()]  # Login without a line break, as before
+    auth_data = lines[0].decode('utf-8', errors='replace').strip()
     log_packet(ip_address, f"Received authentication data: {auth_data}")
 
     # Add a slight delay
@@ -65,39 +81,149 @@ def handle_client(client_socket, ip_address):
     auth_ack = f"# logresp {callsign} verified, server 1.0\r\n"
     client_socket.send(auth_ack.encode('utf-8'))
     log_packet(ip_address, f"Sent logresp for callsign {callsign}")
+    log_received_lines(ip_address, lines[1:], dropped)
 
     # Begin packet receiving loop
     while True:
         try:
-            # Receive packet data from the client
-            data = client_socket.recv(1024)
-            if not data:
+            # Receive packet data from the client, one log entry per APRS line
+            lines, dropped, nbytes = framer.recv_from(client_socket)
+            if not nbytes:
                 break
+            log_received_lines(ip_address, lines, dropped)
+        except (BrokenPipeError, ConnectionResetError):
+            break
 
-            # Log each received packet
-            packet_data = data.decode('utf-8', errors='replace').strip()
-            log_packet(ip_address, f"Received packet: {packet_data}")
-
-        except UnicodeDecodeError as e:
-            log_packet(ip_address, f"Decoding error: {e}")
-
+    log_received_lines(ip_address, [framer.take_pending()])
     client_socket.close()
     log_packet(ip_address, "Connection closed")
 
-# Setting up the server socket with SO_REUSEADDR
-server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Allow reuse of the port
-server_socket.bind((HOST, PORT))
-server_socket.listen()
+def run_threaded_server():
+    """Accept clients and serve each one from its own pair of threads."""
+    # Setting up the server socket with SO_REUSEADDR
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # Allow reuse of the port
+    server_socket.bind((HOST, PORT))
+    server_socket.listen()
 
-log_packet("Server", f"APRS-IS fake server listening on port {PORT}", log_to_console=True)
+    log_packet("Server", f"APRS-IS fake server listening on port {PORT}", log_to_console=True)
 
-# Main server loop
-while True:
-    client_socket, addr = server_socket.accept()
-    ip_address = addr[0]  # Extract only the IP address
+    # Main server loop
+    while True:
+        client_socket, addr = server_socket.accept()
+        ip_address = addr[0]  # Extract only the IP address
+        log_packet(ip_address, "Connection established")
+
+        # Start a new thread to handle the client
+        client_thread = threading.Thread(target=handle_client, args=(client_socket, ip_address))
+        client_thread.start()
+
+# Writers of connected clients, keyed by writer, for the shared keepalive timer
+async_clients = {}
+
+async def send_keepalives_async():
+    """Send keepalive messages to every connected client from a single shared timer."""
+    keepalive_message = "# keepalive\r\n".encode('utf-8')
+    while True:
+        await asyncio.sleep(keepalive_interval)
+        for writer, ip_address in list(async_clients.items()):
+            if writer.is_closing():
+                continue
+            try:
+                writer.write(keepalive_message)  # Buffered, so a slow client cannot stall the timer
+                log_packet(ip_address, "Sent keepalive")
+            except (BrokenPipeError, ConnectionResetError):
+                log_packet(ip_address, "Connection closed during keepalive")
+                async_clients.pop(writer, None)
+                writer.close()
+
+async def handle_client_async(reader, writer):
+    """Handle communication with a single client on the event loop."""
+    ip_address = writer.get_extra_info('peername')[0]  # Extract only the IP address
     log_packet(ip_address, "Connection established")
 
-    # Start a new thread to handle the client
-    client_thread = threading.Thread(target=handle_client, args=(client_socket, ip_address))
-    client_thread.start()
+    try:
+        # Send a welcome message immediately upon connection
+        writer.write("# Welcome to APRS-IS (fake server)\r\n".encode('utf-8'))
+        await writer.drain()
+        log_packet(ip_address, "Sent welcome message")
+
+        # Wait to receive authentication data; anything sent along with it is kept for the packet loop
+        framer = LineFramer(max_length=max_line_length)  # Only fed: the stream reader has its own buffer
+        lines, dropped = framer.feed(await reader.read(framer.max_line_length))
+        if not lines:
+            lines = [framer.take_pending()]  # Login without a line break, as before
+        auth_data = lines[0].decode('utf-8', errors='replace').strip()
+        log_packet(ip_address, f"Received authentication data: {auth_data}")
+
+        # Add a slight delay without holding up the other clients
+        await asyncio.sleep(0.5)
+
+        # Send back logresp acknowledgment to mimic APRS-IS authentication response
+        callsign = auth_data.split()[1]  # Extract the callsign
+        writer.write(f"# logresp {callsign} verified, server 1.0\r\n".encode('utf-8'))
+        await writer.drain()
+        log_packet(ip_address, f"Sent logresp for callsign {callsign}")
+        log_received_lines(ip_address, lines[1:], dropped)
+
+        # Keepalives only start once the client is logged in
+        async_clients[writer] = ip_address
+
+        # Begin packet receiving loop, one log entry per APRS line
+        while True:
+            data = await reader.read(recv_size)
+            if not data:
+                break
+            log_received_lines(ip_address, *framer.feed(data))
+        log_received_lines(ip_address, [framer.take_pending()])
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    except IndexError:
+        log_packet(ip_address, "Malformed authentication data")
+    finally:
+        async_clients.pop(writer, None)
+        writer.close()
+        log_packet(ip_address, "Connection closed")
+
+async def run_asyncio_server():
+    """Accept and serve all clients from a single asyncio event loop."""
+    server = await asyncio.start_server(handle_client_async, HOST, PORT, reuse_address=True)
+
+    log_packet("Server", f"APRS-IS fake server listening on port {PORT}", log_to_console=True)
+
+    keepalive_task = asyncio.create_task(send_keepalives_async())
+    async with server:
+        try:
+            await server.serve_forever()
+        finally:
+            keepalive_task.cancel()
+
+def main():
+    global log_writer, recv_size, max_line_length
+
+    parser = argparse.ArgumentParser(description="Fake APRS-IS server that logs packets from iGates and digipeaters")
+    parser.add_argument(
+        "--engine", choices=["threaded", "asyncio"], default="threaded",
+        help="Client handling engine: a thread pair per client (threaded) or one event loop for all clients (asyncio)"
+    )
+    parser.add_argument("--recv-size", type=int, default=recv_size, help="Bytes to read from a client per receive call")
+    parser.add_argument("--max-line-length", type=int, default=max_line_length, help="Discard received lines longer than this many bytes")
+    add_log_writer_arguments(parser)
+    args = parser.parse_args()
+
+    recv_size = args.recv_size
+    max_line_length = args.max_line_length
+    log_writer = log_writer_from_args(log_file_path, args)
+
+    try:
+        if args.engine == "asyncio":
+            asyncio.run(run_asyncio_server())
+        else:
+            run_threaded_server()
+    except KeyboardInterrupt:
+        print("Exiting on user interrupt.")
+    finally:
+        log_writer.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,30 @@
 #!/usr/bin/env python3
 
 import aprslib
+import io
+import os
+import sys
 import json
 import argparse
+import itertools
+import time
+import contextlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from fake_aprs_is_log import iter_log_lines, iter_packet_lines, parse_log_line, KIND_PACKET
+from fake_aprs_is_decode import DecodeCache, Prefilter, decode_cache_size
+from fake_aprs_is_store import PacketStore, store_batch_size
 
 # Path to the APRS log file
 log_file_path = "/home/lighthouse/fake-aprs-is/fake-aprs-is-logs/fake-aprs-is.log"
 
+# Parallel decoding
+default_chunk_size = 2000  # Log lines handed to a worker at a time
+parallel_min_lines = 50000 # Shorter windows are decoded serially: starting the pool costs more than it saves
+decode_options = {}        # Filters used by pool workers, set by init_worker()
+decode_cache = None        # DecodeCache set up in main() or init_worker()
+
 # Supported packet types
 PACKET_TYPES = ["position", "weather", "telemetry", "status", "message", "object", "item", "query", "nmea"]
 
@@ -18,23 +35,21 @@ def parse_duration(duration_str):
     unit = ''.join(filter(str.isalpha, duration_str))
     return timedelta(**{units[unit]: num})
 
-def process_log_line(line, debug):
-    """Process only lines that start with 'Received packet:'."""
-    if "Received packet:" in line:
-        try:
-            timestamp_str, client_ip, packet_line = line.split(" - ", 2)
-            timestamp = datetime.fromisoformat(timestamp_str)
-            packet_data = packet_line.split("Received packet: ", 1)[1].strip()
-            if debug:
-                print(f"DEBUG: Extracted packet: {packet_data}")
-            return line, packet_data, client_ip, timestamp
-        except ValueError:
-            if debug:
-                print(f"DEBUG: Skipped line due to formatting issue: {line.strip()}")
-    else:
-        if debug:
-            print(f"DEBUG: Skipped line - does not contain 'Received packet:': {line.strip()}")
-    return None, None, None, None
+def iter_debug_packet_lines(lines):
+    """Like iter_packet_lines(), printing why each other line was skipped."""
+    for line in lines:
+        line = line.strip()
+        record = parse_log_line(line)
+        if record is None:
+            print(f"DEBUG: Skipped line due to formatting issue: {line}")
+            continue
+
+        timestamp, client_ip, kind, packet_data = record
+        if kind == KIND_PACKET:
+            print(f"DEBUG: Extracted packet: {packet_data}")
+            yield line, timestamp, client_ip, packet_data
+        else:
+            print(f"DEBUG: Skipped line - does not contain 'Received packet:': {line}")
 
 def infer_packet_type(packet):
     """Infer the packet type based on its fields, prioritizing specific types."""
@@ -56,16 +71,22 @@ def infer_packet_type(packet):
         return "nmea"
     return None
 
-def decode_aprs_packet(logline, packet_data, client_ip, log_timestamp, duration=None, filter_type=None, search_term=None, suppress_errors=False, debug=False):
+def decode_aprs_packet(logline, packet_data, client_ip, log_timestamp, duration=None, filter_type=None, search_term=None, suppress_errors=False, debug=False, prefilter=None):
     """Decodes an APRS packet and applies filters."""
     try:
-        if duration and datetime.now() - log_timestamp > duration:
+        if duration and time.time() - log_timestamp > duration.total_seconds():
             if debug:
-                print(f"DEBUG: Skipped packet due to duration filter - {log_timestamp}")
+                print(f"DEBUG: Skipped packet due to duration filter - {datetime.fromtimestamp(log_timestamp)}")
+            return
+
+        # Skip packets that cannot match --type or --search without parsing them
+        if prefilter and not prefilter.accepts(packet_data):
+            if debug:
+                print(f"DEBUG: Prefilter ruled out packet, skipping - {packet_data}")
             return
 
         # Attempt to parse the packet
-        packet = aprslib.parse(packet_data)
+        packet = decode_cache.parse(packet_data)
         if debug:
             print(f"DEBUG: Parsed packet - {packet}")
 
@@ -90,12 +111,110 @@ def decode_aprs_packet(logline, packet_data, client_ip, log_timestamp, duration=
 
     except aprslib.exceptions.ParseError as e:
         if debug:
-            print(f"{log_timestamp} - Parse Error: {e}")
+            print(f"{datetime.fromtimestamp(log_timestamp)} - Parse Error: {e}")
     except Exception as e:
         if debug:
-            print(f"{log_timestamp} - Error: {e}")
+            print(f"{datetime.fromtimestamp(log_timestamp)} - Error: {e}")
+
+def decode_lines(lines, duration=None, filter_type=None, search_term=None, suppress_errors=False, debug=False, prefilter=None):
+    """Decode and print the matching packets of the given log lines, in order."""
+    for logline, log_timestamp, client_ip, packet_data in (iter_debug_packet_lines if debug else iter_packet_lines)(lines):
+        if packet_data and client_ip:
+            decode_aprs_packet(logline, packet_data, client_ip, log_timestamp, duration, filter_type, search_term, suppress_errors, debug, prefilter)
+
+def init_worker(options, cache_size=decode_cache_size, cache_file=None):
+    global decode_cache
+    decode_options.update(options)
+    decode_cache = DecodeCache(cache_size, cache_file)
+
+def decode_batch(lines):
+    """Decode a batch of lines in a pool worker; returns what decode_lines() would have printed and the worker's cache stats."""
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        decode_lines(lines, **decode_options)
+    return output.getvalue(), (os.getpid(), decode_cache.stats())
+
+def combined_cache_stats(worker_stats):
+    """Add up the latest cache stats of each worker."""
+    totals = {"hits": 0, "misses": 0, "evictions": 0}
+    for stats in worker_stats.values():
+        for name in totals:
+            totals[name] += stats[name]
+    lookups = totals["hits"] + totals["misses"]
+    totals["hit_rate"] = totals["hits"] / lookups if lookups else 0.0
+    return totals
+
+def iter_batches(lines, size):
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def decode_parallel(lines, options, jobs, chunk_size=default_chunk_size, cache_size=decode_cache_size, cache_file=None, worker_stats=None):
+    """Decode batches of lines in a process pool, yielding each batch's output in log order.
+
+    Each worker keeps its own decode cache, starting from `cache_file` if given; their latest
+    stats are collected by process id into `worker_stats`.
+    """
+    worker_stats = {} if worker_stats is None else worker_stats
+    with ProcessPoolExecutor(max_workers=jobs, initializer=init_worker, initargs=(options, cache_size, cache_file)) as pool:
+        pending = deque()
+        for batch in iter_batches(lines, chunk_size):
+            pending.append(pool.submit(decode_batch, batch))
+            while len(pending) >= jobs * 2 or (pending and pending[0].done()):  # Bounded read-ahead
+                output, (pid, stats) = pending.popleft().result()
+                worker_stats[pid] = stats
+                yield output
+        while pending:
+            output, (pid, stats) = pending.popleft().result()
+            worker_stats[pid] = stats
+            yield output
+
+def ingest_log(store, debug=False):
+    """Decode the log lines from the store's newest packet on and add them to the store; returns the number added."""
+    last_epoch = store.last_epoch()
+    since = datetime.fromtimestamp(last_epoch) if last_epoch is not None else None
+    rows = []
+    added = 0
+    lines = iter_log_lines(log_file_path, since)
+    for logline, log_timestamp, client_ip, packet_data in (iter_debug_packet_lines if debug else iter_packet_lines)(lines):
+        if not (packet_data and client_ip):
+            continue
+        if last_epoch is not None and log_timestamp < last_epoch:
+            continue  # Already stored; lines at last_epoch itself are skipped by the store
+        try:
+            packet = decode_cache.parse(packet_data)
+            packet_type = infer_packet_type(packet)
+            if packet_type:
+                packet["type"] = packet_type
+            fields = json.dumps(packet)
+        except Exception as e:
+            if debug:
+                print(f"{datetime.fromtimestamp(log_timestamp)} - Error: {e}")
+            continue
+        rows.append((
+            log_timestamp, client_ip, packet.get("from"), packet.get("to"), packet_type,
+            packet.get("latitude"), packet.get("longitude"), packet_data, logline.strip(), fields
+        ))
+        if len(rows) >= store_batch_size:
+            added += store.add(rows)
+            rows = []
+    return added + store.add(rows)
+
+def query_store(store, duration, filter_type=None, search_term=None):
+    """Print the stored packets matching the filters, as decode_aprs_packet() prints them."""
+    since = time.time() - duration.total_seconds() if duration else None
+    for logline, fields in store.query(since, filter_type, search_term):
+        print(f"Logline: {logline}")
+        print(json.dumps(json.loads(fields), indent=4, ensure_ascii=False))
 
 def main():
+    global decode_cache
+
     parser = argparse.ArgumentParser(description="Decode APRS packets from log file")
     parser.add_argument(
         "-t", "--type", 
@@ -104,8 +223,22 @@ def main():
     parser.add_argument("-s", "--search", help="Case-insensitive search term")
     parser.add_argument("-d", "--duration", type=str, default="1h", help="Specify duration (e.g., 1min, 30min, 1h, 5h, 1d, 1w)")
     parser.add_argument("--debug", action="store_true", help="Enable debugging output")
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1,
+        help=f"Decode in this many worker processes (0 = one per CPU); only helps large backfills on several cores, "
+             f"so windows under {parallel_min_lines} lines are still decoded serially"
+    )
+    parser.add_argument("--chunk-size", type=int, default=default_chunk_size, help="Log lines per batch handed to a worker")
+    parser.add_argument("--cache-size", type=int, default=decode_cache_size, help="Distinct packets kept in the decode cache (0 disables it)")
+    parser.add_argument("--cache-file", help="Load the decode cache from this file, and save it back after a serial run")
+    parser.add_argument("--no-prefilter", action="store_true", help="Parse every packet, even those --type or --search rule out from the raw text")
+    parser.add_argument("--db", help="SQLite store of decoded packets: add the log lines newer than its last packet, then query it instead of the log")
+    parser.add_argument("--ingest-only", action="store_true", help="With --db, only bring the store up to date")
+    parser.add_argument("--cache-stats", action="store_true", help="Print decode cache hit/miss/eviction counts to stderr when done")
 
     args = parser.parse_args()
+    if args.db and args.jobs != 1:
+        parser.error("--jobs does not apply to --db: the store is filled and queried in this process")
     filter_type = args.type
     search_term = args.search
     duration = parse_duration(args.duration)
@@ -115,11 +248,55 @@ def main():
     if debug:
         print(f"DEBUG: Filter type: {filter_type}, Search term: {search_term}, Duration: {duration}")
 
-    with open(log_file_path, "r") as log_file:
-        for line in log_file:
-            logline, packet_data, client_ip, log_timestamp = process_log_line(line.strip(), debug)
-            if packet_data and client_ip and log_timestamp:
-                decode_aprs_packet(logline, packet_data, client_ip, log_timestamp, duration, filter_type, search_term, suppress_errors, debug)
+    # Read only the log segments and offsets that can hold the requested window
+    lines = iter_log_lines(log_file_path, datetime.now() - duration)
+    options = {
+        "duration": duration,
+        "filter_type": filter_type,
+        "search_term": search_term,
+        "suppress_errors": suppress_errors,
+        "debug": debug,
+        "prefilter": None if args.no_prefilter or not (filter_type or search_term) else Prefilter(filter_type, search_term),
+    }
+    jobs = args.jobs or os.cpu_count()
+    if jobs > 1:
+        # Look ahead far enough to know whether the window is worth a process pool
+        head = list(itertools.islice(lines, parallel_min_lines))
+        if len(head) < parallel_min_lines:
+            jobs = 1
+        lines = itertools.chain(head, lines)
+    if args.db:
+        decode_cache = DecodeCache(args.cache_size, args.cache_file)
+        store = PacketStore(args.db)
+        try:
+            added = ingest_log(store, debug)
+            if debug:
+                print(f"DEBUG: Added {added} packets to {args.db}")
+            if not args.ingest_only:
+                query_store(store, duration, filter_type, search_term)
+        finally:
+            store.close()
+        if args.cache_file:
+            decode_cache.save()
+        cache_stats = decode_cache.stats()
+    elif jobs > 1:
+        worker_stats = {}
+        for output in decode_parallel(lines, options, jobs, args.chunk_size, args.cache_size, args.cache_file, worker_stats):
+            sys.stdout.write(output)
+        cache_stats = combined_cache_stats(worker_stats)
+    else:
+        decode_cache = DecodeCache(args.cache_size, args.cache_file)
+        decode_lines(lines, **options)
+        if args.cache_file:
+            decode_cache.save()
+        cache_stats = decode_cache.stats()
+
+    if args.cache_stats or debug:
+        print(
+            f"Decode cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+            f"{cache_stats['evictions']} evictions ({cache_stats['hit_rate']:.1%} hit rate)",
+            file=sys.stderr
+        )
 
 if __name__ == "__main__":
     main()
@@ -2,14 +2,33 @@
 import serial
 import time
 import re
+import os
+import argparse
+import threading
+from collections import deque
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from fake_aprs_is_log import iter_records, log_replaced, KIND_PACKET
 
 # Configuration
 log_file_path = '/home/lighthouse/fake-aprs-is/fake-aprs-is-logs/fake-aprs-is.log'
 serial_port = '/dev/ttyS1'  # Update to your console port
 baud_rate = 9600           # Adjust to match your radio's configuration
-last_sent_packets = {}     # Cache for normalized packets with their timestamps
+dedup_window = 1.0         # Seconds within which a repeat of a sent packet is not sent again
+stats_interval = 3600      # Seconds between counter reports; 0 turns them off
+queue_size = 50            # Packets waiting for the serial link before some are dropped
+drop_policy = 'lowest'     # Which packet a full queue drops: 'lowest' priority, or 'oldest' of any priority
+airtime_window = 10        # Seconds over which the transmit budget is counted
+airtime_share = 0.5        # Share of the serial link's bytes per window the forwarder may use
+transmit_gap = 0.2         # Seconds the link is left idle between packets, so the radio never gets them back to back
+
+# Transmit priority by data type identifier (the first body character), 0 first; others are 1
+PRIORITIES = {
+    ':': 0,  # Messages, acks and bulletins
+    '!': 2, '=': 2, '/': 2, '@': 2, '`': 2, "'": 2,  # Positions, the bulk of the traffic
+    '_': 2,  # Weather
+    'T': 2,  # Telemetry
+}
 
 # Patterns to ignore
 ignore_patterns = [
@@ -17,78 +36,338 @@ ignore_patterns = [
     r'TCPIP\*'  # Lines containing TCPIP* in the source/destination
 ]
 
-def extract_packet(log_line):
-    """Extract APRS packet from a log line using regex."""
-    match = re.search(r'Received packet: (.+)', log_line)
-    if match:
-        return match.group(1)
-    return None
+# Compiled once: every ignore pattern as one alternation, and the q construct normalize_packet() removes
+IGNORE_MATCHER = re.compile("|".join(f"(?:{pattern})" for pattern in ignore_patterns))
+Q_CONSTRUCT = re.compile(r",q[A-Z]+,[^:]+:")
+
+def iter_packets(lines):
+    """Yield the APRS packet of every 'Received packet:' line."""
+    for _, _, kind, packet in iter_records(lines):
+        if kind == KIND_PACKET and packet:
+            yield packet
 
 def normalize_packet(packet):
     """Normalize a packet string by removing dynamic parts."""
-    # Remove any dynamic identifiers using regex
-    normalized = re.sub(r",q[A-Z]+,[^:]+:", "", packet)
-    return normalized.strip()
+    # Remove the q construct and the iGate that added it
+    return Q_CONSTRUCT.sub("", packet).strip()
 
 def should_ignore_packet(packet):
     """Check if the packet matches any ignore patterns."""
-    for pattern in ignore_patterns:
-        if re.search(pattern, packet):
-            return True
-    return False
-
-def is_unique_packet(packet):
-    """Check if a normalized packet is unique within the last second."""
-    current_time = time.time()
-    normalized_packet = normalize_packet(packet)
-    if normalized_packet in last_sent_packets:
-        if current_time - last_sent_packets[normalized_packet] < 1:
-            return False  # Duplicate within the same second
-    last_sent_packets[normalized_packet] = current_time
-    return True
+    return IGNORE_MATCHER.search(packet) is not None
+
+class DedupCache:
+    """Normalized packets sent in the last `window` seconds, forgotten as they expire.
+
+    Entries are kept in a deque in the order they were sent, next to a dict for lookups; expired
+    entries are dropped from the front on every check, so the size stays bounded by the traffic
+    in one window however long the forwarder runs.
+    """
+
+    def __init__(self, window=dedup_window):
+        self.window = window
+        self.sent = {}          # normalized packet -> time it was last sent
+        self.order = deque()    # (time, normalized packet), oldest first
+        self.hits = 0           # Duplicates suppressed
+        self.misses = 0         # Packets let through
+        self.evictions = 0      # Entries expired
+
+    def is_unique(self, packet, now=None):
+        """Return True and remember the packet unless it was sent within the window."""
+        now = time.time() if now is None else now
+        while self.order and now - self.order[0][0] >= self.window:
+            sent_time, key = self.order.popleft()
+            if self.sent.get(key) == sent_time:  # Not sent again since
+                del self.sent[key]
+                self.evictions += 1
+        normalized_packet = normalize_packet(packet)
+        if normalized_packet in self.sent:
+            self.hits += 1
+            return False  # Duplicate within the window
+        self.sent[normalized_packet] = now
+        self.order.append((now, normalized_packet))
+        self.misses += 1
+        return True
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the current size."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.sent),
+            "window": self.window,
+        }
+
+def packet_priority(packet):
+    """Return the transmit priority of a packet, lower first."""
+    body = packet.partition(':')[2]
+    return PRIORITIES.get(body[:1], 1)
+
+POSITION_IDENTIFIERS = "!=/@`'"  # Position reports, plain or Mic-E, all superseded by a station's next one
+ITEM_NAME_END = re.compile(r"[!_]")  # An item's name runs up to its live/killed flag
+
+def coalesce_key(packet, priority):
+    """Return the key under which a newer packet replaces a queued one, or None if none may.
+
+    A station's newer position or status report, or a newer report of the same object or item,
+    supersedes the one still waiting. Everything else is sent as is: messages, telemetry frames
+    (each carries its own sequence number), third-party packets and other types.
+    """
+    if priority == 0:
+        return None
+    header, _, body = packet.partition(':')
+    source = header.partition('>')[0]
+    identifier = body[:1]
+    if identifier and identifier in POSITION_IDENTIFIERS:
+        return source, "position"
+    if identifier == '>':
+        return source, "status"
+    if identifier == ';' and len(body) >= 11:
+        return source, "object", body[1:10]
+    if identifier == ')':
+        name_end = ITEM_NAME_END.search(body, 1)
+        if name_end:
+            return source, "item", body[1:name_end.start()]
+    return None
+
+class TransmitQueue:
+    """Packets waiting for the serial link, sent by a thread of their own within an airtime budget.
+
+    put() never blocks: a packet that cannot be sent soon enough is coalesced with a newer one
+    from the same station, or dropped when the queue is full, rather than stall the log tailing.
+    The transmit thread sends the highest priority packets first, oldest first within a priority,
+    and keeps to `share` of the link's bytes per `window` seconds, leaving `gap` seconds between
+    packets.
+    """
+
+    def __init__(self, serial_connection, max_size=queue_size, policy=drop_policy,
+                 window=airtime_window, share=airtime_share, gap=transmit_gap):
+        self.serial_connection = serial_connection
+        self.max_size = max_size
+        self.policy = policy
+        self.window = window
+        self.gap = gap
+        # 8N1 framing: ten bits on the line per byte
+        self.budget = max(1, int(serial_connection.baudrate / 10 * window * share))
+        self.levels = [deque() for _ in range(max(PRIORITIES.values()) + 1)]  # [queued time, packet, key] per priority
+        self.waiting = {}        # coalesce key -> its entry in levels
+        self.size = 0
+        self.sent_bytes = deque()  # (time, bytes) written in the last window
+        self.window_bytes = 0
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.error = None       # SerialException that stopped the transmit thread
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.thread = threading.Thread(target=self.run, name="transmit", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    def put(self, packet):
+        """Queue a packet for the transmit thread; returns at once."""
+        priority = packet_priority(packet)
+        key = coalesce_key(packet, priority)
+        with self.condition:
+            entry = self.waiting.get(key) if key else None
+            if entry is not None:
+                # Keep its place in the queue, and the time it was queued for the latency
+                print(f"Packet superseded: {entry[1]}")
+                entry[1] = packet
+                self.coalesced += 1
+                return
+            if self.size >= self.max_size and not self._drop(priority):
+                print(f"Transmit queue full, packet dropped: {packet}")
+                self.dropped += 1
+                return
+            entry = [time.monotonic(), packet, key]
+            self.levels[priority].append(entry)
+            if key:
+                self.waiting[key] = entry
+            self.size += 1
+            self.max_depth = max(self.max_depth, self.size)
+            self.condition.notify()
+
+    def _drop(self, priority):
+        """Make room for a packet of the given priority; returns False if that packet is to be dropped instead."""
+        if self.policy == 'oldest':
+            level = min((level for level in self.levels if level), key=lambda level: level[0][0])
+        else:
+            lowest = max(i for i, level in enumerate(self.levels) if level)
+            if lowest < priority:
+                return False  # Everything queued outranks the new packet
+            level = self.levels[lowest]
+        _, packet, key = level.popleft()
+        if key:
+            del self.waiting[key]
+        self.size -= 1
+        self.dropped += 1
+        print(f"Transmit queue full, packet dropped: {packet}")
+        return True
+
+    def _next_level(self):
+        """Return the queue of the highest priority waiting packets; call with the condition held and the queue not empty."""
+        return next(level for level in self.levels if level)
+
+    def _take(self):
+        """Remove and return the next entry to send; call with the condition held and the queue not empty."""
+        entry = self._next_level().popleft()
+        if entry[2]:
+            del self.waiting[entry[2]]
+        self.size -= 1
+        return entry
+
+    def _budget_wait(self, size, now):
+        """Return the seconds until `size` more bytes fit in the budget."""
+        while self.sent_bytes and now - self.sent_bytes[0][0] >= self.window:
+            self.window_bytes -= self.sent_bytes.popleft()[1]
+        if self.window_bytes + size <= self.budget or not self.sent_bytes:
+            return 0
+        # Wait for enough of the oldest writes to leave the window
+        excess = self.window_bytes + size - self.budget
+        for sent_time, sent_size in self.sent_bytes:
+            excess -= sent_size
+            if excess <= 0:
+                return sent_time + self.window - now
+        return self.sent_bytes[-1][0] + self.window - now
+
+    def run(self):
+        """Send queued packets until stop() or a serial error."""
+        next_send = 0.0
+        while True:
+            with self.condition:
+                while not self.size and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    return
+                now = time.monotonic()
+                size = len(self._next_level()[0][1].encode('utf-8')) + 2  # With the CR LF
+                delay = max(next_send - now, self._budget_wait(size, now))
+                if delay > 0:
+                    # Woken early by put() or stop(); a higher priority packet may have arrived meanwhile
+                    self.condition.wait(delay)
+                    continue
+                queued_time, packet, _ = self._take()
+            data = packet.encode('utf-8') + b'\r\n'
+            try:
+                self.serial_connection.write(data)
+            except serial.SerialException as e:
+                self.error = e
+                return
+            now = time.monotonic()
+            next_send = now + self.gap
+            latency = now - queued_time
+            with self.condition:
+                self.sent_bytes.append((now, len(data)))
+                self.window_bytes += len(data)
+                self.sent += 1
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+            print(f"Packet sent to {serial_port}: {packet}")
+
+    def stats(self):
+        """Return queue depth, drop and latency counters."""
+        with self.condition:
+            return {
+                "sent": self.sent,
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "depth": self.size,
+                "max_depth": self.max_depth,
+                "latency_avg": round(self.latency_total / self.sent, 3) if self.sent else 0.0,
+                "latency_max": round(self.latency_max, 3),
+                "window_bytes": self.window_bytes,
+                "budget": self.budget,
+            }
 
 class LogFileHandler(FileSystemEventHandler):
     """Handle changes to the log file."""
-    def __init__(self, serial_connection):
-        self.serial_connection = serial_connection
+    def __init__(self, transmitter, dedup):
+        self.transmitter = transmitter
+        self.dedup = dedup
+        self.ignored = 0
         self.file = open(log_file_path, 'r')
         self.file.seek(0, 2)  # Start at the end of the file
 
     def on_modified(self, event):
         """React to the log file being modified."""
         if event.src_path == log_file_path:
-            for line in self.file:
-                packet = extract_packet(line.strip())
-                if packet:
-                    if should_ignore_packet(packet):
-                        print(f"Packet ignored: {packet}")
-                    elif not is_unique_packet(packet):
-                        print(f"Duplicate packet ignored: {packet}")
-                    else:
-                        # Send the unique and non-ignored packet to the console port
-                        self.serial_connection.write(packet.encode('utf-8') + b'\r\n')
-                        print(f"Packet sent to {serial_port}: {packet}")
+            self.forward_new_lines()
+            if log_replaced(self.file.fileno(), log_file_path, os.lseek(self.file.fileno(), 0, os.SEEK_CUR)):
+                # The collector rotated the log; the rest of the old file was sent above
+                self.file.close()
+                self.file = open(log_file_path, 'r')
+                print("Log file rotated, following the new log")
+                self.forward_new_lines()
+
+    on_created = on_modified  # A rotated log reappears as a new file
+
+    def forward_new_lines(self):
+        """Send the packets in lines appended since the last call."""
+        for packet in iter_packets(self.file):
+            if should_ignore_packet(packet):
+                self.ignored += 1
+                print(f"Packet ignored: {packet}")
+            elif not self.dedup.is_unique(packet):
+                print(f"Duplicate packet ignored: {packet}")
+            else:
+                # Queue the unique and non-ignored packet for the console port
+                self.transmitter.put(packet)
 
 def main():
+    parser = argparse.ArgumentParser(description="Forward packets from the fake-aprs-is log to a radio's serial console")
+    parser.add_argument("--dedup-window", type=float, default=dedup_window,
+                        help="Seconds within which a repeat of a sent packet, e.g. via another iGate, is not sent again")
+    parser.add_argument("--queue-size", type=int, default=queue_size,
+                        help="Packets waiting for the serial link before some are dropped")
+    parser.add_argument("--drop-policy", choices=("lowest", "oldest"), default=drop_policy,
+                        help="Drop the oldest packet of the lowest priority, or the oldest of any, when the queue is full")
+    parser.add_argument("--airtime-share", type=float, default=airtime_share,
+                        help=f"Share of the serial link's bytes per {airtime_window} s the forwarder may use")
+    args = parser.parse_args()
+
     try:
         # Open the serial port
         with serial.Serial(serial_port, baud_rate, timeout=1) as ser:
             print(f"Listening to log file and forwarding packets to {serial_port}...")
 
+            transmitter = TransmitQueue(ser, max_size=args.queue_size, policy=args.drop_policy, share=args.airtime_share)
+            transmitter.start()
+
             # Set up the log file watcher
-            event_handler = LogFileHandler(serial_connection=ser)
+            event_handler = LogFileHandler(transmitter=transmitter, dedup=DedupCache(args.dedup_window))
             observer = Observer()
-            observer.schedule(event_handler, path=log_file_path, recursive=False)
+            # Watch the directory rather than the file so the new log is seen after a rotation
+            observer.schedule(event_handler, path=os.path.dirname(log_file_path), recursive=False)
             observer.start()
 
             try:
+                next_stats = time.time() + stats_interval
                 while True:
                     time.sleep(1)
+                    if transmitter.error:
+                        raise transmitter.error
+                    if stats_interval and time.time() >= next_stats:
+                        next_stats += stats_interval
+                        print(f"Forwarder stats: {event_handler.dedup.stats()}, ignored: {event_handler.ignored}, "
+                              f"transmit: {transmitter.stats()}")
             except KeyboardInterrupt:
                 print("Exiting on user interrupt.")
+            finally:
                 observer.stop()
-
-            observer.join()
+                observer.join()
+                if transmitter.thread.is_alive():
+                    transmitter.stop()
     except serial.SerialException as e:
         print(f"Serial port error: {e}")
 
@@ -1,65 +1,425 @@
 import re
-import matplotlib.pyplot as plt
-from datetime import datetime
+import os
+import json
+import argparse
+from array import array
+from itertools import chain
+from datetime import datetime, timedelta
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+matplotlib.use("Agg")  # Only ever saves PNGs; no display needed, also in pool workers
+import matplotlib.pyplot as plt
+from fake_aprs_is_log import (
+    find_start_offset, iter_log_lines, iter_records, iter_rotated_lines, iter_segment_lines, read_fingerprint,
+    read_log_start, KIND_PACKET,
+)
 
 # Define the log file path
 log_file_path = "/home/lighthouse/fake-aprs-is/fake-aprs-is-logs/fake-aprs-is.log"
 
-# Define the regex pattern to match the desired lines and extract values
-pattern = re.compile(r'(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\.\d+) - .+ - Received packet: (\w+)>LHOUSE,TCPIP\*:@\d+z\d{4}\.\d{2}[NS]/\d{5}\.\d{2}[EW]-.*U=(\d+\.\d+)V,T=.*?(\d+\.\d+)F')
+# Define the regex pattern to match the desired packets and extract values
+pattern = re.compile(r'(\w+)>LHOUSE,TCPIP\*:@\d+z\d{4}\.\d{2}[NS]/\d{5}\.\d{2}[EW]-.*U=(\d+\.\d+)V,T=.*?(\d+\.\d+)F')
+
+marker_limit = 500  # Raw series with more samples than this are drawn as a plain line, without point markers
+
+# T# telemetry frames: the analog channels (1-5, as A1-A5) that hold the voltage and the temperature by default.
+# Their raw values only become volts and degrees through the station's EQNS coefficients, given with --telemetry-eqns.
+telemetry_channels = (1, 2)
+TELEMETRY_CALLSIGN = re.compile(r'^[A-Z0-9]{1,6}(-[A-Z0-9]{1,2})?$', re.I)
+
+# Sample sources: "lhouse" for the LHOUSE beacons matched by `pattern`, "telemetry" for T# frames.
+# Each is kept as records of this layout, in memory and in the --cache files (readable with numpy.memmap or numpy.fromfile).
+FORMAT_DTYPES = {
+    "lhouse": np.dtype([("epoch", "<f8"), ("voltage", "<f8"), ("temperature", "<f8")]),
+    "telemetry": np.dtype([("epoch", "<f8"), ("analog", "<f8", (5,))]),  # Raw A1-A5 values, NaN where missing
+}
+cache_version = 3  # Bump when the --cache layout changes; older caches are rebuilt
 
-# Initialize a dictionary to hold data for each client
-clients_data = defaultdict(lambda: {'timestamps': [], 'voltages': [], 'temperatures': []})
+def parse_duration(duration_str):
+    """Parse duration strings like '1h', '30min', etc., and return a timedelta."""
+    units = {'min': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+    num = int(''.join(filter(str.isdigit, duration_str)))
+    unit = ''.join(filter(str.isalpha, duration_str))
+    return timedelta(**{units[unit]: num})
 
-# Open the log file and process each line
-with open(log_file_path, 'r') as file:
-    for line in file:
-        match = pattern.search(line)
+def parse_analog(value):
+    try:
+        return float(value)
+    except ValueError:
+        return float("nan")
+
+def parse_sample(payload, formats=tuple(FORMAT_DTYPES)):
+    """Return (format, callsign, values) of a telemetry packet, or None if it is not one.
+
+    The values are (voltage, temperature) for "lhouse" and the five raw analog values for "telemetry".
+    """
+    # Cheap substring tests first so the regex only runs on candidate packets
+    if ">LHOUSE,TCPIP*:" in payload:
+        match = pattern.match(payload) if "lhouse" in formats else None
         if match:
-            timestamp_str, client, voltage_str, temperature_str = match.groups()
-
-            # Parse the timestamp and extract numeric values
-            timestamp = datetime.strptime(timestamp_str, "%Y-%m-%dT%H:%M:%S.%f")
-            voltage = float(voltage_str)
-            temperature = float(temperature_str)
-
-            # Append values to the respective client's data
-            clients_data[client]['timestamps'].append(timestamp)
-            clients_data[client]['voltages'].append(voltage)
-            clients_data[client]['temperatures'].append(temperature)
-
-# Check if data was found for any client
-if not clients_data:
-    print("No matching data found in log.")
-else:
-    for client, data in clients_data.items():
-        timestamps = data['timestamps']
-        voltages = data['voltages']
-        temperatures = data['temperatures']
-
-        print(f"\nData for client: {client}")
-        for i in range(len(timestamps)):
-            print(f"Timestamp: {timestamps[i]}, Voltage: {voltages[i]}V, Temperature: {temperatures[i]}F")
-
-        # Plot and save Voltage for this client
-        plt.figure(figsize=(12, 6))
-        plt.plot(timestamps, voltages, marker='o', linestyle='-', label="Voltage (V)")
-        plt.xlabel("Timestamp")
-        plt.ylabel("Voltage (V)")
-        plt.title(f"Voltage Over Time - {client}")
-        plt.legend()
-        plt.gcf().autofmt_xdate()
-        plt.savefig(f"{client}_voltage_over_time.png")
-        print(f"Voltage plot saved as {client}_voltage_over_time.png")
-
-        # Plot and save Temperature for this client
-        plt.figure(figsize=(12, 6))
-        plt.plot(timestamps, temperatures, marker='o', color='r', linestyle='-', label="Temperature (F)")
-        plt.xlabel("Timestamp")
-        plt.ylabel("Temperature (F)")
-        plt.title(f"Temperature Over Time - {client}")
-        plt.legend()
-        plt.gcf().autofmt_xdate()
-        plt.savefig(f"{client}_temperature_over_time.png")
-        print(f"Temperature plot saved as {client}_temperature_over_time.png")
+            client, voltage_str, temperature_str = match.groups()
+            return "lhouse", client, (float(voltage_str), float(temperature_str))
+        return None
+    if ":T#" not in payload or "telemetry" not in formats:
+        return None
+    header, _, body = payload.partition(':')
+    callsign = header.partition('>')[0]
+    if not body.startswith("T#") or not TELEMETRY_CALLSIGN.match(callsign):
+        return None
+    analog = body[2:].split(',')[1:6]  # After the sequence number
+    analog += [""] * (5 - len(analog))
+    return "telemetry", callsign.upper(), tuple(parse_analog(value) for value in analog)
+
+def collect_samples(lines, formats=tuple(FORMAT_DTYPES)):
+    """Return {(format, callsign): records} of the lines' samples, as FORMAT_DTYPES arrays in time order."""
+    # Compact typed arrays while reading, rather than lists of floats and datetimes
+    samples = defaultdict(lambda: (array('d'), array('d')))
+    for epoch, source, kind, payload in iter_records(lines):
+        if kind != KIND_PACKET:
+            continue
+        sample = parse_sample(payload, formats)
+        if sample:
+            sample_format, client, values = sample
+            epochs, flat_values = samples[sample_format, client]
+            epochs.append(epoch)
+            flat_values.extend(values)
+
+    series = {}
+    for (sample_format, client), (epochs, flat_values) in samples.items():
+        records = np.empty(len(epochs), dtype=FORMAT_DTYPES[sample_format])
+        records["epoch"] = np.frombuffer(epochs, dtype=np.float64)
+        values = np.frombuffer(flat_values, dtype=np.float64).reshape(len(epochs), -1)
+        if sample_format == "telemetry":
+            records["analog"] = values
+        else:
+            records["voltage"], records["temperature"] = values.T
+        order = np.argsort(records["epoch"], kind="stable")  # Log order already, barring clock steps
+        series[sample_format, client] = records[order]
+    return series
+
+def to_series(sample_format, records, telemetry=None):
+    """Return (epochs, voltages, temperatures) of a format's records, or None if they are not to be plotted.
+
+    `telemetry` is ((voltage channel, (a, b, c)), (temperature channel, (a, b, c))) for T# frames,
+    each value being a*x^2 + b*x + c of the raw x as in an EQNS message; without it they are left out.
+    """
+    if sample_format == "lhouse":
+        return records["epoch"], records["voltage"], records["temperature"]
+    if telemetry is None:
+        return None
+    converted = []
+    for channel, (a, b, c) in telemetry:
+        x = records["analog"][:, channel - 1]
+        converted.append(a * x * x + b * x + c)
+    valid = np.isfinite(converted[0]) & np.isfinite(converted[1])
+    return records["epoch"][valid], converted[0][valid], converted[1][valid]
+
+def merge_series(series, telemetry=None):
+    """Return {client: (epochs, voltages, temperatures)} of {(format, client): records}, joining a client's formats."""
+    clients_data = {}
+    for (sample_format, client), records in series.items():
+        data = to_series(sample_format, records, telemetry)
+        if data is None or not len(data[0]):
+            continue
+        if client in clients_data:
+            joined = [np.concatenate(pair) for pair in zip(clients_data[client], data)]
+            order = np.argsort(joined[0], kind="stable")
+            data = tuple(values[order] for values in joined)
+        clients_data[client] = data
+    return clients_data
+
+def load_samples(since=None, telemetry=None):
+    """Return {client: (epochs, voltages, temperatures)} as NumPy arrays in time order, from `since` on."""
+    formats = tuple(FORMAT_DTYPES) if telemetry else ("lhouse",)
+    # Process each packet of every log segment that can hold lines from `since` on
+    series = collect_samples(iter_log_lines(log_file_path, since), formats)
+    if since:
+        series = {key: records[records["epoch"] >= since.timestamp()] for key, records in series.items()}
+    return merge_series(series, telemetry)
+
+class TelemetryCache:
+    """Samples of every format and callsign in append-only binary files, with a checkpoint of the log read so far.
+
+    <directory>/<format>/<callsign>.bin holds FORMAT_DTYPES records in time order; T# frames are
+    kept raw, so --telemetry-eqns can change without a rebuild. checkpoint.json records the live
+    log's identity and the byte offset read up to, so each run only parses the lines logged since
+    the last one; after a rotation, reading continues from that offset in the closed segment.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.checkpoint_path = os.path.join(directory, "checkpoint.json")
+        self.log_identity = None    # [device, inode, fingerprint hex] of the live log
+        self.log_start = None       # Timestamp of the live log's first line, to find it again once rotated
+        self.offset = 0             # Bytes of the live log already processed
+        self.last_epoch = None      # Newest sample cached, to resume from if the log was replaced outright
+
+    def load_checkpoint(self):
+        """Load the checkpoint; returns False if there is none to continue from."""
+        try:
+            with open(self.checkpoint_path, 'r') as checkpoint_file:
+                saved = json.load(checkpoint_file)
+        except (FileNotFoundError, ValueError):
+            return False
+        if saved.get("version") != cache_version:
+            return False
+        self.log_identity = saved["log_identity"]
+        self.log_start = saved["log_start"]
+        self.offset = saved["offset"]
+        self.last_epoch = saved["last_epoch"]
+        return True
+
+    def save_checkpoint(self):
+        """Write the checkpoint atomically, after the samples it covers have been appended."""
+        saved = {
+            "version": cache_version,
+            "log_identity": self.log_identity,
+            "log_start": self.log_start,
+            "offset": self.offset,
+            "last_epoch": self.last_epoch,
+        }
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(saved, checkpoint_file)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def clear(self):
+        """Remove the cached samples, to be rebuilt from the whole log."""
+        for sample_format in FORMAT_DTYPES:
+            format_dir = os.path.join(self.directory, sample_format)
+            if os.path.isdir(format_dir):
+                for name in os.listdir(format_dir):
+                    if name.endswith('.bin'):
+                        os.remove(os.path.join(format_dir, name))
+        self.log_identity, self.log_start, self.offset, self.last_epoch = None, None, 0, None
+
+    def _same_log(self, log_path):
+        """Return True if the live log is the one the checkpoint was taken of, only appended to since."""
+        try:
+            with open(log_path, 'rb') as log_file:
+                stat = os.fstat(log_file.fileno())
+                fingerprint = read_fingerprint(log_file).hex()
+        except FileNotFoundError:
+            return False
+        device, inode, saved_fingerprint = self.log_identity or (None, None, "")
+        return (stat.st_dev, stat.st_ino) == (device, inode) and fingerprint.startswith(saved_fingerprint) and stat.st_size >= self.offset
+
+    def read_appended(self, log_path):
+        """Yield the complete lines written to the live log since the last processed offset."""
+        with open(log_path, 'rb') as log_file:
+            stat = os.fstat(log_file.fileno())
+            self.log_identity = [stat.st_dev, stat.st_ino, read_fingerprint(log_file).hex()]
+            self.log_start = read_log_start(log_file)
+            log_file.seek(self.offset)
+            for line in log_file:
+                if not line.endswith(b'\n'):
+                    break  # Still being written; picked up by the next run
+                self.offset += len(line)
+                yield line.decode('utf-8', errors='replace')
+
+    def update(self, log_path):
+        """Append the samples logged since the checkpoint; returns the number added."""
+        os.makedirs(self.directory, exist_ok=True)
+        if not self.load_checkpoint():
+            self.clear()
+        if self.log_identity is not None and self._same_log(log_path):
+            lines = self.read_appended(log_path)
+        else:
+            # First run, or the live log was rotated: the rest of the checkpointed log, now a closed segment
+            lines = iter_rotated_lines(log_path, self.log_start, self.offset) if self.log_start else None
+            since = None
+            if lines is None:
+                # Replaced outright, or its segment is gone: everything from the newest cached sample on.
+                # Samples already cached are skipped per callsign by append().
+                since = datetime.fromtimestamp(self.last_epoch) if self.last_epoch is not None else None
+                lines = iter_segment_lines(log_path, since)
+            self.offset = 0
+            if os.path.exists(log_path):
+                self.offset = find_start_offset(log_path, since)
+                lines = chain(lines, self.read_appended(log_path))
+        added = sum(self.append(key, records) for key, records in collect_samples(lines).items())
+        self.save_checkpoint()
+        return added
+
+    def _path(self, sample_format, client):
+        return os.path.join(self.directory, sample_format, f"{client}.bin")
+
+    def append(self, key, records):
+        """Append a series' records newer than its file's last one; returns the number appended.
+
+        The file's last record is the callsign's own checkpoint: it guards against records appended
+        by a run that was interrupted before its checkpoint, and against clock steps.
+        """
+        dtype = FORMAT_DTYPES[key[0]]
+        path = self._path(*key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab+') as sample_file:
+            size = sample_file.seek(0, os.SEEK_END)
+            if size % dtype.itemsize:
+                size = sample_file.truncate(size - size % dtype.itemsize)  # Cut short by an interrupted run
+            if size:
+                sample_file.seek(size - dtype.itemsize)
+                records = records[records["epoch"] > np.frombuffer(sample_file.read(dtype.itemsize), dtype=dtype)["epoch"][0]]
+            sample_file.write(records.tobytes())
+        if len(records):
+            newest = float(records["epoch"][-1])
+            self.last_epoch = newest if self.last_epoch is None else max(self.last_epoch, newest)
+        return len(records)
+
+    def samples(self, since=None, telemetry=None):
+        """Return {client: (epochs, voltages, temperatures)} from `since` on, from the memory-mapped files."""
+        min_epoch = since.timestamp() if since else None
+        series = {}
+        for sample_format in (FORMAT_DTYPES if telemetry else ("lhouse",)):
+            dtype = FORMAT_DTYPES[sample_format]
+            format_dir = os.path.join(self.directory, sample_format)
+            if not os.path.isdir(format_dir):
+                continue
+            for name in sorted(os.listdir(format_dir)):
+                if not name.endswith('.bin'):
+                    continue
+                path = os.path.join(format_dir, name)
+                count = os.path.getsize(path) // dtype.itemsize
+                if not count:
+                    continue  # numpy.memmap can't map an empty file
+                records = np.memmap(path, dtype=dtype, mode='r', shape=(count,))
+                start = np.searchsorted(records["epoch"], min_epoch) if min_epoch is not None else 0
+                series[sample_format, name[:-4]] = records[start:]
+        return merge_series(series, telemetry)
+
+def downsample(epochs, values, bucket_seconds):
+    """Return (bucket mid-times, minimum, mean, maximum) of the samples in each non-empty bucket."""
+    keys = np.floor(epochs / bucket_seconds).astype(np.int64)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])  # Epochs are sorted: each bucket is one run
+    counts = np.diff(np.r_[starts, len(values)])
+    return (
+        (keys[starts] + 0.5) * bucket_seconds,
+        np.minimum.reduceat(values, starts),
+        np.add.reduceat(values, starts) / counts,
+        np.maximum.reduceat(values, starts),
+    )
+
+def local_datetimes(epochs):
+    """Return epochs as datetime64 in local time, as datetime.fromtimestamp() gives them."""
+    # UTC offsets change on the hour, so one lookup per distinct hour covers DST changes
+    hours, inverse = np.unique(np.floor(epochs / 3600).astype(np.int64), return_inverse=True)
+    offsets = np.array([datetime.fromtimestamp(hour * 3600).astimezone().utcoffset().total_seconds() for hour in hours.tolist()])
+    return np.round((epochs + offsets[inverse]) * 1000).astype(np.int64).astype("datetime64[ms]")
+
+def plot_series(client, label, unit, color, epochs, values, bucket_seconds):
+    """Plot one quantity of one client and save it; returns the file name."""
+    quantity = label.lower()
+    fig, ax = plt.subplots(figsize=(12, 6))
+    try:
+        if bucket_seconds:
+            times, minimum, mean, maximum = downsample(epochs, values, bucket_seconds)
+            times = local_datetimes(times)
+            ax.fill_between(times, minimum, maximum, color=color, alpha=0.25, linewidth=0, label=f"{label} min-max")
+            ax.plot(times, mean, color=color, linestyle='-', label=f"{label} mean ({unit})")
+        else:
+            marker = 'o' if len(values) <= marker_limit else None
+            ax.plot(local_datetimes(epochs), values, marker=marker, color=color, linestyle='-', label=f"{label} ({unit})")
+        ax.set_xlabel("Timestamp")
+        ax.set_ylabel(f"{label} ({unit})")
+        ax.set_title(f"{label} Over Time - {client}")
+        ax.legend()
+        fig.autofmt_xdate()
+        filename = f"{client}_{quantity}_over_time.png"
+        fig.savefig(filename)
+    finally:
+        plt.close(fig)  # Otherwise every figure stays in pyplot's registry until exit
+    return filename
+
+def format_samples(epochs, voltages, temperatures, bucket_seconds):
+    """Return the text listing of a client's samples, or of its buckets with --bucket."""
+    if not bucket_seconds:
+        return [
+            f"Timestamp: {datetime.fromtimestamp(epoch)}, Voltage: {voltage}V, Temperature: {temperature}F"
+            for epoch, voltage, temperature in zip(epochs.tolist(), voltages.tolist(), temperatures.tolist())
+        ]
+    times, voltage_min, voltage_mean, voltage_max = downsample(epochs, voltages, bucket_seconds)
+    _, temperature_min, temperature_mean, temperature_max = downsample(epochs, temperatures, bucket_seconds)
+    return [
+        f"Bucket: {datetime.fromtimestamp(time - bucket_seconds / 2)}, Voltage: {vmin}/{vmean:.2f}/{vmax}V, "
+        f"Temperature: {tmin}/{tmean:.1f}/{tmax}F (min/mean/max)"
+        for time, vmin, vmean, vmax, tmin, tmean, tmax in zip(
+            times.tolist(), voltage_min.tolist(), voltage_mean.tolist(), voltage_max.tolist(),
+            temperature_min.tolist(), temperature_mean.tolist(), temperature_max.tolist()
+        )
+    ]
+
+def render_client(client, epochs, voltages, temperatures, bucket_seconds=None, print_samples=True):
+    """Plot both graphs of a client; returns the lines to print, so pool workers don't interleave output."""
+    output = [f"\nData for client: {client}"]
+    if print_samples:
+        output.extend(format_samples(epochs, voltages, temperatures, bucket_seconds))
+    filename = plot_series(client, "Voltage", "V", 'C0', epochs, voltages, bucket_seconds)
+    output.append(f"Voltage plot saved as {filename}")
+    filename = plot_series(client, "Temperature", "F", 'r', epochs, temperatures, bucket_seconds)
+    output.append(f"Temperature plot saved as {filename}")
+    return output
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot the voltage and temperature telemetry of each LHOUSE client")
+    parser.add_argument("-d", "--duration", type=str, help="Only plot this much of the log (e.g., 1h, 1d, 4w); default all of it")
+    parser.add_argument("-b", "--bucket", type=str, help="Plot the min/mean/max of each bucket of this length (e.g., 15min, 1h, 1d) instead of every sample")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Don't print the samples, only where the plots were saved")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Render clients in this many worker processes (0 = one per CPU)")
+    parser.add_argument("-t", "--telemetry", action="store_true", help="Also plot stations sending T# telemetry frames; needs --telemetry-eqns")
+    parser.add_argument(
+        "--telemetry-channels", default=",".join(map(str, telemetry_channels)), metavar="V,T",
+        help="Analog channels (1-5) of the T# frames holding the voltage and the temperature"
+    )
+    parser.add_argument(
+        "--telemetry-eqns", metavar="A,B,C,A,B,C",
+        help="EQNS coefficients of the voltage channel, then the temperature channel: value = a*x^2 + b*x + c of the raw x"
+    )
+    parser.add_argument("-c", "--callsign", action="append", help="Only plot this client or station (repeatable)")
+    parser.add_argument("--cache", help="Directory of per-callsign sample files, so repeated runs only read newly logged lines")
+    args = parser.parse_args()
+
+    since = datetime.now() - parse_duration(args.duration) if args.duration else None
+    bucket_seconds = parse_duration(args.bucket).total_seconds() if args.bucket else None
+    telemetry = None
+    if args.telemetry:
+        # Raw T# values are ADC counts; plotting them as volts and degrees would be meaningless
+        if not args.telemetry_eqns:
+            parser.error("--telemetry needs --telemetry-eqns, the station's EQNS coefficients for the two channels")
+        try:
+            channels = [int(channel) for channel in args.telemetry_channels.split(",")]
+            coefficients = [float(value) for value in args.telemetry_eqns.split(",")]
+        except ValueError:
+            parser.error("--telemetry-channels and --telemetry-eqns take comma-separated numbers")
+        if len(channels) != 2 or not all(1 <= channel <= 5 for channel in channels) or len(coefficients) != 6:
+            parser.error("--telemetry-channels takes two channels from 1 to 5, --telemetry-eqns six coefficients")
+        telemetry = ((channels[0], tuple(coefficients[:3])), (channels[1], tuple(coefficients[3:])))
+    if args.cache:
+        cache = TelemetryCache(args.cache)
+        cache.update(log_file_path)
+        clients_data = cache.samples(since, telemetry)
+    else:
+        clients_data = load_samples(since, telemetry)
+    if args.callsign:
+        wanted = {callsign.upper() for callsign in args.callsign}
+        clients_data = {client: data for client, data in clients_data.items() if client.upper() in wanted}
+
+    # Check if data was found for any client
+    if not clients_data:
+        print("No matching data found in log.")
+        return
+
+    tasks = [(client, *data, bucket_seconds, not args.quiet) for client, data in clients_data.items()]
+    jobs = args.jobs or os.cpu_count()
+    if jobs > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as pool:
+            results = pool.map(render_client, *zip(*tasks))
+            for output in results:
+                print("\n".join(output))
+    else:
+        for task in tasks:
+            print("\n".join(render_client(*task)))
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,54 @@
+import sys
 import json
-from http.server import BaseHTTPRequestHandler, HTTPServer
+import gzip
+import math
+import hashlib
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import threading
 import time
 import netifaces
-from datetime import datetime, timedelta
-import re
+from collections import OrderedDict, defaultdict, deque
+from itertools import islice
+from urllib.parse import parse_qsl
+from datetime import datetime
 import aprslib
+from fake_aprs_is_log import iter_log_lines_backward, iter_records, normalize_packet, LogFollower, KIND_PACKET
+from fake_aprs_is_decode import DecodeCache
+from fake_aprs_is_store import PacketStore
 
 # Configuration
 HOST = '0.0.0.0'
 HTTP_PORT = 14501
 log_file_path = "/home/lighthouse/fake-aprs-is/fake-aprs-is-logs/fake-aprs-is.log"
-all_packets = []  # Store all packets to apply filters
+all_packets = deque()  # Positions on the map, oldest first, to apply filters to
+packet_keys = set()  # Normalized raw packet of every entry in all_packets, for duplicate checks
+packets_lock = threading.Lock()  # Held while the map's positions or their indexes change or are read
+packets_added = threading.Condition(packets_lock)  # Notified for each new position, to wake /events streams
+history_size = 1000  # Packets kept on the map
+backfill_minutes = 120  # On startup, refill the map from up to this much of the end of the log; 0 turns it off
+backfill_since = None  # With --db, the store's newest epoch: the backfill reads the log back to it instead
+packet_seq = 0  # Sequence number of the newest position; each position's "seq" counts up from 1
+tracks = {}  # callsign -> deque of its positions on the map, oldest first
+track_tolerance_px = 2  # /tracks.json drops points closer than this to the simplified line at the requested zoom
+track_max_points = 500  # Points per track in /tracks.json, however long the track
+grid_cell_size = 1.0  # Degrees of latitude/longitude per spatial index cell
+cluster_max_zoom = 8  # Map zoom levels up to this get server-side clusters instead of single markers
+cluster_size_px = 60  # Width of a cluster cell on screen, in pixels
+cluster_callsigns = 10  # Callsigns listed per cluster
 center_lat = 33.4484  # Phoenix, AZ latitude
 center_lon = -112.0740  # Phoenix, AZ longitude
+decode_cache = DecodeCache()  # Repeated beacons are decoded once
+response_cache = OrderedDict()  # normalize_query() key -> Response, least recently used first
+response_cache_lock = threading.Lock()
+response_cache_size = 256  # Distinct queries whose responses are kept; 0 disables the cache
+response_cache_hits = 0
+response_cache_misses = 0
+gzip_min_size = 1024  # Smaller responses are sent uncompressed
+event_keepalive = 15  # Seconds between comments on an idle /events stream, so proxies keep it open
+popup_cache = OrderedDict()  # seq -> /packet.json Response, least recently used first
+popup_cache_lock = threading.Lock()
+popup_cache_size = 256  # Popups whose decoded packets are kept
 
 def get_all_ips():
     """Get all IP addresses of the server."""
@@ -25,239 +60,869 @@ def get_all_ips():
                 ip_addresses.append(addr['addr'])
     return ip_addresses
 
-def normalize_packet(packet):
-    """Normalize the packet by removing substrings that shouldn't affect duplicate detection."""
-    ignore_patterns = [r",qAR,[^:]*:", r",qAO,[^:]*:"]  # Add more patterns as needed
-    for pattern in ignore_patterns:
-        packet = re.sub(pattern, "", packet)
-    return packet
+class PositionRecord:
+    """One position on the map, kept small: the decoded fields are not stored, only the raw packet.
 
-def decode_packet(raw_packet):
-    """Decode the packet to extract latitude, longitude, and other details."""
+    The JSON the position lists are built from is made on first use and kept; the fields are
+    decoded again from raw, by packet_response(), when a popup asks for them.
+    """
+    __slots__ = ("seq", "epoch", "lat", "lon", "callsign", "raw", "_json")
+
+    def __init__(self, epoch, lat, lon, callsign, raw):
+        self.seq = 0  # Set by add_position()
+        self.epoch = float(epoch)
+        self.lat = float(lat)
+        self.lon = float(lon)
+        self.callsign = sys.intern(callsign)  # One string per station, however many positions it has
+        self.raw = raw
+        self._json = None
+
+    def to_json(self):
+        """Return the position as the JSON object the page draws a marker from."""
+        if self._json is None:
+            self._json = json.dumps({"seq": self.seq, "lat": self.lat, "lon": self.lon, "epoch": self.epoch, "callsign": self.callsign})
+        return self._json
+
+def dumps_positions(items):
+    """Serialize a list of PositionRecords (and cluster dicts) as a JSON array."""
+    return "[" + ", ".join(item.to_json() if isinstance(item, PositionRecord) else json.dumps(item) for item in items) + "]"
+
+def decode_packet(raw_packet, epoch=None):
+    """Decode the packet to extract latitude, longitude, and other details; `epoch` is when it was heard, default now."""
     try:
-        packet = aprslib.parse(raw_packet)
+        packet = decode_cache.parse(raw_packet)
         if "latitude" in packet and "longitude" in packet:
-            return {
-                "lat": packet["latitude"],
-                "lon": packet["longitude"],
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "fields": packet,
-                "callsign": packet.get("from", "Unknown")
-            }
+            return PositionRecord(
+                time.time() if epoch is None else epoch,
+                packet["latitude"],
+                packet["longitude"],
+                packet.get("from", "Unknown"),
+                packet["raw"],
+            )
     except aprslib.exceptions.UnknownFormat:
         print(f"Skipping unknown format: {raw_packet}")
     except Exception as e:
         print(f"Parse error for packet: {raw_packet}, Error: {e}")
     return None
 
-def process_new_aprs_data():
-    """Continuously read the log file and add only new APRS packets to the list."""
-    global all_packets
-    try:
-        with open(log_file_path, "r") as log_file:
-            log_file.seek(0, 2)  # Move to the end of the file
-            while True:
-                line = log_file.readline()
-                if not line:
-                    time.sleep(0.1)
-                    continue
-                if "Received packet:" in line:
-                    try:
-                        raw_packet = line.split("Received packet: ", 1)[1].strip()
-
-                        # Ignore `#` packets
-                        if raw_packet == "#":
-                            print("Ignored packet: #")
-                            continue
-
-                        normalized_packet = normalize_packet(raw_packet)
-
-                        # Decode the packet
-                        position = decode_packet(raw_packet)
-
-                        if position:
-                            # Check for duplicates
-                            if any(
-                                normalize_packet(p["fields"].get("raw", "")) == normalized_packet
-                                for p in all_packets
-                            ):
-                                print(f"Duplicate packet ignored: {raw_packet}")
-                                continue
-
-                            all_packets.append(position)
-                            if len(all_packets) > 1000:  # Limit history to 1000 packets
-                                all_packets = all_packets[-1000:]
-                            print(f"New packet added: {raw_packet}")
-                    except Exception as e:
-                        print(f"Error processing packet: {line.strip()}, Error: {e}")
-    except FileNotFoundError:
-        print("Log file not found. Please ensure the path is correct.")
+class PositionIndex:
+    """Grid of the map's positions by latitude/longitude cell, for viewport queries.
 
-class MapHTTPRequestHandler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        """Serve the map with filtered position data."""
-        if self.path.startswith("/new_positions.json"):
-            # Extract query parameters
-            params = self.path.split("?")
-            filters = {}
-            if len(params) > 1:
-                filters = dict(p.split("=") for p in params[1].split("&"))
-
-            # Apply time filter
-            now = datetime.now()
-            time_filter = filters.get("time", "all")
-            min_time = now - timedelta(minutes=int(time_filter)) if time_filter != "all" else None
-
-            # Apply call sign filter
-            call_sign_filter = filters.get("callsigns", "all")
-            call_signs = call_sign_filter.split(",") if call_sign_filter != "all" else None
-
-            # "Last Updated Only" filter
-            last_updated_only = filters.get("lastUpdatedOnly", "false") == "true"
-            latest_positions = {}
-
-            # Filter packets
-            filtered_packets = []
-            for p in all_packets:
-                if min_time and datetime.strptime(p["timestamp"], "%Y-%m-%d %H:%M:%S") < min_time:
-                    continue
-                if call_signs and p["callsign"] not in call_signs:
+    Positions are added and evicted in arrival order, so each cell is a deque with its oldest entry first.
+    """
+
+    def __init__(self, cell_size=grid_cell_size):
+        self.cell_size = cell_size
+        self.cells = defaultdict(deque)  # (row, column) -> deque of positions, oldest first
+
+    def cell(self, lat, lon):
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def add(self, position):
+        self.cells[self.cell(position.lat, position.lon)].append(position)
+
+    def remove_oldest(self, position):
+        """Remove a position evicted from the map, which is the oldest entry in its cell."""
+        key = self.cell(position.lat, position.lon)
+        bucket = self.cells[key]
+        bucket.popleft()
+        if not bucket:
+            del self.cells[key]
+
+    def query(self, boxes):
+        """Return the positions inside any of the (west, south, east, north) boxes, unordered."""
+        found = []
+        for box in boxes:
+            west, south, east, north = box
+            south_row, west_column = self.cell(max(south, -90.0), west)
+            north_row, east_column = self.cell(min(north, 90.0), east)
+            cell_count = max(north_row - south_row + 1, 0) * max(east_column - west_column + 1, 0)
+            if cell_count > len(self.cells):
+                # A wide view covers more cells than are occupied; walk the occupied ones instead
+                keys = [key for key in self.cells if south_row <= key[0] <= north_row and west_column <= key[1] <= east_column]
+            else:
+                keys = [(row, column) for row in range(south_row, north_row + 1) for column in range(west_column, east_column + 1)]
+            for key in keys:
+                bucket = self.cells.get(key)
+                if not bucket:
                     continue
-                if last_updated_only:
-                    latest_positions[p["callsign"]] = p
+                row, column = key
+                if south_row < row < north_row and west_column < column < east_column:
+                    found.extend(bucket)  # Cells inside the box need no per-position test
                 else:
-                    filtered_packets.append(p)
+                    found.extend(position for position in bucket if in_box(box, position))
+        return found
 
-            if last_updated_only:
-                filtered_packets = list(latest_positions.values())
+position_index = PositionIndex()  # Spatial index over all_packets
 
-            # Serve filtered packets
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(filtered_packets).encode("utf-8"))
-        elif self.path.startswith("/callsigns.json"):
-            # Return unique list of call signs
-            unique_callsigns = list(set(p["callsign"] for p in all_packets if p["callsign"] != "Unknown"))
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(unique_callsigns).encode("utf-8"))
+def in_box(box, position):
+    west, south, east, north = box
+    return south <= position.lat <= north and west <= position.lon <= east
+
+def parse_bbox(value):
+    """Parse Leaflet's toBBoxString() "west,south,east,north" into boxes within -180..180 longitude.
+
+    Leaflet's longitudes keep growing as the map is panned around the world, so the view is wrapped
+    back, and a view crossing the antimeridian becomes two boxes.
+    """
+    west, south, east, north = (float(v) for v in value.split(","))
+    if east - west >= 360:
+        return [(-180.0, south, 180.0, north)]
+    width = east - west
+    west = (west + 180) % 360 - 180
+    east = west + width
+    if east > 180:
+        return [(west, south, 180.0, north), (-180.0, south, east - 360, north)]
+    return [(west, south, east, north)]
+
+def add_position(position):
+    """Add a decoded position unless the same packet, relayed by another iGate, is already on the map."""
+    global packet_seq
+    normalized_packet = normalize_packet(position.raw)
+    with packets_lock:
+        if normalized_packet in packet_keys:
+            return False
+
+        packet_seq += 1
+        position.seq = packet_seq
+        all_packets.append(position)
+        packet_keys.add(normalized_packet)
+        position_index.add(position)
+        tracks.setdefault(position.callsign, deque()).append(position)
+        while len(all_packets) > history_size:  # Limit history, forgetting the oldest packet
+            evicted = all_packets.popleft()
+            packet_keys.discard(normalize_packet(evicted.raw))
+            position_index.remove_oldest(evicted)
+            track = tracks[evicted.callsign]
+            track.popleft()  # The oldest position on the map is also the oldest of its track
+            if not track:
+                del tracks[evicted.callsign]
+        packets_added.notify_all()
+    return True
+
+def query_positions(boxes=None, last_updated_only=False):
+    """Return the map's positions in arrival order, limited to the parse_bbox() boxes if given.
+
+    With last_updated_only, only each callsign's newest position is returned, and only if it is in view.
+    """
+    with packets_lock:
+        if last_updated_only:
+            positions = [track[-1] for track in tracks.values()]
+        elif boxes is not None:
+            positions = position_index.query(boxes)
         else:
-            # Serve the HTML map page
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html")
-            self.end_headers()
-            html_content = f"""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>Real-Time APRS Packet Map</title>
-                <link rel="stylesheet" href="https://unpkg.com/leaflet/dist/leaflet.css" />
-                <script src="https://unpkg.com/leaflet/dist/leaflet.js"></script>
-            </head>
-            <body>
-                <h1>Real-Time APRS Packet Map</h1>
-                <div id="map" style="width: 100%; height: 600px;"></div>
-                <div>
-                    <label>Filter by Time:</label>
-                    <input type="range" id="timeFilter" min="1" max="121" value="121" oninput="updateTimeLabel(this.value)" onchange="updateFilters()" />
-                    <span id="timeLabel">All</span>
-                    <br/>
-                    <label>Filter by Call Signs:</label>
-                    <select id="callsignFilter" multiple onchange="updateFilters()">
-                        <option value="all" selected>All</option>
-                    </select>
-                    <br/>
-                    <input type="checkbox" id="lastUpdatedOnly" onchange="updateFilters()" />
-                    <label for="lastUpdatedOnly">Last Updated Only</label>
-                    <br/>
-                    <button onclick="location.reload()">Refresh Map</button>
-                </div>
-                <script>
-                    const map = L.map('map');
-                    let savedCenter = localStorage.getItem("mapCenter");
-                    let savedZoom = localStorage.getItem("mapZoom");
-
-                    if (savedCenter && savedZoom) {{
-                        map.setView(JSON.parse(savedCenter), parseInt(savedZoom));
-                    }} else {{
-                        map.setView([{center_lat}, {center_lon}], 13);
-                    }}
+            return list(all_packets)
+    if last_updated_only and boxes is not None:
+        positions = [p for p in positions if any(in_box(box, p) for box in boxes)]
+    positions.sort(key=lambda p: p.seq)
+    return positions
 
-                    const baseLayers = {{
-                        "Street Map": L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{
-                            maxZoom: 19,
-                            attribution: 'Â© OpenStreetMap contributors'
-                        }}),
-                        "Satellite": L.tileLayer('https://mt1.google.com/vt/lyrs=s&x={{x}}&y={{y}}&z={{z}}', {{
-                            maxZoom: 20,
-                            attribution: 'Â© Google'
-                        }}),
-                        "Topographic": L.tileLayer('https://{{s}}.tile.opentopomap.org/{{z}}/{{x}}/{{y}}.png', {{
-                            maxZoom: 17,
-                            attribution: 'Â© OpenTopoMap contributors'
-                        }})
-                    }};
-                    baseLayers["Street Map"].addTo(map);
-                    L.control.layers(baseLayers).addTo(map);
-
-                    async function updateFilters() {{
-                        const timeFilter = document.getElementById("timeFilter").value;
-                        const callsignFilter = Array.from(document.getElementById("callsignFilter").selectedOptions).map(opt => opt.value).join(",");
-                        const lastUpdatedOnly = document.getElementById("lastUpdatedOnly").checked;
-                        const response = await fetch(`/new_positions.json?time=${{timeFilter === "121" ? "all" : timeFilter}}&callsigns=${{callsignFilter}}&lastUpdatedOnly=${{lastUpdatedOnly}}`);
-                        const newPositions = await response.json();
-                        map.eachLayer(layer => layer instanceof L.Marker && map.removeLayer(layer));
-                        newPositions.forEach(position => {{
-                            const fieldsData = JSON.stringify(position.fields, null, 2)
-                                .replace(/\\n/g, "<br/>")
-                                .replace(/ /g, "&nbsp;");
-                            L.marker([position.lat, position.lon]).addTo(map)
-                                .bindPopup(`Callsign: ${'{'}position.callsign{'}'}<br/>Data:<br/>${'{'}fieldsData{'}'}`);
-                        }});
-                    }}
+def mercator(lat, lon):
+    """Project to Web Mercator, scaled to degrees of longitude, where distances compare like on screen."""
+    lat = max(min(lat, 85.0511), -85.0511)
+    return lon, math.degrees(math.log(math.tan(math.pi / 4 + math.radians(lat) / 2)))
+
+def track_importance(points, floor=0.0):
+    """Rank the points of a [lat, lon] polyline for Douglas-Peucker simplification.
+
+    Returns, for each point, the largest tolerance (in Mercator degrees) at which Douglas-Peucker
+    keeps it; the end points are infinite. Keeping the points ranked above a tolerance gives the
+    simplified track at that tolerance, and keeping the N best gives the closest N-point track.
+    Points that would be dropped at `floor` anyway are not ranked (left at 0), which saves the work.
+    """
+    importance = [0.0] * len(points)
+    if not points:
+        return importance
+    importance[0] = importance[-1] = math.inf
+    projected = [mercator(lat, lon) for lat, lon in points]
+    stack = [(0, len(points) - 1, math.inf)]
+    while stack:
+        first, last, parent = stack.pop()
+        if last - first < 2:
+            continue
+        x1, y1 = projected[first]
+        dx, dy = projected[last][0] - x1, projected[last][1] - y1
+        length_squared = dx * dx + dy * dy
+        farthest, max_distance = first + 1, -1.0
+        for i in range(first + 1, last):
+            x, y = projected[i]
+            # Distance to the segment, not the line through it: tracks double back
+            t = max(0.0, min(1.0, ((x - x1) * dx + (y - y1) * dy) / length_squared)) if length_squared else 0.0
+            distance = math.hypot(x - x1 - t * dx, y - y1 - t * dy)
+            if distance > max_distance:
+                farthest, max_distance = i, distance
+        # A point is only kept if the split that made room for it was, hence the cap at the parent's rank
+        importance[farthest] = min(max_distance, parent)
+        if importance[farthest] <= floor:
+            continue
+        stack.append((first, farthest, importance[farthest]))
+        stack.append((farthest, last, importance[farthest]))
+    return importance
+
+def simplify_track(points, tolerance, max_points=None):
+    """Douglas-Peucker: drop points of a [lat, lon] polyline within `tolerance` (Mercator degrees) of the simplified line.
+
+    With max_points, the tolerance is raised as far as needed to keep at most that many points.
+    """
+    if len(points) < 3:
+        return points
+    importance = track_importance(points, tolerance)
+    if max_points is not None and len(points) > max_points:
+        tolerance = max(tolerance, sorted(importance, reverse=True)[max_points - 1])
+    return [point for point, rank in zip(points, importance) if rank > tolerance or rank == math.inf]
+
+def positions_since(since, boxes=None, last_updated_only=False):
+    """Return (positions with a seq above since in arrival order, newest seq, oldest seq still on the map).
+
+    Positions are appended with consecutive seqs, so the new ones are the tail of all_packets.
+    """
+    with packets_lock:
+        count = min(max(packet_seq - since, 0), len(all_packets))
+        new_positions = list(islice(reversed(all_packets), count))
+        newest, oldest = packet_seq, packet_seq - len(all_packets) + 1
+    new_positions.reverse()
+    if last_updated_only:
+        new_positions = list({p.callsign: p for p in new_positions}.values())
+        new_positions.sort(key=lambda p: p.seq)
+    if boxes is not None:
+        new_positions = [p for p in new_positions if any(in_box(box, p) for box in boxes)]
+    return new_positions, newest, oldest
+
+def cluster_positions(positions, zoom):
+    """Merge positions that would overlap at this zoom level into cluster markers.
+
+    Positions alone in their cell are kept as they are; the others become
+    {"cluster": true, "count", "lat", "lon", "callsigns"} at the mean of their coordinates.
+    """
+    cell_size = cluster_size_px * 360 / (256 * 2 ** zoom)  # 256 pixel tiles, 2**zoom of them around the world
+    cells = {}
+    for p in positions:
+        cells.setdefault((math.floor(p.lat / cell_size), math.floor(p.lon / cell_size)), []).append(p)
+    markers = []
+    for members in cells.values():
+        if len(members) == 1:
+            markers.append(members[0])
+            continue
+        markers.append({
+            "cluster": True,
+            "count": len(members),
+            "lat": sum(p.lat for p in members) / len(members),
+            "lon": sum(p.lon for p in members) / len(members),
+            "callsigns": sorted(set(p.callsign for p in members))[:cluster_callsigns],
+        })
+    return markers
+
+def load_history(db_path):
+    """Start the map from the newest positions in the decoded-packet store written by the decoder's --db.
+
+    Returns the store's newest epoch, from which the log still has to be read, or None if it is empty.
+    """
+    store = PacketStore(db_path)
+    try:
+        # Copies of a packet from other iGates are stored too; fetch more rows until there are enough distinct ones
+        limit = history_size
+        while True:
+            rows = store.recent_positions(limit)
+            if len(rows) < limit or len(set(normalize_packet(row[4]) for row in rows)) >= history_size:
+                break
+            limit *= 2
+        last_epoch = store.last_epoch()
+    finally:
+        store.close()
+    for epoch, from_call, lat, lon, raw_packet in rows:
+        add_position(PositionRecord(epoch, lat, lon, from_call or "Unknown", raw_packet))
+    print(f"Loaded {len(all_packets)} packets from {db_path}")
+    return last_epoch
+
+def backfill(follower):
+    """Refill the map from the end of the log, reading backwards from where the follower starts.
+
+    Reading stops once history_size distinct positions or backfill_minutes of log have been seen, so
+    startup takes as long as the history asked for, not the size of the log. With backfill_since set
+    (by --db), it reads back to that epoch instead, so nothing logged after the store's last ingest is
+    missed; packets already loaded from the store are skipped as duplicates. The positions are added
+    oldest first, as the live ingester would have, and the follower goes on from the same offset.
+    """
+    cutoff = time.time() - backfill_minutes * 60 if backfill_since is None else backfill_since
+    positions = []
+    keys = set()
+    lines = iter_log_lines_backward(log_file_path, follower.fd, follower.offset)
+    for epoch, _, kind, raw_packet in iter_records(lines):
+        if epoch < cutoff:
+            break
+        if kind != KIND_PACKET or raw_packet == "#":
+            continue
+        position = decode_packet(raw_packet, epoch)
+        if position:
+            positions.append(position)
+            keys.add(normalize_packet(raw_packet))
+            if len(keys) >= history_size:
+                break
+    lines.close()
+    added = sum(add_position(position) for position in reversed(positions))
+    if backfill_since is None:
+        print(f"Backfilled {added} packets from the last {backfill_minutes} minutes of the log")
+    else:
+        print(f"Backfilled {added} packets logged since the store's last ingest")
+
+def process_new_aprs_data():
+    """Follow the log file and add only new APRS packets to the list."""
+    follower = LogFollower(log_file_path)
+    if follower.fd is None:
+        print("Log file not found, waiting for it to appear. Please ensure the path is correct.")
+    elif backfill_minutes or backfill_since is not None:
+        backfill(follower)
+    reopened = 0
+    for lines in follower.batches():
+        if follower.reopened != reopened:
+            reopened = follower.reopened
+            print("Log file rotated, following the new log")
+        for _, _, kind, raw_packet in iter_records(lines):
+            if kind != KIND_PACKET:
+                continue
+            try:
+                # Ignore `#` packets
+                if raw_packet == "#":
+                    print("Ignored packet: #")
+                    continue
+
+                # Decode the packet
+                position = decode_packet(raw_packet)
+
+                if position:
+                    # Skip duplicates
+                    if not add_position(position):
+                        print(f"Duplicate packet ignored: {raw_packet}")
+                        continue
+                    print(f"New packet added: {raw_packet}")
+            except Exception as e:
+                print(f"Error processing packet: {raw_packet}, Error: {e}")
+
+class Response:
+    """A serialized response body with its ETag, and a gzipped copy made on first use."""
+
+    def __init__(self, body, content_type, generation=None, expires=math.inf, count=None):
+        self.body = body
+        self.content_type = content_type
+        self.etag = f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+        self.generation = generation  # packet_seq the body was built at
+        self.expires = expires  # When time-filtered contents go stale even without new packets
+        self.count = count  # Positions or markers in the body
+        self._gzipped = None
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+def normalize_query(query):
+    """Reduce /new_positions.json or /events query parameters to a response cache key.
 
-                    async function loadCallSigns() {{
-                        const response = await fetch("/callsigns.json");
-                        const callsigns = await response.json();
-                        const callsignFilter = document.getElementById("callsignFilter");
-                        callsignFilter.innerHTML = "<option value='all' selected>All</option>";
-                        callsigns.forEach(call => {{
-                            const option = document.createElement("option");
-                            option.value = call;
-                            option.text = call;
-                            callsignFilter.appendChild(option);
-                        }});
+    Parameter order, callsign order and zoom levels that are not clustered do not change the response.
+    """
+    filters = dict(parse_qsl(query))
+    time_filter = filters.get("time", "all")
+    minutes = int(time_filter) if time_filter != "all" else None
+    call_sign_filter = filters.get("callsigns", "all")
+    call_signs = tuple(sorted(set(call_sign_filter.split(",")))) if call_sign_filter != "all" else None
+    last_updated_only = filters.get("lastUpdatedOnly", "false") == "true"
+    boxes = tuple(parse_bbox(filters["bbox"])) if "bbox" in filters else None  # "west,south,east,north" as sent by the page
+    zoom = int(filters["zoom"]) if "zoom" in filters else None
+    if zoom is not None and zoom > cluster_max_zoom:
+        zoom = None
+    since = int(filters["since"]) if "since" in filters else None
+    return minutes, call_signs, last_updated_only, boxes, zoom, since
+
+def cached_response(key, build):
+    """Return the cached Response for key if no packet arrived since and it has not expired, else build() a new one."""
+    global response_cache_hits, response_cache_misses
+    with response_cache_lock:
+        response = response_cache.get(key)
+        if response is not None and response.generation == packet_seq and time.time() < response.expires:
+            response_cache.move_to_end(key)
+            response_cache_hits += 1
+            return response
+        response_cache_misses += 1
+    response = build()
+    if response_cache_size:
+        with response_cache_lock:
+            response_cache[key] = response
+            response_cache.move_to_end(key)
+            while len(response_cache) > response_cache_size:
+                response_cache.popitem(last=False)
+    return response
+
+def filter_positions(positions, min_epoch, call_signs):
+    """Apply the time and call sign filters."""
+    return [
+        p for p in positions
+        if (min_epoch is None or p.epoch >= min_epoch) and (not call_signs or p.callsign in call_signs)
+    ]
+
+def positions_response(key):
+    """Build the /new_positions.json response for a normalize_query() key.
+
+    Without since, the response is the list of positions (or clusters). With since=<seq> it is
+    {"seq", "oldest", "full", "positions"}: only positions newer than that seq, or everything with
+    "full" set when since is 0, ahead of the server (restarted) or the view is clustered. Clients
+    drop positions older than "oldest", which have left the map's history.
+    """
+    def build():
+        minutes, call_signs, last_updated_only, boxes, zoom, since = key
+        generation = packet_seq  # Read first, so a packet arriving meanwhile leaves the response stale
+        min_epoch = time.time() - minutes * 60 if minutes is not None else None
+        full = since is None or since == 0 or since > generation or zoom is not None
+
+        # Apply time, call sign, "Last Updated Only" and viewport filters
+        if full:
+            filtered_packets = filter_positions(query_positions(boxes, last_updated_only), min_epoch, call_signs)
+            oldest = generation - len(all_packets) + 1
+        else:
+            new_positions, _, oldest = positions_since(since, boxes, last_updated_only)
+            filtered_packets = filter_positions(new_positions, min_epoch, call_signs)
+
+        # With a time filter, the response changes when its oldest packet ages out
+        expires = math.inf
+        if min_epoch is not None and filtered_packets:
+            expires = min(p.epoch for p in filtered_packets) + minutes * 60
+
+        # Cluster markers when zoomed out
+        if zoom is not None:
+            filtered_packets = cluster_positions(filtered_packets, zoom)
+        body = dumps_positions(filtered_packets)
+        if since is not None:
+            body = f'{{"seq": {generation}, "oldest": {oldest}, "full": {json.dumps(full)}, "positions": {body}}}'
+        return Response(body.encode("utf-8"), "application/json", generation, expires, len(filtered_packets))
+
+    return cached_response(key, build)
+
+def tracks_response(query):
+    """Build the /tracks.json response: one simplified polyline per station with two or more positions.
+
+    Takes the /new_positions.json filters; the zoom sets the simplification tolerance, and a track is
+    returned whole when any of its points is in the bbox. Tracks are [{"callsign", "count", "points"}],
+    with count the positions before simplification and points [lat, lon] oldest first.
+    """
+    minutes, call_signs, _, boxes, _, _ = normalize_query(query)
+    filters = dict(parse_qsl(query))
+    zoom = int(filters["zoom"]) if "zoom" in filters else None
+    key = ("tracks", minutes, call_signs, boxes, zoom)
+
+    def build():
+        generation = packet_seq
+        with packets_lock:
+            selected = [(track[-1].seq, list(track)) for callsign, track in tracks.items() if not call_signs or callsign in call_signs]
+        min_epoch = time.time() - minutes * 60 if minutes is not None else None
+        tolerance = track_tolerance_px * 360 / (256 * 2 ** zoom) if zoom is not None else 0.0
+        selected.sort(key=lambda entry: entry[0])
+        result = []
+        expires = math.inf
+        for _, track in selected:
+            if min_epoch is not None:
+                track = [p for p in track if p.epoch >= min_epoch]
+            if len(track) < 2:
+                continue
+            if boxes is not None and not any(in_box(box, p) for p in track for box in boxes):
+                continue
+            if min_epoch is not None:
+                expires = min(expires, track[0].epoch + minutes * 60)
+            points = simplify_track([[p.lat, p.lon] for p in track], tolerance, track_max_points)
+            result.append({"callsign": track[-1].callsign, "count": len(track), "points": points})
+        return Response(json.dumps(result).encode("utf-8"), "application/json", generation, expires, len(result))
+
+    return cached_response(key, build)
+
+def packet_response(seq):
+    """Build the /packet.json response for a marker's popup: the position's packet, decoded again from raw."""
+    with popup_cache_lock:
+        response = popup_cache.get(seq)
+        if response is not None:
+            popup_cache.move_to_end(seq)
+            return response
+    with packets_lock:
+        index = seq - (packet_seq - len(all_packets) + 1)
+        position = all_packets[index] if 0 <= index < len(all_packets) else None
+    if position is None:
+        return None  # No longer on the map
+    try:
+        fields = decode_cache.parse(position.raw)
+    except Exception as e:
+        fields = {"raw": position.raw, "error": str(e)}
+    packet = {
+        "seq": position.seq,
+        "callsign": position.callsign,
+        "timestamp": datetime.fromtimestamp(position.epoch).strftime("%Y-%m-%d %H:%M:%S"),
+        "fields": fields,
+    }
+    response = Response(json.dumps(packet).encode("utf-8"), "application/json")
+    with popup_cache_lock:
+        popup_cache[seq] = response
+        while len(popup_cache) > popup_cache_size:
+            popup_cache.popitem(last=False)
+    return response
+
+def callsigns_response():
+    """Build the /callsigns.json response: the call signs on the map."""
+    def build():
+        generation = packet_seq
+        with packets_lock:
+            callsigns = [callsign for callsign in tracks if callsign != "Unknown"]
+        return Response(json.dumps(sorted(callsigns)).encode("utf-8"), "application/json", generation)
+
+    return cached_response("callsigns", build)
+
+def stats_response():
+    """Build the /stats.json response from the decode and response cache counters."""
+    stats = {
+        "packets": len(all_packets),
+        "decode_cache": decode_cache.stats(),
+        "response_cache": {
+            "hits": response_cache_hits,
+            "misses": response_cache_misses,
+            "entries": len(response_cache),
+            "max_entries": response_cache_size,
+        },
+    }
+    return Response(json.dumps(stats).encode("utf-8"), "application/json")
+
+def build_page():
+    """Return the HTML map page, built once at startup."""
+    html_content = f"""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <title>Real-Time APRS Packet Map</title>
+        <link rel="stylesheet" href="https://unpkg.com/leaflet/dist/leaflet.css" />
+        <script src="https://unpkg.com/leaflet/dist/leaflet.js"></script>
+    </head>
+    <body>
+        <h1>Real-Time APRS Packet Map</h1>
+        <div id="map" style="width: 100%; height: 600px;"></div>
+        <div>
+            <label>Filter by Time:</label>
+            <input type="range" id="timeFilter" min="1" max="121" value="121" oninput="updateTimeLabel(this.value)" onchange="updateFilters()" />
+            <span id="timeLabel">All</span>
+            <br/>
+            <label>Filter by Call Signs:</label>
+            <select id="callsignFilter" multiple onchange="updateFilters()">
+                <option value="all" selected>All</option>
+            </select>
+            <br/>
+            <input type="checkbox" id="lastUpdatedOnly" onchange="updateFilters()" />
+            <label for="lastUpdatedOnly">Last Updated Only</label>
+            <input type="checkbox" id="showTracks" onchange="updateFilters()" />
+            <label for="showTracks">Show Tracks</label>
+            <br/>
+            <button onclick="location.reload()">Refresh Map</button>
+        </div>
+        <script>
+            const map = L.map('map');
+            let savedCenter = localStorage.getItem("mapCenter");
+            let savedZoom = localStorage.getItem("mapZoom");
+
+            if (savedCenter && savedZoom) {{
+                map.setView(JSON.parse(savedCenter), parseInt(savedZoom));
+            }} else {{
+                map.setView([{center_lat}, {center_lon}], 13);
+            }}
+
+            const baseLayers = {{
+                "Street Map": L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{
+                    maxZoom: 19,
+                    attribution: 'Â© OpenStreetMap contributors'
+                }}),
+                "Satellite": L.tileLayer('https://mt1.google.com/vt/lyrs=s&x={{x}}&y={{y}}&z={{z}}', {{
+                    maxZoom: 20,
+                    attribution: 'Â© Google'
+                }}),
+                "Topographic": L.tileLayer('https://{{s}}.tile.opentopomap.org/{{z}}/{{x}}/{{y}}.png', {{
+                    maxZoom: 17,
+                    attribution: 'Â© OpenTopoMap contributors'
+                }})
+            }};
+            baseLayers["Street Map"].addTo(map);
+            L.control.layers(baseLayers).addTo(map);
+
+            const markers = L.layerGroup().addTo(map);
+            const shown = new Map();  // seq -> marker of each single position on the map
+            const shownByCallsign = new Map();  // callsign -> seq, with "Last Updated Only"
+            let latestRequest = 0;
+            let events = null;
+            let refreshTimer = null;
+
+            const trackLines = L.layerGroup().addTo(map);
+            const trackByCallsign = new Map();  // callsign -> polyline
+
+            function latestOnly() {{
+                // With tracks shown, each station gets one marker at the end of its track
+                return document.getElementById("lastUpdatedOnly").checked || document.getElementById("showTracks").checked;
+            }}
+
+            async function loadTracks(query, request) {{
+                if (!document.getElementById("showTracks").checked) {{
+                    trackLines.clearLayers();
+                    trackByCallsign.clear();
+                    return;
+                }}
+                const response = await fetch(`/tracks.json?${{query}}`);
+                const tracks = await response.json();
+                if (request !== latestRequest) {{
+                    return;
+                }}
+                trackLines.clearLayers();
+                trackByCallsign.clear();
+                tracks.forEach(track => {{
+                    trackByCallsign.set(track.callsign, L.polyline(track.points, {{weight: 2}}).addTo(trackLines));
+                }});
+            }}
+
+            function filterQuery() {{
+                const timeFilter = document.getElementById("timeFilter").value;
+                const callsignFilter = Array.from(document.getElementById("callsignFilter").selectedOptions).map(opt => opt.value).join(",");
+                const lastUpdatedOnly = latestOnly();
+                return `time=${{timeFilter === "121" ? "all" : timeFilter}}&callsigns=${{callsignFilter}}&lastUpdatedOnly=${{lastUpdatedOnly}}&bbox=${{map.getBounds().toBBoxString()}}&zoom=${{map.getZoom()}}`;
+            }}
+
+            function removeMarker(seq) {{
+                const marker = shown.get(seq);
+                markers.removeLayer(marker);
+                shown.delete(seq);
+                if (shownByCallsign.get(marker.position.callsign) === seq) {{
+                    shownByCallsign.delete(marker.position.callsign);
+                }}
+            }}
+
+            function addPosition(position) {{
+                if (position.cluster) {{
+                    L.circleMarker([position.lat, position.lon], {{radius: 10 + 3 * Math.log2(position.count)}}).addTo(markers)
+                        .bindTooltip(`${{position.count}}`, {{permanent: true, direction: "center"}})
+                        .on("click", () => map.setView([position.lat, position.lon], map.getZoom() + 2));
+                    return;
+                }}
+                if (shown.has(position.seq)) {{
+                    return;
+                }}
+                if (latestOnly()) {{
+                    if (shownByCallsign.has(position.callsign)) {{
+                        removeMarker(shownByCallsign.get(position.callsign));
                     }}
+                    shownByCallsign.set(position.callsign, position.seq);
+                }}
+                const marker = L.marker([position.lat, position.lon]).addTo(markers)
+                    .bindPopup(`Callsign: ${'{'}position.callsign{'}'}<br/>Loading...`)
+                    .on("popupopen", showPacket);
+                marker.position = position;
+                shown.set(position.seq, marker);
+            }}
+
+            async function showPacket(event) {{
+                // The packet's fields are only fetched when its popup is opened
+                const position = event.target.position;
+                const response = await fetch(`/packet.json?seq=${{position.seq}}`);
+                if (!response.ok) {{
+                    event.popup.setContent(`Callsign: ${'{'}position.callsign{'}'}<br/>No longer on the map`);
+                    return;
+                }}
+                const packet = await response.json();
+                const fieldsData = JSON.stringify(packet.fields, null, 2)
+                    .replace(/\\n/g, "<br/>")
+                    .replace(/ /g, "&nbsp;");
+                event.popup.setContent(`Callsign: ${'{'}position.callsign{'}'}<br/>Heard: ${'{'}packet.timestamp{'}'}<br/>Data:<br/>${'{'}fieldsData{'}'}`);
+            }}
 
-                    function updateTimeLabel(value) {{
-                        const label = value === "121" ? "All" : `${{value}} minutes`;
-                        document.getElementById("timeLabel").textContent = label;
+            function dropExpired(oldest) {{
+                // Positions that left the server's history, or aged out of the time filter
+                const timeFilter = document.getElementById("timeFilter").value;
+                const minEpoch = timeFilter === "121" ? 0 : Date.now() / 1000 - timeFilter * 60;
+                for (const [seq, marker] of shown) {{
+                    if (seq < oldest || marker.position.epoch < minEpoch) {{
+                        removeMarker(seq);
                     }}
+                }}
+            }}
 
-                    map.on("moveend", () => {{
-                        localStorage.setItem("mapCenter", JSON.stringify(map.getCenter()));
-                        localStorage.setItem("mapZoom", map.getZoom());
+            function showUpdate(update) {{
+                if (update.full) {{
+                    markers.clearLayers();
+                    shown.clear();
+                    shownByCallsign.clear();
+                }}
+                update.positions.forEach(addPosition);
+                dropExpired(update.oldest);
+            }}
+
+            async function updateFilters() {{
+                const query = filterQuery();
+                const request = ++latestRequest;
+                const response = await fetch(`/new_positions.json?${{query}}&since=0`);
+                const update = await response.json();
+                if (request !== latestRequest) {{
+                    return;  // The map moved again while this was loading
+                }}
+                showUpdate(update);
+                loadTracks(query, request);
+
+                // Follow new positions pushed by the server from here on
+                if (events) {{
+                    events.close();
+                }}
+                events = new EventSource(`/events?${{query}}&since=${{update.seq}}`);
+                events.addEventListener("positions", event => {{
+                    if (map.getZoom() <= {cluster_max_zoom}) {{
+                        // Clusters are built by the server; fetch them again, at most every few seconds
+                        if (!refreshTimer) {{
+                            refreshTimer = setTimeout(() => {{ refreshTimer = null; updateFilters(); }}, 3000);
+                        }}
+                        return;
+                    }}
+                    const update = JSON.parse(event.data);
+                    showUpdate(update);
+                    update.positions.forEach(position => {{
+                        const track = trackByCallsign.get(position.callsign);
+                        if (track) {{
+                            track.addLatLng([position.lat, position.lon]);  // Until the next full load simplifies it
+                        }}
                     }});
+                }});
+            }}
+
+            async function loadCallSigns() {{
+                const response = await fetch("/callsigns.json");
+                const callsigns = await response.json();
+                const callsignFilter = document.getElementById("callsignFilter");
+                callsignFilter.innerHTML = "<option value='all' selected>All</option>";
+                callsigns.forEach(call => {{
+                    const option = document.createElement("option");
+                    option.value = call;
+                    option.text = call;
+                    callsignFilter.appendChild(option);
+                }});
+            }}
+
+            function updateTimeLabel(value) {{
+                const label = value === "121" ? "All" : `${{value}} minutes`;
+                document.getElementById("timeLabel").textContent = label;
+            }}
+
+            map.on("moveend", () => {{
+                localStorage.setItem("mapCenter", JSON.stringify(map.getCenter()));
+                localStorage.setItem("mapZoom", map.getZoom());
+                updateFilters();
+            }});
+
+            loadCallSigns();
+            updateFilters();
+        </script>
+    </body>
+    </html>
+    """
+    return html_content.encode("utf-8")
+
+page_response = Response(build_page(), "text/html; charset=utf-8")
+
+class MapHTTPRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Every response has a Content-Length, so polling clients can keep the connection
+
+    def do_GET(self):
+        """Serve the map with filtered position data."""
+        path, _, query = self.path.partition("?")
+        if path == "/new_positions.json":
+            response = positions_response(normalize_query(query))
+        elif path == "/packet.json":
+            response = packet_response(int(dict(parse_qsl(query)).get("seq", 0)))
+            if response is None:
+                self.send_error(404, "Position no longer on the map")
+                return
+        elif path == "/tracks.json":
+            response = tracks_response(query)
+        elif path == "/events":
+            self.send_events(query)
+            return
+        elif path == "/stats.json":
+            # Decode and response cache counters, to see how much parsing and serializing they save
+            response = stats_response()
+        elif path == "/callsigns.json":
+            # Return unique list of call signs
+            response = callsigns_response()
+        else:
+            # Serve the HTML map page
+            response = page_response
+        self.send_cached(response)
 
-                    loadCallSigns();
-                    updateFilters();
-                </script>
-            </body>
-            </html>
-            """
-            self.wfile.write(html_content.encode("utf-8"))
+    def send_events(self, query):
+        """Stream new positions matching the query's filters as Server-Sent Events.
+
+        Each event is a /new_positions.json since=<seq> delta, unclustered, with the seq as its id so
+        a reconnecting EventSource resumes where it left off. Runs until the client goes away.
+        """
+        key = normalize_query(query)
+        since = self.headers.get("Last-Event-ID") or key[5]
+        since = packet_seq if since is None else int(since)
+        if since > packet_seq:
+            since = 0  # The server restarted; start the client over
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        try:
+            while True:
+                with packets_added:
+                    packets_added.wait_for(lambda: packet_seq > since, timeout=event_keepalive)
+                if packet_seq <= since:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    continue
+                response = positions_response(key[:4] + (None, since))
+                since = response.generation
+                if not response.count and not json.loads(response.body)["full"]:
+                    continue  # Nothing new passes this client's filters
+                self.wfile.write(b"id: %d\nevent: positions\ndata: %s\n\n" % (since, response.body))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_cached(self, response):
+        """Send a Response, or 304 Not Modified if the client already has it, gzipped if large and accepted."""
+        if response.etag in self.headers.get("If-None-Match", ""):
+            self.send_response(304)
+            self.send_header("ETag", response.etag)
+            self.end_headers()
+            return
+        body = response.body
+        self.send_response(200)
+        self.send_header("Content-Type", response.content_type)
+        self.send_header("ETag", response.etag)
+        self.send_header("Cache-Control", "no-cache")  # Revalidate on every poll
+        self.send_header("Vary", "Accept-Encoding")
+        if len(body) >= gzip_min_size and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = response.gzipped()
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
 
 def run_http_server():
     """Run the HTTP server."""
-    http_server = HTTPServer((HOST, HTTP_PORT), MapHTTPRequestHandler)
+    http_server = ThreadingHTTPServer((HOST, HTTP_PORT), MapHTTPRequestHandler)
     print(f"Server running at http://{HOST}:{HTTP_PORT}/")
     for ip in get_all_ips():
         print(f"- {ip}:{HTTP_PORT}")
     http_server.serve_forever()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Real-time APRS packet map")
+    parser.add_argument("--history", type=int, default=history_size, help="Number of positions kept on the map")
+    parser.add_argument("--db", help="Load the map's history from this decoded-packet store (see fake-aprs-is-decoder.py --db), then the log from its newest packet on")
+    parser.add_argument("--backfill-minutes", type=int, default=backfill_minutes,
+                        help="Refill the map from this many minutes at the end of the log on startup, up to --history packets; 0 turns it off")
+    args = parser.parse_args()
+    history_size = args.history
+    backfill_minutes = args.backfill_minutes
+    if args.db:
+        backfill_since = load_history(args.db)
+
     log_thread = threading.Thread(target=process_new_aprs_data, daemon=True)
     log_thread.start()
     run_http_server()
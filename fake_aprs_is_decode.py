@@ -0,0 +1,212 @@
+"""APRS decoding helpers shared by the fake-aprs-is decoder and web map."""
+import os
+import re
+import pickle
+import threading
+from collections import OrderedDict
+
+import aprslib
+
+from fake_aprs_is_log import normalize_packet
+
+decode_cache_size = 10000    # Distinct normalized packets kept by DecodeCache
+cache_file_version = 1       # Bump when the --cache-file layout changes; older files are ignored
+
+PATH_CALL = re.compile(r"^[A-Z0-9\-]{1,9}\*?$", re.I)  # What aprslib accepts as a path entry
+Q_CONSTRUCT = re.compile(r"^q..$")
+
+# Prefilter tables, mirroring how aprslib 0.7 dispatches on the data type identifier (the first body character).
+# Each identifier maps to the decoder types its packets can be given; None means any type (third-party
+# packets carry a whole inner packet). Identifiers aprslib does not decode are rejected for any --type.
+TYPE_IDENTIFIERS = {
+    '}': None,
+    '>': {"status"},
+    ':': {"message", "telemetry"},
+    '_': {"weather"},
+    '`': {"position", "telemetry"},
+    "'": {"position", "telemetry"},
+    '!': {"position", "weather", "telemetry"},
+    '=': {"position", "weather", "telemetry"},
+    '/': {"position", "weather", "telemetry"},
+    '@': {"position", "weather", "telemetry"},
+    ';': {"object", "weather"},
+}
+EMBEDDED_POSITION_TYPES = {"position", "weather", "telemetry"}  # Other identifiers with a '!' early in the body
+# Position reports (and objects) only decode as weather with the '_' symbol, and only carry telemetry in a
+# |...| comment (Mic-E also after a ' or ` flag); without those characters the types are ruled out too.
+POSITION_TYPE_MARKERS = {"weather": "_", "telemetry": "|"}
+MIC_E_TELEMETRY_MARKERS = "|'`"
+
+# Text the decoded JSON can contain that is not copied from the packet: field names, format and
+# type names, Mic-E message types, JSON literals. Search terms found in none of these, and not
+# even as a subsequence of the packet, cannot match.
+DERIVED_WORDS = (
+    "ackmsgno addresse alive altitude announcement beacon bid bits body bulletin comment compressed course "
+    "daodatumbyte format from gpsfixstatus group-bulletin humidity id identifier invalid latitude longitude "
+    "luminosity mbits message message_text messagecapable mic-e msgno mtype object object_format object_name "
+    "path phg posambiguity pressure rain_1h rain_24h rain_raw rain_since_midnight raw raw_timestamp response "
+    "rng seq snow speed status subpacket symbol symbol_table tbits telemetry telemetry-message temperature "
+    "teqns text thirdparty timestamp title to tparm tunit type uncompressed user-defined vals via weather "
+    "wind_direction wind_gust wind_speed wx wx_raw_timestamp position query nmea true false null nan infinity "
+    "m0: off duty|m1: en route|m2: in service|m3: returning|m4: committed|m5: special|m6: priority|emergency|"
+    "c0: custom-0|c1: custom-1|c2: custom-2|c3: custom-3|c4: custom-4|c5: custom-5|c6: custom-6"
+).replace("|", " ").split(" ")
+NUMBER_CHARS = set("0123456789.-+e")
+JSON_SYNTAX_CHARS = set('"\\{}[],: ')
+
+class Prefilter:
+    """Reject packets that cannot pass --type or --search, from the raw text alone.
+
+    Only packets that certainly fail are rejected, so decoding the rest gives the same output as
+    decoding everything.
+    """
+
+    def __init__(self, filter_type=None, search_term=None):
+        self.filter_type = filter_type
+        self.search_term = search_term.lower() if search_term else None
+        # Terms that could come from decoded text rather than the packet are never rejected
+        self.search_raw_only = bool(self.search_term) and not (
+            all(c in NUMBER_CHARS for c in self.search_term)
+            or any(c in JSON_SYNTAX_CHARS for c in self.search_term)
+            or any(self.search_term in word for word in DERIVED_WORDS)
+        )
+
+    def accepts(self, raw_packet):
+        """Return False if the packet can be skipped without parsing it."""
+        if self.filter_type:
+            body = raw_packet.partition(':')[2]
+            if not body:
+                return False  # aprslib rejects packets without a body
+            identifier = body[0]
+            if identifier in TYPE_IDENTIFIERS:
+                types = TYPE_IDENTIFIERS[identifier]
+            else:
+                types = EMBEDDED_POSITION_TYPES if 0 <= body.find('!', 1) < 41 else set()
+            if types is not None:
+                if self.filter_type not in types:
+                    return False
+                if identifier not in "_:" and self.filter_type in POSITION_TYPE_MARKERS:
+                    markers = MIC_E_TELEMETRY_MARKERS if identifier in "'`" and self.filter_type == "telemetry" else POSITION_TYPE_MARKERS[self.filter_type]
+                    if not any(marker in body[1:] for marker in markers):
+                        return False
+
+        if self.search_raw_only:
+            raw_lower = raw_packet.lower()
+            if self.search_term in raw_lower:
+                return True
+            if not raw_packet.isascii() or not raw_packet.isprintable() or '"' in raw_packet or '\\' in raw_packet:
+                return True  # JSON escapes add text of their own
+            # Decoded fields such as comments are the packet with pieces cut out, i.e. subsequences of it
+            remaining = iter(raw_lower)
+            return all(c in remaining for c in self.search_term)
+        return True
+
+def split_path(raw_packet):
+    """Return (path, via) as aprslib.parse() reports them, from the packet header alone."""
+    head = raw_packet.partition(':')[0]
+    path = head.partition('>')[2].split(',')[1:]
+    via = path[-1] if len(path) >= 2 and Q_CONSTRUCT.match(path[-2]) else ""
+    return path, via
+
+class DecodeCache:
+    """Size-bounded LRU cache of aprslib.parse() results, keyed on the normalized packet.
+
+    Copies of a beacon relayed by different iGates share one entry; the path-dependent fields
+    (raw, path, via) are filled in from the packet itself on every hit. Parse failures are
+    cached too and raised again as the same exception type. Safe to share between threads: the
+    entries are only touched under a lock, while aprslib.parse() itself runs outside it.
+    """
+
+    def __init__(self, max_entries=decode_cache_size, cache_file=None):
+        self.max_entries = max_entries
+        self.cache_file = cache_file
+        self.entries = OrderedDict()  # normalized packet -> (body, parsed dict or None, (exception type, message) or None)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        if cache_file:
+            self.load(cache_file)
+
+    def parse(self, raw_packet):
+        """Return aprslib.parse(raw_packet), from the cache when an equivalent packet was parsed before."""
+        if not self.max_entries:
+            return aprslib.parse(raw_packet)
+        raw_packet = raw_packet.rstrip("\r\n")
+        key = normalize_packet(raw_packet)
+        body = raw_packet.partition(':')[2]
+        path, via = split_path(raw_packet)
+        path_valid = all(PATH_CALL.match(digi) for digi in path)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] == body and path_valid:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            else:
+                entry = None
+                self.misses += 1
+        if entry is not None:
+            _, parsed, error = entry
+            if error:
+                error_type, message = error
+                raise error_type(message, raw_packet)
+            packet = dict(parsed)
+            packet.update(raw=raw_packet, path=path, via=via)
+            return packet
+
+        try:
+            packet = aprslib.parse(raw_packet)
+        except (aprslib.exceptions.ParseError, aprslib.exceptions.UnknownFormat) as e:
+            if path_valid:  # An invalid path fails in the header, which other copies may not share
+                self._store(key, (body, None, (type(e), e.message)))
+            raise
+        if path_valid:
+            self._store(key, (body, dict(packet), None))
+        return packet
+
+    def _store(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Return hit/miss/eviction counters and the current size."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def load(self, cache_file):
+        """Load entries saved by an earlier run; a missing, stale or unreadable file is ignored."""
+        try:
+            with open(cache_file, 'rb') as f:
+                saved = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return
+        if saved.get("version") != (cache_file_version, aprslib.__version__):
+            return  # A different aprslib may decode differently
+        for key, entry in saved["entries"]:
+            self._store(key, entry)
+
+    def save(self, cache_file=None):
+        """Write the entries atomically for the next run."""
+        cache_file = cache_file or self.cache_file
+        temp_path = cache_file + '.tmp'
+        with self.lock:
+            entries = list(self.entries.items())
+        with open(temp_path, 'wb') as f:
+            pickle.dump({
+                "version": (cache_file_version, aprslib.__version__),
+                "entries": entries,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_file)
@@ -0,0 +1,157 @@
+"""Framing of received byte streams into APRS lines, shared by the TCP and serial collectors."""
+import re
+
+recv_size = 16384           # Bytes read per call into LineFramer's buffer
+max_line_length = 2048      # Longer lines are discarded instead of buffered
+max_kiss_frame = 1024       # Longer KISS frames are discarded; AX.25 UI frames are at most ~330 bytes
+
+# KISS special bytes (frame end, frame escape, transposed frame end and escape)
+FEND = b'\xc0'
+FESC = b'\xdb'
+KISS_ESCAPE = re.compile(rb'\xdb([\xdc\xdd])')
+KISS_UNESCAPED = {b'\xdc': FEND, b'\xdd': FESC}
+KISS_DATA_FRAME = 0x00      # Low nibble of the command byte; the high nibble is the TNC port
+AX25_UI_CONTROL_PID = b'\x03\xf0'  # UI frame, no layer 3: all APRS traffic
+AX25_CALL = re.compile(rb'^[A-Z0-9]{1,6} *$')
+
+class LineFramer:
+    """Split a client's byte stream into CR/LF terminated lines, carrying partial lines across reads."""
+
+    def __init__(self, size=None, max_length=None):
+        self.recv_size = size or recv_size
+        self.recv_buffer = None  # Reused for every recv_into(); only allocated by recv_from(), as feed() needs none
+        self.recv_view = None
+        self.pending = bytearray()  # Bytes of the line still being received
+        self.max_line_length = max_length or max_line_length
+        self.discarding = False  # Skipping the tail of an overlong line
+
+    def recv_from(self, client_socket):
+        """Read from the socket into the reusable buffer and frame it; returns (lines, dropped, nbytes)."""
+        if self.recv_buffer is None:
+            self.recv_buffer = bytearray(self.recv_size)
+            self.recv_view = memoryview(self.recv_buffer)
+        nbytes = client_socket.recv_into(self.recv_buffer)
+        lines, dropped = self.feed(self.recv_view[:nbytes])
+        return lines, dropped, nbytes
+
+    def feed(self, data):
+        """Add received bytes; returns the complete lines and the number of overlong lines dropped."""
+        self.pending += data
+        end = max(self.pending.rfind(b'\n'), self.pending.rfind(b'\r'))
+        if end < 0:
+            if len(self.pending) > self.max_line_length:
+                # Nothing to frame yet and already too long: drop it and skip to the next line break
+                self.pending.clear()
+                dropped = 0 if self.discarding else 1
+                self.discarding = True
+                return [], dropped
+            return [], 0
+
+        chunk = bytes(self.pending[:end + 1])
+        del self.pending[:end + 1]
+        lines = chunk.replace(b'\r', b'\n').split(b'\n')
+        if self.discarding:
+            lines[0] = b''  # Tail of the overlong line
+            self.discarding = False
+
+        dropped = 0
+        complete = []
+        for line in lines:
+            if len(line) > self.max_line_length:
+                dropped += 1
+            elif line:
+                complete.append(line)
+        if len(self.pending) > self.max_line_length:
+            self.pending.clear()
+            self.discarding = True
+            dropped += 1
+        return complete, dropped
+
+    def take_pending(self):
+        """Return and clear any unterminated bytes, e.g. when the connection closes."""
+        remainder = bytes(self.pending)
+        self.pending.clear()
+        discarding, self.discarding = self.discarding, False
+        return b'' if discarding else remainder
+
+def ax25_to_tnc2(frame):
+    """Return an AX.25 UI frame as a TNC2 text line (bytes), e.g. b'N0CALL-9>APRS,WIDE1-1*:!...', or None if it is not one."""
+    addresses = []
+    offset = 0
+    while True:
+        field = frame[offset:offset + 7]
+        if len(field) < 7 or len(addresses) == 10:
+            return None  # Truncated, or more than the destination, source and eight digipeaters
+        call = bytes(byte >> 1 for byte in field[:6])
+        if not AX25_CALL.match(call):
+            return None
+        ssid = (field[6] >> 1) & 0x0F
+        addresses.append((call.rstrip() + (b'-%d' % ssid if ssid else b''), field[6] & 0x80))
+        offset += 7
+        if field[6] & 0x01:  # Last address
+            break
+    if len(addresses) < 2 or frame[offset:offset + 2] != AX25_UI_CONTROL_PID:
+        return None
+
+    destination, source = addresses[0][0], addresses[1][0]
+    digipeaters = addresses[2:]
+    # As TNC2 monitors show it: '*' after the last digipeater that has repeated the frame
+    repeated = max((n for n, (_, has_been_repeated) in enumerate(digipeaters) if has_been_repeated), default=-1)
+    path = b''.join(b',' + call + (b'*' if n == repeated else b'') for n, (call, _) in enumerate(digipeaters))
+    info = frame[offset + 2:].rstrip(b'\r\n').replace(b'\r', b' ').replace(b'\n', b' ')
+    return source + b'>' + destination + path + b':' + info
+
+class KissFramer:
+    """Split a KISS TNC's byte stream into TNC2 text lines, with the same feed() interface as LineFramer.
+
+    Only data frames are decoded; frames that are not AX.25 UI frames, or are too long, are counted
+    as dropped.
+    """
+
+    def __init__(self, max_length=None):
+        self.pending = bytearray()  # Bytes of the frame still being received
+        self.max_frame_length = max_length or max_kiss_frame
+        self.in_frame = False  # False until the first FEND, and while skipping an overlong frame
+
+    def feed(self, data):
+        """Add received bytes; returns the decoded lines and the number of frames dropped."""
+        self.pending += data
+        if self.pending.find(FEND) < 0:
+            if len(self.pending) > self.max_frame_length:
+                self.pending.clear()
+                dropped = 1 if self.in_frame else 0
+                self.in_frame = False
+                return [], dropped
+            return [], 0
+
+        frames = self.pending.split(FEND)
+        self.pending = frames.pop()  # After the last FEND: the frame still being received
+        if not self.in_frame:
+            frames[0] = b''  # Bytes before the stream's first FEND, or the tail of an overlong frame
+        self.in_frame = True
+
+        lines = []
+        dropped = 0
+        for frame in frames:
+            if not frame:
+                continue  # Back to back FENDs between frames
+            if frame[0] & 0x0F != KISS_DATA_FRAME:
+                continue  # A TNC parameter command rather than received data
+            if len(frame) > self.max_frame_length:
+                dropped += 1
+                continue
+            line = ax25_to_tnc2(KISS_ESCAPE.sub(lambda match: KISS_UNESCAPED[match.group(1)], frame[1:]))
+            if line:
+                lines.append(line)
+            else:
+                dropped += 1
+        if len(self.pending) > self.max_frame_length:
+            self.pending.clear()
+            self.in_frame = False
+            dropped += 1
+        return lines, dropped
+
+    def take_pending(self):
+        """Discard an unterminated frame; a KISS frame is only complete at its closing FEND."""
+        self.pending.clear()
+        return b''
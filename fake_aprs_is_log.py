@@ -0,0 +1,794 @@
+"""Helpers shared by the fake-aprs-is tools for writing and reading fake-aprs-is.log."""
+import ctypes
+import ctypes.util
+import fcntl
+import gzip
+import io
+import json
+import os
+import queue
+import re
+import select
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import date, datetime
+
+try:
+    import zstandard
+except ImportError:  # Optional, only needed for --compress zstd
+    zstandard = None
+
+# Sidecar index: one (minute bucket, byte offset) entry for the first line of every new minute
+index_suffix = '.idx'
+INDEX_MAGIC = b'FAI1'
+INDEX_HEADER = struct.Struct('<4sQQQH64s')  # magic, inode, indexed size, entry count, fingerprint length, fingerprint
+INDEX_ENTRY = struct.Struct('<iQ')          # minute bucket, byte offset
+fingerprint_size = 64                       # Leading log bytes used to recognise a replaced log
+bisect_block_size = 64 * 1024               # Binary search stops once the window is this small
+
+# Parsed log lines are (epoch timestamp, source, kind, payload) tuples; the source is a client IP, "Server",
+# or "Console" from the serial collector ("Console:<device>" when it reads several ports)
+PACKET_PREFIX = "Received packet: "
+KIND_PACKET = "packet"    # Payload is the TNC2 packet from a "Received packet: " line
+KIND_CONSOLE = "console"  # Payload is a line heard on the radio console by the serial collector
+KIND_EVENT = "event"      # Payload is the whole message: connections, keepalives, logins...
+QA_PATTERN = re.compile(r",qA[OR],[^:]+:")  # qAR/qAO iGate part of a relayed packet's path
+
+# Writer defaults
+log_batch_size = 256        # Write a batch once this many entries are queued...
+log_flush_interval = 0.1    # ...or once the oldest queued entry is this many seconds old
+
+# LogFollower: appended data is read this many bytes at a time
+follow_block_size = 256 * 1024
+follow_poll_interval = 0.1   # Seconds between checks where inotify is unavailable
+follow_check_interval = 30   # With inotify, re-check the log this often anyway, in case an event was missed
+
+# inotify(7) constants, for LogFollower
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, name length; the name follows
+
+# Closed segments sit next to the live log as <name>-<start>.log[.gz|.zst], listed in <name>.manifest.json
+compressed_suffixes = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+
+def minute_key(timestamp):
+    """Return minutes since 0001-01-01 for a log timestamp string or a datetime, ignoring time zones."""
+    if isinstance(timestamp, (str, bytes)):
+        if isinstance(timestamp, bytes):
+            timestamp = timestamp.decode('ascii')
+        days = date(int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10])).toordinal()
+        return days * 1440 + int(timestamp[11:13]) * 60 + int(timestamp[14:16])
+    return timestamp.toordinal() * 1440 + timestamp.hour * 60 + timestamp.minute
+
+def line_minute_key(line):
+    """Return the minute bucket of a raw log line, or None if it does not start with a timestamp."""
+    if len(line) < 16 or line[4:5] != b'-' or line[10:11] != b'T':
+        return None
+    try:
+        return minute_key(line[:16])
+    except ValueError:
+        return None
+
+def iter_records(lines):
+    """Yield (timestamp, source, kind, payload) for every well-formed line of a file or line iterator."""
+    # Kept as one flat loop with plain tuples: this runs once per log line in every tool
+    from_iso = datetime.fromisoformat
+    prefix_length = len(PACKET_PREFIX)
+    for line in lines:
+        timestamp, separator, rest = line.partition(' - ')
+        source, separator, message = rest.partition(' - ')
+        if not separator:
+            continue
+        try:
+            epoch = from_iso(timestamp).timestamp()
+        except ValueError:
+            continue
+        if message.startswith(PACKET_PREFIX):
+            yield (epoch, source, KIND_PACKET, message[prefix_length:].strip())
+        elif source.startswith("Console"):
+            yield (epoch, source, KIND_CONSOLE, message.strip())
+        else:
+            yield (epoch, source, KIND_EVENT, message.strip())
+
+def iter_packet_lines(lines):
+    """Yield (line, timestamp, source, packet) for the "Received packet: " lines of a file or line iterator.
+
+    Other lines are skipped before their timestamp is parsed, for readers that only want packets.
+    """
+    from_iso = datetime.fromisoformat
+    prefix_length = len(PACKET_PREFIX)
+    for line in lines:
+        timestamp, separator, rest = line.partition(' - ')
+        source, separator, message = rest.partition(' - ')
+        if not separator or not message.startswith(PACKET_PREFIX):
+            continue
+        try:
+            epoch = from_iso(timestamp).timestamp()
+        except ValueError:
+            continue
+        yield (line, epoch, source, message[prefix_length:].strip())
+
+def parse_log_line(line):
+    """Return (timestamp, source, kind, payload) for a single log line, or None if it is not one."""
+    for record in iter_records((line,)):
+        return record
+    return None
+
+def normalize_packet(packet):
+    """Remove the `qAR`/`qAO` iGate part of the path, so copies relayed by different iGates compare equal."""
+    return QA_PATTERN.sub(":", packet).strip()
+
+def read_fingerprint(log_file):
+    """Return the leading bytes of a binary log file, which stay the same while the log is only appended to."""
+    log_file.seek(0)
+    return log_file.read(fingerprint_size)
+
+class LogIndex:
+    """Minute-bucket to byte-offset index kept next to a log file and extended as the log grows."""
+
+    def __init__(self, log_path, index_path=None):
+        self.log_path = log_path
+        self.index_path = index_path or log_path + index_suffix
+        self.buckets = []
+        self.offsets = []
+
+    def _load(self, stat, fingerprint):
+        """Load a still-valid index; returns the log size it covers, or None if it must be rebuilt."""
+        try:
+            with open(self.index_path, 'rb') as index_file:
+                header = index_file.read(INDEX_HEADER.size)
+                if len(header) < INDEX_HEADER.size:
+                    return None
+                magic, inode, indexed_size, count, fp_len, fp = INDEX_HEADER.unpack(header)
+                if magic != INDEX_MAGIC or inode != stat.st_ino or indexed_size > stat.st_size:
+                    return None  # Different, rotated or truncated log
+                if fp[:fp_len] != fingerprint[:fp_len]:
+                    return None
+                data = index_file.read(count * INDEX_ENTRY.size)
+                if len(data) < count * INDEX_ENTRY.size:
+                    return None
+        except FileNotFoundError:
+            return None
+
+        self.buckets = []
+        self.offsets = []
+        for bucket, offset in INDEX_ENTRY.iter_unpack(data):
+            self.buckets.append(bucket)
+            self.offsets.append(offset)
+        return indexed_size
+
+    def update(self):
+        """Bring the index up to date with the log, rebuilding it if the log was replaced or truncated."""
+        with open(self.log_path, 'rb') as log_file:
+            stat = os.fstat(log_file.fileno())
+            fingerprint = read_fingerprint(log_file)
+            indexed_size = self._load(stat, fingerprint)
+
+            # Repair check: the last indexed offset must still hold a line from that minute
+            if indexed_size is not None and self.offsets:
+                log_file.seek(self.offsets[-1])
+                if line_minute_key(log_file.readline()) != self.buckets[-1]:
+                    indexed_size = None
+
+            if indexed_size is None:
+                indexed_size = 0
+                self.buckets = []
+                self.offsets = []
+                with open(self.index_path, 'wb'):
+                    pass
+            first_new = len(self.buckets)
+
+            # Index complete lines appended since the last update
+            offset = indexed_size
+            last_bucket = self.buckets[-1] if self.buckets else None
+            last_prefix = None
+            log_file.seek(offset)
+            for line in log_file:
+                if not line.endswith(b'\n'):
+                    break  # Still being written
+                prefix = line[:16]
+                if prefix != last_prefix:
+                    last_prefix = prefix
+                    bucket = line_minute_key(line)
+                    if bucket is not None and (last_bucket is None or bucket > last_bucket):
+                        self.buckets.append(bucket)
+                        self.offsets.append(offset)
+                        last_bucket = bucket
+                offset += len(line)
+
+        with open(self.index_path, 'r+b') as index_file:
+            index_file.seek(INDEX_HEADER.size + first_new * INDEX_ENTRY.size)
+            index_file.write(b''.join(
+                INDEX_ENTRY.pack(bucket, offset)
+                for bucket, offset in zip(self.buckets[first_new:], self.offsets[first_new:])
+            ))
+            # The header goes last so an interrupted update leaves the previous index valid
+            index_file.seek(0)
+            index_file.write(INDEX_HEADER.pack(
+                INDEX_MAGIC, stat.st_ino, offset, len(self.buckets), len(fingerprint), fingerprint
+            ))
+
+    def offset_for(self, since):
+        """Return a line offset before which every line is older than the minute of `since`."""
+        position = bisect_left(self.buckets, minute_key(since))
+        return self.offsets[position - 1] if position > 0 else 0
+
+def bisect_log_offset(log_file, since):
+    """Binary search an open binary log for a line offset before which every line is older than `since`."""
+    target = minute_key(since)
+    log_file.seek(0, 2)
+    low, high = 0, log_file.tell()
+    while high - low > bisect_block_size:
+        middle = (low + high) // 2
+        log_file.seek(middle)
+        log_file.readline()  # Skip to the start of the next line
+        position = log_file.tell()
+        bucket = None
+        while bucket is None and position < high:
+            line = log_file.readline()
+            if not line:
+                break
+            bucket = line_minute_key(line)
+            if bucket is None:
+                position = log_file.tell()
+        if bucket is None or position >= high:
+            high = middle
+        elif bucket < target:
+            low = position
+        else:
+            high = position
+    return low
+
+def find_start_offset(log_path, since, use_index=True):
+    """Return the byte offset to start reading `log_path` from to see every line at or after `since`."""
+    if since is None:
+        return 0
+    if use_index:
+        index = LogIndex(log_path)
+        try:
+            index.update()
+            return index.offset_for(since)
+        except OSError:
+            pass  # Index not writable here, fall back to searching the log itself
+    with open(log_path, 'rb') as log_file:
+        return bisect_log_offset(log_file, since)
+
+def open_log_since(log_path, since=None, use_index=True):
+    """Open the log as text positioned at the first line that can be at or after `since`."""
+    offset = find_start_offset(log_path, since, use_index)
+    log_file = open(log_path, 'rb')
+    log_file.seek(offset)
+    return io.TextIOWrapper(log_file, encoding='utf-8', errors='replace')
+
+@contextmanager
+def _log_lock(log_path):
+    """Hold an exclusive lock shared by every process that rotates or lists segments of this log."""
+    with open(log_path + '.lock', 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def manifest_path(log_path):
+    return os.path.splitext(log_path)[0] + '.manifest.json'
+
+def load_manifest(log_path):
+    """Return the closed segments of a log, oldest first, as dicts with file, start and end."""
+    try:
+        with open(manifest_path(log_path), 'r') as manifest_file:
+            return json.load(manifest_file)["segments"]
+    except FileNotFoundError:
+        return []
+
+def _save_manifest(log_path, segments):
+    temp_path = manifest_path(log_path) + '.tmp'
+    with open(temp_path, 'w') as manifest_file:
+        json.dump({"segments": segments}, manifest_file, indent=1)
+    os.replace(temp_path, manifest_path(log_path))
+
+def _line_timestamp(line):
+    return line.split(' - ', 1)[0].strip()
+
+def _is_timestamp(text):
+    try:
+        datetime.fromisoformat(text)
+    except ValueError:
+        return False
+    return True
+
+def _first_last_timestamps(path):
+    """Return the timestamp strings of the first and last timestamped lines of an uncompressed log file, or None if it has none."""
+    with open(path, 'r', encoding='utf-8', errors='replace') as log_file:
+        first = next((timestamp for timestamp in map(_line_timestamp, log_file) if _is_timestamp(timestamp)), None)
+        if first is None:
+            return None
+        log_file.seek(0, 2)
+        size = log_file.tell()
+        log_file.seek(max(0, size - 4096))
+        tail = log_file.read().split('\n')[0 if size <= 4096 else 1:]  # Without the partial first line
+    last = next((timestamp for timestamp in map(_line_timestamp, reversed(tail)) if _is_timestamp(timestamp)), first)
+    return first, last
+
+def rotate_log(log_path):
+    """Move the live log aside as a closed segment and record it in the manifest; call with the lock held.
+
+    A log without a single timestamped line could not be placed in the manifest; it is left as it is,
+    to be rotated once timestamped lines follow, and None is returned.
+    """
+    timestamps = _first_last_timestamps(log_path)
+    if timestamps is None:
+        return None
+    first, last = timestamps
+    stem = os.path.splitext(log_path)[0]
+    segment_path = f"{stem}-{first[:19].replace('-', '').replace(':', '')}.log"
+    suffix = 1
+    while any(os.path.exists(segment_path[:-4] + (f"-{suffix}" if suffix > 1 else "") + ".log" + ext)
+              for ext in compressed_suffixes.values()):
+        suffix += 1
+    if suffix > 1:
+        segment_path = segment_path[:-4] + f"-{suffix}.log"
+
+    os.rename(log_path, segment_path)
+    segments = load_manifest(log_path)
+    segments.append({"file": os.path.basename(segment_path), "start": first, "end": last})
+    _save_manifest(log_path, segments)
+    return segment_path
+
+def compress_segment(log_path, segment_path, compression):
+    """Compress a closed segment, point the manifest at the compressed file and remove the original."""
+    compressed_path = segment_path + compressed_suffixes[compression]
+    with open(segment_path, 'rb') as source:
+        # A temp file of its own, as several writers may compress the same leftover segment; the last
+        # os.replace() wins, and they all wrote the same contents
+        fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(compressed_path) + '.', suffix='.tmp',
+                                         dir=os.path.dirname(segment_path) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                if compression == "zstd":
+                    with zstandard.open(temp_file, 'wb') as target:
+                        shutil.copyfileobj(source, target, 1024 * 1024)
+                else:
+                    with gzip.open(temp_file, 'wb') as target:
+                        shutil.copyfileobj(source, target, 1024 * 1024)
+            os.replace(temp_path, compressed_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    with _log_lock(log_path):
+        segments = load_manifest(log_path)
+        for segment in segments:
+            if segment["file"] == os.path.basename(segment_path):
+                segment["file"] = os.path.basename(compressed_path)
+        _save_manifest(log_path, segments)
+    try:
+        os.remove(segment_path)
+    except FileNotFoundError:
+        pass  # Another writer compressing it too got there first
+
+class LogWriter:
+    """Single writer thread that keeps the log file open, appends queued entries in batches and rotates segments."""
+
+    def __init__(self, path, batch_size=log_batch_size, flush_interval=log_flush_interval,
+                 fsync_policy="none", fsync_interval=1.0, rotate="none", rotate_size=0, compression="gzip"):
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstd compression needs the 'zstandard' package")
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy  # "none", "batch" or "interval"
+        self.fsync_interval = fsync_interval
+        self.rotate = rotate              # "none", "hourly" or "daily"
+        self.rotate_size = rotate_size    # Also rotate once the live log reaches this many bytes (0 = never)
+        self.compression = compression    # "gzip", "zstd" or "none" for closed segments
+        self.inode = None
+        self.segment_period = None        # Period of the first line in the live log
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, log_entry):
+        """Queue a log entry; safe to call from any thread or the event loop."""
+        self.queue.put(log_entry)
+
+    def close(self):
+        """Write out everything still queued and stop the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _next_batch(self):
+        """Block for one entry, then gather more until the batch is full or the flush interval passes."""
+        batch = []
+        entry = self.queue.get()
+        if entry is None:
+            return batch, True
+        batch.append(entry)
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                entry = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    def _period(self, log_entry):
+        """Return the rotation period a log entry belongs to, e.g. '2024-11-01T13' for hourly."""
+        if self.rotate == "hourly":
+            return log_entry[:13]
+        if self.rotate == "daily":
+            return log_entry[:10]
+        return None
+
+    def _open(self):
+        log_file = open(self.path, 'a', buffering=1024 * 1024)
+        self.inode = os.fstat(log_file.fileno()).st_ino
+        with open(self.path, 'r', encoding='utf-8', errors='replace') as reader:
+            first_line = reader.readline()
+        self.segment_period = self._period(first_line) if first_line else None
+        return log_file
+
+    def _rotation_due(self, log_file, first_entry):
+        if self.segment_period is not None and self._period(first_entry) != self.segment_period:
+            return True
+        return bool(self.rotate_size) and log_file.tell() >= self.rotate_size
+
+    def _maybe_rotate(self, log_file, first_entry):
+        """Return the file to write the next batch to, rotating the live log first if its segment is complete."""
+        # Another writer (e.g. the serial collector) may have rotated the shared log already
+        try:
+            rotated_elsewhere = os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            rotated_elsewhere = True
+        if not rotated_elsewhere and not self._rotation_due(log_file, first_entry):
+            return log_file
+
+        log_file.close()
+        segment_path = None
+        with _log_lock(self.path):
+            try:
+                still_ours = os.stat(self.path).st_ino == self.inode
+            except FileNotFoundError:
+                still_ours = False
+            if still_ours and not rotated_elsewhere:
+                segment_path = rotate_log(self.path)
+        if segment_path and self.compression != "none":
+            threading.Thread(
+                target=compress_segment, args=(self.path, segment_path, self.compression),
+                name="log-compress", daemon=True
+            ).start()
+        return self._open()
+
+    def _compress_leftovers(self):
+        """Compress closed segments left uncompressed by an earlier run that stopped mid-compression."""
+        log_dir = os.path.dirname(self.path)
+        for segment in load_manifest(self.path):
+            if segment["file"].endswith('.log'):
+                segment_path = os.path.join(log_dir, segment["file"])
+                try:
+                    compress_segment(self.path, segment_path, self.compression)
+                except FileNotFoundError:
+                    pass  # Already compressed by another writer
+
+    def _run(self):
+        if self.compression != "none":
+            self._compress_leftovers()
+        last_fsync = time.monotonic()
+        log_file = self._open()
+        try:
+            while True:
+                batch, stopping = self._next_batch()
+                if batch:
+                    if self.rotate != "none" or self.rotate_size:
+                        log_file = self._maybe_rotate(log_file, batch[0])
+                    if self.segment_period is None:
+                        self.segment_period = self._period(batch[0])
+                    log_file.write("\n".join(batch) + "\n")
+                    log_file.flush()  # Hand the batch to the OS so tailing tools see it promptly
+
+                    if self.fsync_policy == "batch":
+                        os.fsync(log_file.fileno())
+                    elif self.fsync_policy == "interval" and time.monotonic() - last_fsync >= self.fsync_interval:
+                        os.fsync(log_file.fileno())
+                        last_fsync = time.monotonic()
+                if stopping:
+                    if self.fsync_policy != "none":
+                        os.fsync(log_file.fileno())
+                    return
+        finally:
+            log_file.close()
+
+def add_log_writer_arguments(parser):
+    """Add the batching, fsync and rotation options shared by the collectors."""
+    parser.add_argument("--log-batch-size", type=int, default=log_batch_size, help="Maximum number of log entries written per batch")
+    parser.add_argument("--log-flush-ms", type=int, default=int(log_flush_interval * 1000), help="Maximum time in milliseconds an entry waits before its batch is written")
+    parser.add_argument(
+        "--fsync", choices=["none", "batch", "interval"], default="none",
+        help="When to fsync the log: never (leave it to the OS), after every batch, or every --fsync-ms milliseconds"
+    )
+    parser.add_argument("--fsync-ms", type=int, default=1000, help="Interval in milliseconds for --fsync interval")
+    parser.add_argument(
+        "--rotate", choices=["none", "hourly", "daily"], default="none",
+        help="Close the live log as a time-bounded segment every hour or day"
+    )
+    parser.add_argument("--rotate-size-mb", type=int, default=0, help="Also close the live log once it reaches this size in MB (0 = no limit)")
+    parser.add_argument(
+        "--compress", choices=["gzip", "zstd", "none"], default="gzip",
+        help="Compression for closed segments (zstd needs the 'zstandard' package)"
+    )
+
+def log_writer_from_args(path, args):
+    """Start a LogWriter for `path` configured from add_log_writer_arguments() options."""
+    return LogWriter(
+        path,
+        batch_size=args.log_batch_size,
+        flush_interval=args.log_flush_ms / 1000,
+        fsync_policy=args.fsync,
+        fsync_interval=args.fsync_ms / 1000,
+        rotate=args.rotate,
+        rotate_size=args.rotate_size_mb * 1024 * 1024,
+        compression=args.compress,
+    )
+
+def log_replaced(fd, log_path, position):
+    """Return True if the log at log_path is no longer the file open as `fd`, or was truncated below `position`."""
+    try:
+        stat = os.stat(log_path)
+    except FileNotFoundError:
+        return False  # Mid-rotation; keep reading the old file until the new one appears
+    return stat.st_ino != os.fstat(fd).st_ino or stat.st_size < position
+
+def line_start_before(fd, end, block_size=follow_block_size):
+    """Return the offset just after the last newline before `end` in an open file, or 0 if there is none."""
+    while end > 0:
+        start = max(0, end - block_size)
+        newline = os.pread(fd, end - start, start).rfind(b'\n')
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return 0
+
+def iter_lines_backward(fd, end, block_size=follow_block_size):
+    """Yield the lines of an open file before offset `end`, newest first, reading blocks backwards."""
+    remainder = b''
+    position = end
+    while position > 0:
+        start = max(0, position - block_size)
+        lines = (os.pread(fd, position - start, start) + remainder).split(b'\n')
+        position = start
+        remainder = lines[0]  # May continue in the block before
+        for line in reversed(lines[1:]):
+            if line:
+                yield line.decode('utf-8', errors='replace')
+    if remainder:
+        yield remainder.decode('utf-8', errors='replace')
+
+def _inotify_watch(directory):
+    """Return a non-blocking inotify descriptor watching a directory's files, or None where inotify is unavailable."""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+class LogFollower:
+    """Follow a log as it is appended to, like `tail -F`, yielding batches of complete lines.
+
+    Sleeps on inotify events for the log's directory on Linux and polls elsewhere. Appended data is
+    read in blocks and split in bulk; a line still being written is held back until it is complete.
+    The log is reopened from the start when it is rotated away (its inode changes) or truncated,
+    after the rest of the old file has been read.
+    """
+
+    def __init__(self, log_path, offset=None, block_size=follow_block_size, poll_interval=follow_poll_interval):
+        self.log_path = log_path
+        self.name = os.fsencode(os.path.basename(log_path))
+        self.block_size = block_size
+        self.poll_interval = poll_interval
+        # Watch before opening, so nothing written in between goes unnoticed
+        self.inotify_fd = _inotify_watch(os.path.dirname(log_path) or '.')
+        self.fd = None
+        self.offset = 0        # Offset in the current file just past the last complete line returned
+        self.partial = b''     # Start of a line whose newline has not been written yet
+        self.reopened = 0      # Times the log was found rotated or truncated
+        self._open(offset)
+
+    def _open(self, offset=None):
+        """Open the log at `offset`, or at the start of its last line if None; False if it does not exist."""
+        try:
+            fd = os.open(self.log_path, os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = fd
+        if offset is None:
+            offset = line_start_before(fd, os.fstat(fd).st_size)
+        self.offset = offset
+        self.partial = b''
+        os.lseek(fd, offset, os.SEEK_SET)
+        return True
+
+    def read_lines(self):
+        """Return the complete lines appended since the last call, at most about one block."""
+        if self.fd is None:
+            return []
+        while True:
+            data = os.read(self.fd, self.block_size)
+            if not data:
+                return []
+            head, newline, self.partial = (self.partial + data).rpartition(b'\n')
+            if newline:
+                self.offset += len(head) + 1
+                return head.decode('utf-8', errors='replace').split('\n')
+            # Only part of a line so far; keep reading
+
+    def replaced(self):
+        """Return True if the log at log_path is no longer the file being read, or was truncated."""
+        if self.fd is None:
+            return os.path.exists(self.log_path)
+        return log_replaced(self.fd, self.log_path, self.offset + len(self.partial))
+
+    def wait(self, timeout=follow_check_interval):
+        """Block until the log's directory reports a change to the log, or `timeout` seconds pass."""
+        if self.inotify_fd is None:
+            time.sleep(self.poll_interval)
+            return
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not select.select([self.inotify_fd], [], [], remaining)[0]:
+                return
+            try:
+                events = os.read(self.inotify_fd, 64 * 1024)
+            except BlockingIOError:
+                continue
+            position = 0
+            while position < len(events):
+                _, mask, _, length = INOTIFY_EVENT.unpack_from(events, position)
+                name = events[position + INOTIFY_EVENT.size:position + INOTIFY_EVENT.size + length].rstrip(b'\0')
+                position += INOTIFY_EVENT.size + length
+                if name == self.name or mask & IN_Q_OVERFLOW:
+                    return
+            # Only other files in the directory changed (segments, indexes); keep waiting
+
+    def batches(self):
+        """Yield lists of complete lines (without newlines) as they are appended, forever."""
+        while True:
+            lines = self.read_lines()
+            if lines:
+                yield lines
+            elif self.replaced():
+                # Lines may have landed in the old file between reaching its end and the rotation
+                lines = self.read_lines()
+                while lines:
+                    yield lines
+                    lines = self.read_lines()
+                if self._open(0):
+                    self.reopened += 1
+            else:
+                self.wait()
+
+    def close(self):
+        for fd in (self.fd, self.inotify_fd):
+            if fd is not None:
+                os.close(fd)
+        self.fd = self.inotify_fd = None
+
+def _open_segment(segment_path, binary=False):
+    """Open a closed segment as text (or bytes), following it if it was compressed after the manifest was read."""
+    text = {} if binary else {"encoding": 'utf-8', "errors": 'replace'}
+    for path in [segment_path] + [segment_path + suffix for suffix in (".gz", ".zst")]:
+        try:
+            if path.endswith('.gz'):
+                return gzip.open(path, 'rb' if binary else 'rt', **text)
+            if path.endswith('.zst'):
+                if zstandard is None:
+                    raise RuntimeError(f"{path} is zstd-compressed; install the 'zstandard' package to read it")
+                return zstandard.open(path, 'rb' if binary else 'rt', **text)
+            return open(path, 'rb' if binary else 'r', **text)
+        except FileNotFoundError:
+            continue
+    return None
+
+def read_log_start(log_file):
+    """Return the timestamp of a binary log file's first line, which rotate_log() records as its segment's start."""
+    return _line_timestamp(read_fingerprint(log_file).decode('utf-8', errors='replace'))
+
+def iter_rotated_lines(log_path, start, offset):
+    """Return an iterator over the lines after byte `offset` of the live log that began at `start` and has
+    since been rotated, followed by the lines of every later closed segment; None if no segment began at `start`.
+    """
+    segments = load_manifest(log_path)
+    for index in range(len(segments) - 1, -1, -1):
+        if segments[index]["start"] == start:
+            return _iter_segments_from(log_path, segments[index:], offset)
+    return None
+
+def _iter_segments_from(log_path, segments, offset):
+    log_dir = os.path.dirname(log_path)
+    first = _open_segment(os.path.join(log_dir, segments[0]["file"]), binary=True)
+    if first is not None:
+        with first:
+            first.seek(offset)  # Forward seeks also work on the decompressing readers
+            for line in first:
+                yield line.decode('utf-8', errors='replace')
+    for segment in segments[1:]:
+        segment_file = _open_segment(os.path.join(log_dir, segment["file"]))
+        if segment_file is not None:
+            with segment_file:
+                yield from segment_file
+
+def iter_segment_lines(log_path, since=None):
+    """Yield the lines of every closed segment that can hold entries at or after `since`."""
+    log_dir = os.path.dirname(log_path)
+    for segment in load_manifest(log_path):
+        if since is not None and datetime.fromisoformat(segment["end"]) < since:
+            continue  # Entirely older than the requested window
+        segment_file = _open_segment(os.path.join(log_dir, segment["file"]))
+        if segment_file is None:
+            continue
+        with segment_file:
+            yield from segment_file
+
+def iter_log_lines_backward(log_path, fd, end):
+    """Yield lines newest first: the live log, open as `fd`, before offset `end`, then the closed segments.
+
+    Uncompressed segments are read backwards too; a compressed one is decompressed whole, and only
+    once the lines after it have all been consumed.
+    """
+    yield from iter_lines_backward(fd, end)
+    log_dir = os.path.dirname(log_path)
+    for segment in reversed(load_manifest(log_path)):
+        segment_path = os.path.join(log_dir, segment["file"])
+        if not segment_path.endswith((".gz", ".zst")):
+            try:
+                segment_fd = os.open(segment_path, os.O_RDONLY)
+            except FileNotFoundError:
+                pass  # Compressed since the manifest was read
+            else:
+                try:
+                    yield from iter_lines_backward(segment_fd, os.fstat(segment_fd).st_size)
+                finally:
+                    os.close(segment_fd)
+                continue
+        segment_file = _open_segment(segment_path)
+        if segment_file is None:
+            continue
+        with segment_file:
+            lines = segment_file.read().split('\n')
+        yield from (line for line in reversed(lines) if line)
+
+def iter_log_lines(log_path, since=None, use_index=True):
+    """Yield the lines of every closed segment and the live log that can hold entries at or after `since`."""
+    yield from iter_segment_lines(log_path, since)
+    if os.path.exists(log_path):
+        with open_log_since(log_path, since, use_index) as log_file:
+            yield from log_file
@@ -0,0 +1,84 @@
+"""SQLite store of decoded packets, filled by fake-aprs-is-decoder.py --db and read by the decoder and web map."""
+import sqlite3
+
+store_batch_size = 1000  # Rows inserted per transaction while ingesting
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packets (
+    id INTEGER PRIMARY KEY,    -- Ingest order, i.e. log order
+    epoch REAL NOT NULL,       -- Log timestamp
+    source TEXT NOT NULL,      -- Client IP the packet came from
+    from_call TEXT,
+    to_call TEXT,
+    type TEXT,                 -- Type inferred by the decoder, NULL if none
+    lat REAL,
+    lon REAL,
+    raw TEXT NOT NULL,
+    logline TEXT NOT NULL,
+    fields TEXT NOT NULL,      -- json.dumps() of the decoded packet, as the decoder searches it
+    UNIQUE (epoch, source, raw)
+);
+CREATE INDEX IF NOT EXISTS packets_epoch ON packets (epoch);
+CREATE INDEX IF NOT EXISTS packets_from_call ON packets (from_call, epoch);
+CREATE INDEX IF NOT EXISTS packets_type ON packets (type, epoch);
+"""
+
+class PacketStore:
+    """Decoded packets in a local SQLite database, indexed on time, callsign and type."""
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")  # Readers don't block the ingest
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def last_epoch(self):
+        """Return the timestamp of the newest stored packet, or None if the store is empty."""
+        return self.connection.execute("SELECT max(epoch) FROM packets").fetchone()[0]
+
+    def add(self, rows):
+        """Insert (epoch, source, from_call, to_call, type, lat, lon, raw, logline, fields) rows.
+
+        Rows already stored are skipped, so ingesting overlapping ranges of the log is harmless.
+        Returns the number of rows added.
+        """
+        changes = self.connection.total_changes
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO packets (epoch, source, from_call, to_call, type, lat, lon, raw, logline, fields) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        return self.connection.total_changes - changes
+
+    def query(self, since=None, packet_type=None, search_term=None, callsign=None):
+        """Yield (logline, fields) of matching packets in log order; search is case-insensitive over the fields JSON."""
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append("epoch >= ?")
+            params.append(since)
+        if packet_type:
+            conditions.append("type = ?")
+            params.append(packet_type)
+        if callsign:
+            conditions.append("from_call = ?")
+            params.append(callsign)
+        if search_term:
+            # The JSON is ASCII (non-ASCII is escaped), where SQLite's lower() matches str.lower()
+            conditions.append("instr(lower(fields), ?) > 0")
+            params.append(search_term.lower())
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        yield from self.connection.execute(f"SELECT logline, fields FROM packets {where} ORDER BY id", params)
+
+    def recent_positions(self, limit):
+        """Return up to `limit` of the newest packets with a position as (epoch, from_call, lat, lon, raw), oldest first."""
+        rows = self.connection.execute(
+            "SELECT epoch, from_call, lat, lon, raw FROM packets WHERE lat IS NOT NULL AND lon IS NOT NULL ORDER BY id DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        rows.reverse()
+        return rows